@@ -1,34 +1,132 @@
+import importlib
+import signal
 import sys
-import jack
 import threading
-from lib.jack.timebase_master import PyJackTimebaseMaster
-from lib.jack.timebase_client import PyJackTimebaseClient
-from lib.parser import args
+from lib.parser import parse_args
+from lib.stats import CallbackStats, StatsServer
+from lib.telemetry import PositionSnapshot, TelemetryQueue, TelemetryReporter, open_output
+
+# module and class of each mode. Only the selected mode is imported, so e.g. the master does
+# not load the client's beat model or MIDI modules.
+MODES = {
+    'master': ('lib.jack.timebase_master', 'PyJackTimebaseMaster'),
+    'client': ('lib.jack.timebase_client', 'PyJackTimebaseClient'),
+    'record': ('lib.jack.trace', 'TransportRecorder'),
+}
+
+
+def load_mode(mode):
+    module, name = MODES[mode]
+    return getattr(importlib.import_module(module), name)
 
 
 def main(config):
-    client = jack.Client(config['name'])
-    shutdownevent = threading.Event()
-    config['type'](client, shutdownevent)
-    with client:
-        try:
-            shutdownevent.wait()
-        except Exception as e:
-            print(e.with_traceback(e.__traceback__))
-            sys.exit(0)
+    # imported here so that JACK is only loaded by the modes that connect to it.
+    from lib.supervisor import Supervisor
+    stopevent = threading.Event()
+    telemetry = TelemetryQueue()
+    output = open_output(config['telemetry'])
+    reporter = TelemetryReporter(telemetry, output, config['telemetry_rate'])
+    stats = CallbackStats()
+    # the supervisor hands the stats server each client it connects.
+    stats_server = StatsServer(stats, None, output or sys.stderr, config.get('stats_socket'),
+                               config['telemetry_rate'])
+    signal.signal(signal.SIGUSR1, stats_server.request_dump)
+    options = dict(config.get('options', {}))
+    options['telemetry'] = telemetry
+    publisher = None
+    if config.get('publish'):
+        from lib.shared_state import SharedStatePublisher
+        publisher = SharedStatePublisher(config['publish'], config['publish_beats'])
+        options['publisher'] = publisher
+    view = None
+    if config.get('ui'):
+        # imported here so that urwid is only needed for the display.
+        from lib.urwid.position import PositionView
+        options['snapshot'] = PositionSnapshot()
+        view = PositionView(options['snapshot'], stats, stopevent, config['ui_rate'],
+                            config['name'])
+    control_server = None
+    if config.get('control'):
+        from lib.jack.control import ControlBuffer
+        from lib.jack.control_server import ControlServer
+        options['control'] = ControlBuffer()
+        control_server = ControlServer(options['control'], config['control'])
+    supervisor = Supervisor(config['name'], load_mode(config['mode']), options, stats, stopevent,
+                            daemon=config.get('daemon', False),
+                            backoff=config.get('backoff', 0.5),
+                            max_backoff=config.get('max_backoff', 30.0),
+                            stats_server=stats_server,
+                            checkpoint_interval=config.get('checkpoint_interval', 5.0))
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    reporter.start()
+    stats_server.start()
+    if control_server is not None:
+        control_server.start()
+    try:
+        if view is not None:
+            # the display runs on the main thread; it ends when the supervisor sets the stop
+            # event, and sets it on quit.
+            thread = threading.Thread(target=supervisor.run, name='jacktime-supervisor',
+                                      daemon=True)
+            thread.start()
+            view.run()
+            supervisor.stop()
+            thread.join()
+        else:
+            supervisor.run()
+    except KeyboardInterrupt:
+        supervisor.stop()
+    finally:
+        reporter.stop()
+        stats_server.stop()
+        if control_server is not None:
+            control_server.stop()
+        if publisher is not None:
+            publisher.close()
 
 if __name__ == "__main__":
-    config = {}
+    args = parse_args()
+    if getattr(args, 'analyze', None):
+        from lib.jack.trace_analysis import analyze, load_trace, report
+        print(report(analyze(*load_trace(args.analyze)), args.repositions))
+        sys.exit(0)
+    config = {'telemetry': args.telemetry or ('none' if args.ui else 'stdout'),
+              'telemetry_rate': args.telemetry_rate,
+              'stats_socket': args.stats_socket,
+              'ui': args.ui,
+              'ui_rate': args.ui_rate,
+              'daemon': getattr(args, 'daemon', False),
+              'backoff': getattr(args, 'backoff', 0.5),
+              'max_backoff': getattr(args, 'max_backoff', 30.0)}
     try:
         if args.master:
             config['name'] = 'jacktime_master'
-            config['type'] = PyJackTimebaseMaster
+            config['mode'] = 'master'
+            config['options'] = {'time_signature': args.time_signature}
+            config['control'] = args.control
     except AttributeError:
         pass
     try:
         if args.client:
             config['name'] = 'jacktime_client'
-            config['type'] = PyJackTimebaseClient
+            config['mode'] = 'client'
+            config['options'] = {'beat_retention': args.beat_retention,
+                                 'midi_clock': args.midi_clock,
+                                 'beat_note': args.beat_note,
+                                 'bar_note': args.bar_note,
+                                 'midi_channel': args.midi_channel,
+                                 'checkpoint': args.checkpoint}
+            config['checkpoint_interval'] = args.checkpoint_interval
+            config['publish'] = args.publish
+            config['publish_beats'] = args.publish_beats
+    except AttributeError:
+        pass
+    try:
+        if args.record:
+            config['name'] = 'jacktime_record'
+            config['mode'] = 'record'
+            config['options'] = {'trace': args.trace, 'hours': args.trace_hours}
     except AttributeError:
         pass
-    main(config)
\ No newline at end of file
+    main(config)
@@ -0,0 +1,153 @@
+"""
+Offline benchmarks of the jacktime callbacks, driven by lib.jack.simulator.FakeClient.
+
+Run with: python -m lib.bench [suite ...]
+"""
+import time
+import tracemalloc
+from contextlib import contextmanager
+import jack
+
+# blocksizes benchmarked, from the smallest to the largest JACK allows.
+BLOCKSIZES = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def percentile(sorted_samples, p):
+    """
+    Returns the p-th percentile of sorted samples by the nearest-rank method.
+    """
+    if not sorted_samples:
+        return 0
+    rank = max(int(round(p / 100.0 * len(sorted_samples) + 0.5)) - 1, 0)
+    return sorted_samples[min(rank, len(sorted_samples) - 1)]
+
+
+class CallbackTimer(object):
+    """
+    Wraps a callback to record the duration of each call in nanoseconds.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        self.samples = []
+
+    def __call__(self, *args):
+        start = time.perf_counter_ns()
+        result = self.callback(*args)
+        self.samples.append(time.perf_counter_ns() - start)
+        return result
+
+    def percentiles_usecs(self):
+        samples = sorted(self.samples)
+        return [percentile(samples, p) / 1000.0 for p in PERCENTILES] + [samples[-1] / 1000.0]
+
+
+def _noop(*args):
+    pass
+
+
+class CountingFFI(object):
+    """
+    Stands in for jack._ffi while allocations are traced, counting the C structs allocated with
+    new. cffi allocates them with malloc, which tracemalloc does not see.
+    """
+    def __init__(self, ffi):
+        self.ffi = ffi
+        self.news = 0
+
+    def new(self, *args, **kwargs):
+        self.news += 1
+        return self.ffi.new(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.ffi, name)
+
+
+@contextmanager
+def tracing_allocations():
+    """
+    Traces Python allocations with tracemalloc and counts cffi allocations through jack._ffi
+    while the block runs, for CallbackAllocations. Allocations made in C outside cffi, e.g. by
+    libjack, are not seen.
+    """
+    ffi = jack._ffi
+    jack._ffi = CountingFFI(ffi)
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        tracemalloc.stop()
+        jack._ffi = ffi
+
+
+def _ffi_news():
+    return getattr(jack._ffi, 'news', 0)
+
+
+class CallbackAllocations(object):
+    """
+    Wraps a callback to record what it allocates per call, inside tracing_allocations.
+
+    Bytes are the peak of the Python objects allocated during the call as traced by
+    tracemalloc, and the retained bytes what is still allocated when it returns, both less what
+    the measurement itself traces around an empty callback; C structs allocated with
+    jack._ffi.new are counted separately, since their memory is not traced. A call allocating
+    either counts as an allocating call.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        self.calls = 0
+        self.allocating_calls = 0
+        self.allocated_bytes = 0
+        self.retained_bytes = 0
+        self.ffi_news = 0
+        # peak and retained bytes traced by the measurement itself, measured on the first call.
+        self._overhead = None
+        self._retained_overhead = None
+
+    def _traced_bytes(self, callback, args):
+        news = _ffi_news()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = callback(*args)
+        after, peak = tracemalloc.get_traced_memory()
+        return peak - before, after - before, _ffi_news() - news, result
+
+    def __call__(self, *args):
+        if self._overhead is None:
+            baselines = [self._traced_bytes(_noop, args) for _ in range(16)]
+            self._overhead = min(baseline[0] for baseline in baselines)
+            self._retained_overhead = min(baseline[1] for baseline in baselines)
+        allocated, retained, news, result = self._traced_bytes(self.callback, args)
+        allocated -= self._overhead
+        self.retained_bytes += retained - self._retained_overhead
+        self.calls += 1
+        if allocated > 0 or news:
+            self.allocating_calls += 1
+        if allocated > 0:
+            self.allocated_bytes += allocated
+        self.ffi_news += news
+        return result
+
+    def bytes_per_call(self):
+        return self.allocated_bytes / max(self.calls, 1)
+
+    def retained_bytes_per_call(self):
+        return self.retained_bytes / max(self.calls, 1)
+
+    def ffi_news_per_call(self):
+        return self.ffi_news / max(self.calls, 1)
+
+
+def format_table(header, rows):
+    """
+    Returns rows of values as a text table aligned under header.
+    """
+    cells = [[str(cell) for cell in header]]
+    for row in rows:
+        cells.append([cell if isinstance(cell, str) else '{0:.2f}'.format(cell)
+                      if isinstance(cell, float) else str(cell) for cell in row])
+    widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(row, widths))
+                     for row in cells)
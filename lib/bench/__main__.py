@@ -0,0 +1,32 @@
+import argparse
+from lib.bench import (BLOCKSIZES, callbacks, control, estimators, frames, midi, scheduler,
+                       timebase)
+
+SUITES = {
+    'callbacks': callbacks,
+    'control': control,
+    'estimators': estimators,
+    'frames': frames,
+    'midi': midi,
+    'scheduler': scheduler,
+    'timebase': timebase,
+}
+
+parser = argparse.ArgumentParser(description='Benchmark jacktime against a simulated JACK server.')
+parser.add_argument('suites', nargs='*', metavar='suite',
+                    help='Benchmark suites to run, of: {0}. Runs all by default.'.format(
+                        ', '.join(sorted(SUITES))))
+parser.add_argument('--frame-rate', type=int, default=48000)
+parser.add_argument('--seconds', type=float, default=10.0,
+                    help='Seconds of simulated audio per run.')
+parser.add_argument('--blocksize', type=int, action='append', dest='blocksizes',
+                    help='Blocksize to benchmark. May be repeated. Defaults to 16 through 4096.')
+args = parser.parse_args()
+for name in args.suites:
+    if name not in SUITES:
+        parser.error('unknown suite {0!r}'.format(name))
+
+for name in args.suites or sorted(SUITES):
+    print('== {0} =='.format(name))
+    SUITES[name].run(frame_rate=args.frame_rate, seconds=args.seconds,
+                     blocksizes=tuple(args.blocksizes or BLOCKSIZES))
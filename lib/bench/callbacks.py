@@ -0,0 +1,88 @@
+"""
+Per-cycle latency and allocations of the master and client callbacks across blocksizes.
+"""
+import threading
+from lib.bench import (BLOCKSIZES, PERCENTILES, CallbackTimer, CallbackAllocations,
+                       format_table, tracing_allocations)
+from lib.jack.simulator import FakeClient, SimulatedTransport
+from lib.jack.timebase_client import PyJackTimebaseClient
+from lib.jack.timebase_master import PyJackTimebaseMaster
+from lib.telemetry import TelemetryQueue
+
+
+def make_transport(frame_rate):
+    """
+    Transport with a tempo change, repositions and beat jitter, so the client exercises every
+    path of its process callback.
+    """
+    return SimulatedTransport(frame_rate=frame_rate, beats_per_minute=120.0,
+                              tempo_changes=[(frame_rate * 60, 128.0)],
+                              jitter=32, seed=1)
+
+
+def build(mode, blocksize, frame_rate, seconds):
+    """
+    Returns a FakeClient running the given mode and the names of the callbacks to measure.
+    """
+    cycles = int(seconds * frame_rate / blocksize)
+    repositions = {cycles // 3: 0, 2 * cycles // 3: frame_rate * 30}
+    client = FakeClient(name='jacktime_' + mode, transport=make_transport(frame_rate),
+                        blocksize=blocksize, repositions=repositions)
+    telemetry = TelemetryQueue()
+    if mode == 'master':
+        master = PyJackTimebaseMaster(client, threading.Event(), telemetry=telemetry)
+        master.set_timebase_callback()
+        callbacks = ('process_callback', 'timebase_callback')
+    else:
+        PyJackTimebaseClient(client, threading.Event(), telemetry=telemetry)
+        callbacks = ('process_callback',)
+    return client, telemetry, callbacks, cycles
+
+
+def run_cycles(client, telemetry, cycles):
+    for _ in range(cycles):
+        client.cycle()
+        # drain outside the measured callbacks, as the reporter thread would.
+        for _ in telemetry.drain():
+            pass
+
+
+def measure(mode, blocksize, frame_rate, seconds):
+    """
+    Runs mode at blocksize twice: once timing each callback and once tracing its allocations.
+    :return: list of table rows, one per callback
+    """
+    client, telemetry, callbacks, cycles = build(mode, blocksize, frame_rate, seconds)
+    timers = {}
+    for name in callbacks:
+        timers[name] = CallbackTimer(getattr(client, name))
+        setattr(client, name, timers[name])
+    run_cycles(client, telemetry, cycles)
+
+    client, telemetry, callbacks, cycles = build(mode, blocksize, frame_rate, seconds)
+    allocations = {}
+    for name in callbacks:
+        allocations[name] = CallbackAllocations(getattr(client, name))
+        setattr(client, name, allocations[name])
+    with tracing_allocations():
+        run_cycles(client, telemetry, cycles)
+
+    rows = []
+    for name in callbacks:
+        rows.append([mode, blocksize, name.replace('_callback', '')]
+                    + timers[name].percentiles_usecs()
+                    + ['{0}/{1}'.format(allocations[name].allocating_calls, allocations[name].calls),
+                       allocations[name].bytes_per_call(),
+                       allocations[name].ffi_news_per_call()])
+    return rows
+
+
+def run(frame_rate=48000, seconds=10.0, blocksizes=BLOCKSIZES, modes=('master', 'client')):
+    header = (['mode', 'blocksize', 'callback']
+              + ['p{0} us'.format(p) for p in PERCENTILES] + ['max us']
+              + ['allocating cycles', 'bytes/cycle', 'ffi.new/cycle'])
+    rows = []
+    for mode in modes:
+        for blocksize in blocksizes:
+            rows.extend(measure(mode, blocksize, frame_rate, seconds))
+    print(format_table(header, rows))
@@ -0,0 +1,106 @@
+"""
+Latency of the master's callbacks while tempo commands are swept through the control socket,
+against an idle control socket. Cycles are paced in real time so that commands arrive between
+and during callbacks as they would with a JACK server, and commands are sent from another
+process, as they would be by a controller, so that the sender does not hold the GIL the
+callbacks need.
+"""
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+from lib.bench import CallbackTimer, format_table
+from lib.jack.control import ControlBuffer
+from lib.jack.control_server import ControlServer
+from lib.jack.simulator import FakeClient, SimulatedTransport
+from lib.jack.timebase_master import PyJackTimebaseMaster
+
+# commands sent per second.
+RATES = (0, 1000, 10000)
+
+
+class _Sender(multiprocessing.Process):
+    """
+    Sweeps the tempo between 60 and 180 bpm at rate commands per second, in 1 ms bursts.
+    """
+    def __init__(self, path, rate):
+        super(_Sender, self).__init__(daemon=True)
+        self.path = path
+        self.rate = rate
+        self._sent = multiprocessing.Value('q', 0)
+        self.stopevent = multiprocessing.Event()
+
+    @property
+    def sent(self):
+        return self._sent.value
+
+    def run(self):
+        if not self.rate:
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        start = time.perf_counter()
+        sent = 0
+        while not self.stopevent.wait(0.001):
+            due = int((time.perf_counter() - start) * self.rate)
+            while sent < due:
+                tempo = 60 + (sent % 1200) / 10.0
+                try:
+                    sock.sendto('tempo {0}'.format(tempo).encode(), self.path)
+                except BlockingIOError:
+                    break
+                sent += 1
+            self._sent.value = sent
+        sock.close()
+
+
+def measure(blocksize, rate, frame_rate, seconds, path):
+    cycles = int(seconds * frame_rate / blocksize)
+    client = FakeClient(name='jacktime_master', transport=SimulatedTransport(frame_rate=frame_rate),
+                        blocksize=blocksize)
+    control = ControlBuffer()
+    server = ControlServer(control, path)
+    master = PyJackTimebaseMaster(client, threading.Event(), control=control)
+    master.set_timebase_callback()
+    applied = [0]
+    read = control.read
+
+    def counting_read():
+        changed = read()
+        applied[0] += changed
+        return changed
+    control.read = counting_read
+    process = CallbackTimer(client.process_callback)
+    client.process_callback = process
+    timebase = CallbackTimer(client.timebase_callback)
+    client.timebase_callback = timebase
+
+    server.start()
+    sender = _Sender(path, rate)
+    sender.start()
+    period = blocksize / frame_rate
+    start = time.perf_counter()
+    for cycle in range(cycles):
+        delay = start + cycle * period - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        client.cycle()
+    sender.stopevent.set()
+    sender.join()
+    server.stop()
+    return ([blocksize, rate, sender.sent, server.published, applied[0],
+             len(master.tempo_map.segments)]
+            + process.percentiles_usecs()[2:] + timebase.percentiles_usecs()[2:])
+
+
+def run(frame_rate=48000, seconds=10.0, blocksizes=(256, 1024)):
+    header = ['blocksize', 'rate', 'sent', 'published', 'applied', 'tempo segments',
+              'process p99 us', 'p99.9 us', 'max us', 'timebase p99 us', 'p99.9 us', 'max us']
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'control')
+        for blocksize in blocksizes:
+            for rate in RATES:
+                rows.append(measure(blocksize, rate, frame_rate, seconds, path))
+    print(format_table(header, rows))
@@ -0,0 +1,99 @@
+"""
+Convergence speed and accuracy of the beat width estimators on simulated jittery masters: the
+fpb range narrowed by adjust_fpb_range against the streaming least-squares fit. Besides the
+error of each width, the frame each model predicts for the next beat is scored against the
+master, with that of the model predictions use.
+"""
+import threading
+import time
+from fractions import Fraction
+from lib.bench import format_table
+from lib.jack.simulator import FakeClient, SimulatedTransport
+from lib.jack.timebase_client import PyJackTimebaseClient
+
+JITTERS = (0, 16, 128, 512)
+
+# a tempo whose beats are a whole number of frames at 48 kHz, and one whose beats are not.
+TEMPOS = (120.0, 117.3)
+
+# an estimate has converged once it stays within this many frames of the true beat width.
+THRESHOLD = 1.0
+
+
+def converged_at(errors):
+    """
+    Returns the number of beats after which every error is within THRESHOLD, or None.
+    """
+    for index in range(len(errors) - 1, -1, -1):
+        if errors[index] > THRESHOLD:
+            return index + 2 if index + 1 < len(errors) else None
+    return 1
+
+
+def measure(blocksize, jitter, frame_rate, seconds, beats_per_minute=120.0):
+    """
+    Runs the client against a master with the given jitter, recording the error of both
+    estimates of the beat width after each recorded beat, and of the frame each predicts for the
+    next beat.
+    """
+    true_width = 60.0 * frame_rate / beats_per_minute
+    client = FakeClient(transport=SimulatedTransport(frame_rate=frame_rate,
+                                                     beats_per_minute=beats_per_minute,
+                                                     jitter=jitter, seed=jitter + 1),
+                        blocksize=blocksize)
+    tclient = PyJackTimebaseClient(client, threading.Event())
+    segment = tclient.beat_state.current_segment
+    range_errors = []
+    fit_errors = []
+    # errors of the next beat's predicted frame, from the third recorded beat on.
+    range_misses = []
+    fit_misses = []
+    chosen_misses = []
+    beat_state = tclient.beat_state
+    record_nanoseconds = 0
+    recorded = segment.estimator.count
+    for _ in range(int(seconds * frame_rate / blocksize)):
+        start = time.perf_counter_ns()
+        client.cycle()
+        elapsed = time.perf_counter_ns() - start
+        if segment.estimator.count != recorded:
+            recorded = segment.estimator.count
+            record_nanoseconds += elapsed
+            low, high = segment.fpb
+            range_errors.append(abs((low + high) / 2 - true_width))
+            fit_errors.append(abs(segment.estimator.width - true_width))
+            if segment.estimator.count >= 3:
+                beat = max(beat_state.beat_map) + 1
+                true_frame = client.transport.frame_at(beat - 1)
+                beats = beat - segment.start_beat
+                range_misses.append(abs(float(segment.start_frame
+                                              + Fraction(low + high, 2) * beats) - true_frame))
+                start_frame, width = segment.estimator.line(segment.start_beat)
+                fit_misses.append(abs(float(start_frame + width * beats) - true_frame))
+                chosen_misses.append(abs(float(beat_state.exact_beat_frame(beat)) - true_frame))
+    report = tclient.beat_state.skew_report()
+    return [beats_per_minute, blocksize, jitter, len(range_errors),
+            converged_at(range_errors) or '-', range_errors[-1],
+            converged_at(fit_errors) or '-', fit_errors[-1],
+            mean(range_misses), mean(fit_misses), mean(chosen_misses), max(chosen_misses or [0]),
+            report['estimator'], report['skew_type'],
+            record_nanoseconds / max(len(range_errors), 1) / 1000.0]
+
+
+def mean(values):
+    return sum(values) / max(len(values), 1)
+
+
+def run(frame_rate=48000, seconds=120.0, blocksizes=(256, 1024)):
+    header = ['bpm', 'blocksize', 'jitter', 'beats', 'range converged', 'range error',
+              'fit converged', 'fit error', 'range miss', 'fit miss', 'chosen miss',
+              'max chosen miss', 'preferred', 'skew type', 'us/beat cycle']
+    rows = []
+    for beats_per_minute in TEMPOS:
+        for blocksize in blocksizes:
+            for jitter in JITTERS:
+                rows.append(measure(blocksize, jitter, frame_rate, seconds, beats_per_minute))
+    print('beats until the width stays within {0} frame of the master, the final error, and the '
+          'mean frames by which each model and the one chosen miss the next beat'
+          .format(THRESHOLD))
+    print(format_table(header, rows))
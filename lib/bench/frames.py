@@ -0,0 +1,196 @@
+"""
+Exactness of the fixed-point beat frames of BeatLine against exact rational arithmetic, and of
+the float formula they replace, out to frame 2 ** 63; and the cost of each per prediction.
+
+Random lines cover the beat models the client builds: nominal tempo widths, fpb range
+midpoints and least-squares widths, from start frames anywhere below 2 ** 62. Long runs learn
+a model from a simulated master with tempo changes and walk consecutive beats of each of its
+segments from frame 2 ** 31 to 2 ** 62; jack_position_t frames are 32 bits, so the model is
+learned early and extrapolated. Beat counts before start and from 2 ** GUARD_BITS on, which
+BeatLine.frame takes from the exact frame, are checked too. Any fixed-point frame off the floor
+of the exact frame raises AssertionError, so the bench exits non-zero.
+"""
+import random
+import threading
+import time
+from fractions import Fraction
+from math import floor
+from lib.bench import format_table
+from lib.jack.frames import FIXED_BEATS, BeatLine, frames_per_beat
+from lib.jack.simulator import FakeClient, SimulatedTransport
+from lib.jack.timebase_client import PyJackTimebaseClient
+
+FRAME_RATES = (44100, 48000, 88200, 96000, 192000)
+TEMPOS = (120.0, 128.0, 140.0, 174.0, 93.75)
+MAGNITUDES = (31, 40, 53, 60, 62)
+LIMIT = 2 ** 63
+
+
+def random_line(rng):
+    """
+    Returns a BeatLine of one of the kinds of beat model the client builds.
+    """
+    frame_rate = rng.choice(FRAME_RATES)
+    bpm = rng.choice(TEMPOS) if rng.random() < 0.5 else rng.uniform(20.0, 300.0)
+    nominal = frames_per_beat(frame_rate, bpm)
+    kind = rng.randrange(3)
+    if kind == 0:
+        width = nominal
+    elif kind == 1:
+        # midpoint of a whole-frame fpb range.
+        width = Fraction(2 * floor(nominal) + 1, 2)
+    else:
+        width = Fraction(float(nominal) + rng.uniform(-0.5, 0.5))
+    start = Fraction(rng.randrange(2 ** rng.randrange(1, 63)), 2)
+    if rng.random() < 0.5:
+        start += Fraction(rng.random())
+    return BeatLine(start, width)
+
+
+def beat_counts(line, rng, count):
+    """
+    Returns beat counts whose frames lie below 2 ** 63: log-spaced ones, and ones whose exact
+    frame is a whole number, where rounding up or down is most likely to cross a frame.
+    """
+    last = int((LIMIT - 1 - line.start) / line.width)
+    counts = [0, last]
+    for _ in range(count):
+        counts.append(min(int(2 ** rng.uniform(0, last.bit_length())), last))
+    # exact frames are whole every denominator beats if start is whole.
+    denominator = line.width.denominator
+    if line.start.denominator == 1 and denominator <= last:
+        for _ in range(count):
+            counts.append(denominator * rng.randrange(last // denominator + 1))
+    return counts
+
+
+def edge_counts(rng, count):
+    """
+    Returns beat counts outside the fixed-point range of BeatLine.frame: negative ones, and ones
+    from 2 ** GUARD_BITS on.
+    """
+    counts = [-1, FIXED_BEATS - 1, FIXED_BEATS]
+    for _ in range(count):
+        counts.append(-int(2 ** rng.uniform(0, 62)))
+        counts.append(FIXED_BEATS + int(2 ** rng.uniform(0, 80)))
+    return counts
+
+
+def float_frame(line, beats):
+    """
+    Returns the frame of a beat as the float formula of the client computed it before.
+    """
+    return floor(float(line.start) + float(line.width) * beats)
+
+
+def check_random(lines, seed=1, per_line=64):
+    rng = random.Random(seed)
+    checked = fixed_errors = float_errors = edges = 0
+    first_float = None
+    max_float = 0
+    for _ in range(lines):
+        line = random_line(rng)
+        for beats in edge_counts(rng, per_line // 8):
+            edges += 1
+            if line.frame(beats) != floor(line.exact(beats)):
+                fixed_errors += 1
+        for beats in beat_counts(line, rng, per_line):
+            exact = floor(line.exact(beats))
+            checked += 1
+            if line.frame(beats) != exact:
+                fixed_errors += 1
+            error = abs(float_frame(line, beats) - exact)
+            if error:
+                float_errors += 1
+                max_float = max(max_float, error)
+                if first_float is None or exact < first_float:
+                    first_float = exact
+    return [lines, checked, edges, fixed_errors, float_errors,
+            '2^{0}'.format(first_float.bit_length() - 1) if first_float else '-',
+            max_float]
+
+
+def learn(blocksize, frame_rate, seconds):
+    """
+    Returns the beat state learned from a master with a tempo change every 20 seconds.
+    """
+    changes = [(frame_rate * 20 * step, 80.0 + 37.5 * step) for step in range(1, 4)]
+    client = FakeClient(transport=SimulatedTransport(frame_rate=frame_rate, jitter=16, seed=1,
+                                                     tempo_changes=changes),
+                        blocksize=blocksize)
+    tclient = PyJackTimebaseClient(client, threading.Event())
+    client.run(int(seconds * frame_rate / blocksize))
+    return tclient.beat_state
+
+
+def check_long_run(beat_state, beats):
+    """
+    Walks beats consecutive beats of each segment from each of MAGNITUDES, comparing the
+    fixed-point and float frames against the exact one. The last segment is walked through
+    beat_frame of the beat state, the others through their lines.
+    """
+    rows = []
+    last = beat_state.fpb_segments.last
+    for segment in beat_state.fpb_segments:
+        line = segment.beat_line()
+        for magnitude in MAGNITUDES:
+            first = int((2 ** magnitude - line.start) / line.width)
+            fixed_errors = float_errors = max_float = 0
+            for beats_after in range(first, first + beats):
+                exact = floor(line.exact(beats_after))
+                if segment is last:
+                    fixed = beat_state.beat_frame(segment.start_beat + beats_after)
+                else:
+                    fixed = line.frame(beats_after)
+                if fixed != exact:
+                    fixed_errors += 1
+                error = abs(float_frame(line, beats_after) - exact)
+                if error:
+                    float_errors += 1
+                    max_float = max(max_float, error)
+            rows.append([segment.number, float(line.width), '2^{0}'.format(magnitude), beats,
+                         fixed_errors, float_errors, max_float])
+    return rows
+
+
+def timings(beat_state, calls=100000):
+    """
+    Returns microseconds per prediction of a beat near frame 2 ** 40 for each path.
+    """
+    segment = beat_state.fpb_segments.last
+    line = segment.beat_line()
+    beat = segment.start_beat + int((2 ** 40 - line.start) / line.width)
+    start_frame, width = float(line.start), float(line.width)
+    beats = beat - segment.start_beat
+    paths = [('float formula', lambda: floor(start_frame + width * beats)),
+             ('beat_frame', lambda: beat_state.beat_frame(beat)),
+             ('beat_offset', lambda: beat_state.beat_offset(beat, 2 ** 40)),
+             ('predict_beat_frame', lambda: beat_state.predict_beat_frame(beat)),
+             ('exact_beat_frame', lambda: beat_state.exact_beat_frame(beat))]
+    rows = []
+    for name, path in paths:
+        start = time.perf_counter()
+        for _ in range(calls):
+            path()
+        rows.append([name, (time.perf_counter() - start) / calls * 1e6])
+    return rows
+
+
+def run(frame_rate=48000, seconds=10.0, blocksizes=(256, 1024)):
+    failures = 0
+    rows = [check_random(int(100 * seconds))]
+    failures += rows[0][3]
+    print(format_table(['lines', 'frames', 'edge frames', 'fixed errors', 'float errors',
+                        'first float error', 'max float error'], rows))
+    print()
+    # long enough to learn every tempo segment of the master.
+    beat_state = learn(blocksizes[0], frame_rate, max(seconds, 70.0))
+    rows = check_long_run(beat_state, int(1000 * seconds))
+    failures += sum(row[4] for row in rows)
+    print(format_table(['segment', 'width', 'from frame', 'beats', 'fixed errors',
+                        'float errors', 'max float error'], rows))
+    print()
+    print(format_table(['path', 'us per call'], timings(beat_state)))
+    if failures:
+        raise AssertionError('{0} fixed-point frames differ from the exact frame'
+                             .format(failures))
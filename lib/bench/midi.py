@@ -0,0 +1,83 @@
+"""
+Jitter of the MIDI clock written by the client against the simulated master, and the
+allocations of the client's process callback while writing it, and of the clock's share of it.
+"""
+import threading
+from lib.bench import (PERCENTILES, CallbackAllocations, format_table, percentile,
+                       tracing_allocations)
+from lib.jack.midi_clock import CLOCK, PULSES_PER_QUARTER_NOTE
+from lib.jack.simulator import FakeClient, SimulatedTransport
+from lib.jack.timebase_client import PyJackTimebaseClient
+
+JITTERS = (0, 16, 128)
+
+
+def build(blocksize, jitter, frame_rate):
+    client = FakeClient(transport=SimulatedTransport(frame_rate=frame_rate, jitter=jitter,
+                                                     seed=jitter + 1),
+                        blocksize=blocksize)
+    tclient = PyJackTimebaseClient(client, threading.Event(), midi_clock=True, beat_note=60,
+                                   bar_note=72)
+    return client, tclient.midi_clock
+
+
+def clock_errors(client):
+    """
+    Returns the difference in frames between each clock pulse written and the frame at which the
+    master reached it. Pulses are counted from the start message at frame 0, in the simulated
+    master's 4/4.
+    """
+    port = next(iter(client.midi_outports))
+    transport = client.transport
+    clock = CLOCK[0]
+    errors = []
+    pulse = 0
+    for frame, status, _ in port.events():
+        if status == clock:
+            errors.append(frame - transport.frame_at(pulse / PULSES_PER_QUARTER_NOTE))
+            pulse += 1
+    return errors
+
+
+def measure(blocksize, jitter, frame_rate, seconds):
+    cycles = int(seconds * frame_rate / blocksize)
+    client, _ = build(blocksize, jitter, frame_rate)
+    client.run(cycles)
+    errors = clock_errors(client)
+    # the first beats are written before the beat width is known.
+    settled = errors[8 * PULSES_PER_QUARTER_NOTE:]
+    magnitudes = sorted(abs(error) for error in settled)
+    mean = sum(settled) / max(len(settled), 1)
+    deviation = (sum((error - mean) ** 2 for error in settled) / max(len(settled), 1)) ** 0.5
+
+    client, _ = build(blocksize, jitter, frame_rate)
+    allocations = CallbackAllocations(client.process_callback)
+    client.process_callback = allocations
+    with tracing_allocations():
+        client.run(cycles)
+
+    # measured in a run of its own, since the peaks of nested calls cannot both be traced.
+    client, midi_clock = build(blocksize, jitter, frame_rate)
+    clock_allocations = CallbackAllocations(midi_clock.process)
+    midi_clock.process = clock_allocations
+    with tracing_allocations():
+        client.run(cycles)
+    return ([blocksize, jitter, len(errors), mean, deviation]
+            + [float(percentile(magnitudes, p)) for p in PERCENTILES]
+            + [float(magnitudes[-1]) if magnitudes else 0.0,
+               '{0}/{1}'.format(allocations.allocating_calls, allocations.calls),
+               allocations.bytes_per_call(), allocations.ffi_news_per_call(),
+               clock_allocations.bytes_per_call(), clock_allocations.retained_bytes_per_call()])
+
+
+def run(frame_rate=48000, seconds=60.0, blocksizes=(64, 256, 1024)):
+    header = (['blocksize', 'jitter', 'pulses', 'mean error', 'jitter (sd)']
+              + ['p{0} |error|'.format(p) for p in PERCENTILES]
+              + ['max |error|', 'allocating cycles', 'bytes/cycle', 'ffi.new/cycle',
+                 'clock peak bytes/cycle', 'clock retained bytes/cycle'])
+    rows = []
+    for blocksize in blocksizes:
+        for jitter in JITTERS:
+            rows.append(measure(blocksize, jitter, frame_rate, seconds))
+    print('MIDI clock frames against the master after the first 8 beats')
+    print(format_table(header, rows))
@@ -0,0 +1,45 @@
+"""
+Per-cycle cost of the client's beat scheduler against the number of events queued.
+"""
+import threading
+from lib.bench import CallbackTimer, format_table
+from lib.jack.simulator import FakeClient, SimulatedTransport
+from lib.jack.timebase_client import PyJackTimebaseClient
+
+QUEUED = (0, 1000, 10000, 50000)
+
+# events scheduled per beat ahead of the transport.
+EVENTS_PER_BEAT = 16
+
+
+def measure(blocksize, queued, frame_rate, seconds):
+    """
+    Queues events EVENTS_PER_BEAT to a beat, as far ahead as needed, and times the process
+    callback and its dispatching.
+    """
+    client = FakeClient(transport=SimulatedTransport(frame_rate=frame_rate, jitter=32, seed=1),
+                        blocksize=blocksize)
+    tclient = PyJackTimebaseClient(client, threading.Event())
+    scheduler = tclient.scheduler
+    fired = []
+    for index in range(queued):
+        scheduler.at(2 + index / EVENTS_PER_BEAT, fired.append)
+    # drain the queue into the heap before timing.
+    client.cycle()
+    dispatch = CallbackTimer(scheduler.dispatch)
+    scheduler.dispatch = dispatch
+    process = CallbackTimer(client.process_callback)
+    client.process_callback = process
+    client.run(int(seconds * frame_rate / blocksize))
+    return ([blocksize, queued, len(scheduler), scheduler.dispatched, scheduler.missed]
+            + dispatch.percentiles_usecs()[1:3] + process.percentiles_usecs()[1:3])
+
+
+def run(frame_rate=48000, seconds=10.0, blocksizes=(64, 1024)):
+    header = ['blocksize', 'queued', 'left', 'dispatched', 'missed', 'dispatch p90 us',
+              'dispatch p99 us', 'process p90 us', 'process p99 us']
+    rows = []
+    for blocksize in blocksizes:
+        for queued in QUEUED:
+            rows.append(measure(blocksize, queued, frame_rate, seconds))
+    print(format_table(header, rows))
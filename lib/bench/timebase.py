@@ -0,0 +1,58 @@
+"""
+Allocations and latency of the master's timebase callback, against rebuilding the position
+struct every cycle as the callback used to. Both are registered without the stats timing
+wrapper, whose own cost the callbacks suite includes.
+
+The cached callback allocates no struct, Fraction or container, but it does not reach zero
+allocations: nearly every call still counts as allocating. What tracemalloc sees are the int
+objects CPython creates for values above 256, such as pos.frame as cffi reads it, and the tick
+and sub-tick units the BBT engine adds each cycle. Each replaces the one before and is freed
+within the call, so a pure Python callback cannot avoid them but does not accumulate them: the
+bytes retained per call, well under a byte, are those of ints growing past a size, e.g. the
+bar number past 256.
+"""
+import threading
+from lib.bench import (BLOCKSIZES, PERCENTILES, CallbackTimer, CallbackAllocations, format_table,
+                       tracing_allocations)
+from lib.jack.simulator import FakeClient, SimulatedTransport
+from lib.jack.timebase_master import PyJackTimebaseMaster
+
+
+def rebuilding_callback(master):
+    """
+    Timebase callback allocating and filling a new position struct every cycle.
+    """
+    def timebase_callback(state, blocksize, pos, new_pos):
+        pos[0] = master.config.getPos()[0]
+    return timebase_callback
+
+
+def measure(variant, blocksize, frame_rate, seconds, wrapper):
+    cycles = int(seconds * frame_rate / blocksize)
+    client = FakeClient(name='jacktime_master', transport=SimulatedTransport(frame_rate=frame_rate),
+                        blocksize=blocksize, repositions={cycles // 2: 0})
+    master = PyJackTimebaseMaster(client, threading.Event())
+    if variant == 'cached':
+        client.set_timebase_callback(master.timebase_callback)
+    else:
+        client.set_timebase_callback(rebuilding_callback(master))
+    measured = wrapper(client.timebase_callback)
+    client.timebase_callback = measured
+    client.run(cycles)
+    return measured
+
+
+def run(frame_rate=48000, seconds=10.0, blocksizes=BLOCKSIZES):
+    header = (['variant', 'blocksize'] + ['p{0} us'.format(p) for p in PERCENTILES] + ['max us']
+              + ['allocating calls', 'peak bytes/call', 'retained bytes/call', 'ffi.new/call'])
+    rows = []
+    for variant in ('rebuilding', 'cached'):
+        for blocksize in blocksizes:
+            timer = measure(variant, blocksize, frame_rate, seconds, CallbackTimer)
+            with tracing_allocations():
+                allocations = measure(variant, blocksize, frame_rate, seconds, CallbackAllocations)
+            rows.append([variant, blocksize] + timer.percentiles_usecs()
+                        + ['{0}/{1}'.format(allocations.allocating_calls, allocations.calls),
+                           allocations.bytes_per_call(), allocations.retained_bytes_per_call(),
+                           allocations.ffi_news_per_call()])
+    print(format_table(header, rows))
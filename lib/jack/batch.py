@@ -0,0 +1,91 @@
+import numpy as np
+
+
+class BeatModelSnapshot(object):
+    """
+    Copy of the tempo segments of a BeatStateMachine for predicting many beats at once.
+
+    Taking the snapshot only copies a few values per segment, so it can be taken from a
+    non-realtime thread while the process callback keeps recording beats; predictions are then
+    computed from the snapshot with NumPy without touching the state machine again.
+
+    Segment i covers the beats from its start beat up to the start beat of segment i + 1. Beat
+    frames are predicted as in BeatStateMachine.predict_beat_frame, from the beat model of the
+    beat's segment. The bounds combine the window of the start beat with the low and high ends of
+    the fpb range.
+    """
+    def __init__(self, beat_state):
+        """
+        :param beat_state: BeatStateMachine
+        """
+        segments = list(beat_state.fpb_segments)
+        count = len(segments)
+        self.start_beats = np.empty(count, dtype=np.int64)
+        self.start_frames = np.empty(count, dtype=np.float64)
+        self.window_starts = np.empty(count, dtype=np.float64)
+        self.window_ends = np.empty(count, dtype=np.float64)
+        self.fpb_low = np.empty(count, dtype=np.float64)
+        self.fpb_high = np.empty(count, dtype=np.float64)
+        self.fpb = np.empty(count, dtype=np.float64)
+        for i, segment in enumerate(segments):
+            window = segment.start_window
+            low, high = segment.fpb
+            self.start_beats[i] = segment.start_beat
+            self.start_frames[i], self.fpb[i] = segment.beat_model()
+            if window is None:
+                self.window_starts[i] = self.window_ends[i] = segment.start_frame
+            else:
+                self.window_starts[i], self.window_ends[i] = window
+            self.fpb_low[i] = low
+            self.fpb_high[i] = high
+
+    def _segments_of(self, beats):
+        return np.maximum(np.searchsorted(self.start_beats, beats, side='right') - 1, 0)
+
+    def _predict(self, beats, segments):
+        beat_counts = beats - self.start_beats[segments]
+        frames = self.start_frames[segments] + self.fpb[segments] * beat_counts
+        low = self.window_starts[segments] + self.fpb_low[segments] * beat_counts
+        high = self.window_ends[segments] + self.fpb_high[segments] * beat_counts
+        invalid = beats < 1
+        if invalid.any():
+            frames[invalid] = low[invalid] = high[invalid] = np.nan
+        return frames, low, high
+
+    def predict_beats(self, beats):
+        """
+        Predicts the frames of the given beats.
+        :param beats: array-like of absolute beat numbers
+        :return: tuple of float64 arrays (frames, low, high); NaN for beats below 1.
+        """
+        beats = np.asarray(beats, dtype=np.int64)
+        return self._predict(beats, self._segments_of(beats))
+
+    def predict_beat_range(self, first_beat, count):
+        """
+        Predicts the frames of count beats starting with first_beat.
+        :return: tuple of arrays (beats, frames, low, high)
+        """
+        beats = np.arange(first_beat, first_beat + count, dtype=np.int64)
+        return (beats,) + self.predict_beats(beats)
+
+    def predict_window(self, start_frame, end_frame):
+        """
+        Predicts every beat whose frame falls in [start_frame, end_frame), across tempo segments.
+        :return: tuple of arrays (beats, frames, low, high), ordered by beat
+        """
+        # first beat at or after each edge of the window, per segment.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fpb = np.where(self.fpb > 0, self.fpb, np.nan)
+            first = np.ceil(self.start_beats + (start_frame - self.start_frames) / fpb)
+            last = np.ceil(self.start_beats + (end_frame - self.start_frames) / fpb)
+        segment_ends = np.append(self.start_beats[1:], np.iinfo(np.int64).max)
+        first = np.maximum(np.nan_to_num(first, nan=0.0), np.maximum(self.start_beats, 1))
+        last = np.minimum(np.nan_to_num(last, nan=0.0), segment_ends)
+        counts = np.maximum(last - first, 0).astype(np.int64)
+
+        total = int(counts.sum())
+        segments = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        beats = first.astype(np.int64)[segments] + offsets
+        return (beats,) + self._predict(beats, segments)
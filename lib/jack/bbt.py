@@ -0,0 +1,316 @@
+import jack
+from bisect import bisect_right
+from fractions import Fraction
+from math import gcd
+from lib.jack.frames import frames_per_beat
+
+
+class Tempo(object):
+    """
+    A tempo and meter, with the constants a TempoSegment computes positions from that do not
+    depend on where the segment starts. Building one involves Fractions, so it is built ahead of
+    the change where possible, see PyJackTimebaseMaster.prepare_control.
+    """
+    __slots__ = ('frame_rate', 'beats_per_minute', 'beats_per_bar', 'beat_type', 'ticks_per_beat',
+                 'whole_ticks_per_beat', 'whole_beats_per_bar', 'ticks_per_frame',
+                 'frames_per_beat')
+
+    def __init__(self, frame_rate, beats_per_minute, beats_per_bar, beat_type, ticks_per_beat):
+        """
+        :param frame_rate: frames per second
+        :param beats_per_minute: tempo
+        :param beats_per_bar: time signature numerator, a whole number of beats
+        :param beat_type: time signature denominator
+        :param ticks_per_beat: tick resolution, a whole number of ticks
+        """
+        self.frame_rate = frame_rate
+        self.beats_per_minute = beats_per_minute
+        self.beats_per_bar = beats_per_bar
+        self.beat_type = beat_type
+        self.ticks_per_beat = ticks_per_beat
+        self.whole_ticks_per_beat = int(round(ticks_per_beat))
+        self.whole_beats_per_bar = int(round(beats_per_bar))
+        # ticks per frame = bpm * ticks per beat / (60 * frame rate), exactly, as a pair of ints.
+        ticks_per_frame = (Fraction(beats_per_minute) * self.whole_ticks_per_beat
+                           / (60 * frame_rate))
+        self.ticks_per_frame = (ticks_per_frame.numerator, ticks_per_frame.denominator)
+        self.frames_per_beat = frames_per_beat(frame_rate, beats_per_minute)
+
+    def matches(self, frame_rate, beats_per_minute, beats_per_bar, beat_type, ticks_per_beat):
+        return (self.frame_rate == frame_rate and self.beats_per_minute == beats_per_minute
+                and self.beats_per_bar == beats_per_bar and self.beat_type == beat_type
+                and self.ticks_per_beat == ticks_per_beat)
+
+
+class TempoSegment(object):
+    """
+    A span of the transport with constant tempo and meter, starting at start_frame.
+
+    Positions within the segment are kept in integer units of 1/units_per_tick ticks counted from
+    the start of start_bar, so that bars, beats and ticks are computed from the frame with integer
+    arithmetic only and never accumulate rounding error.
+    """
+    __slots__ = ('start_frame', 'tempo', 'frame_rate', 'beats_per_minute', 'beats_per_bar',
+                 'beat_type', 'ticks_per_beat', 'start_bar', 'start_bar_start_tick',
+                 'units_per_tick', 'units_per_frame', 'start_units', '_ticks_per_beat',
+                 '_beats_per_bar', '_ticks_per_bar')
+
+    def __init__(self, start_frame, tempo, start_bar=1, start_bar_start_tick=0, start_ticks=0,
+                 ticks_denominator=1):
+        """
+        :param start_frame: first frame of the segment
+        :param tempo: Tempo of the segment
+        :param start_bar: bar in progress at start_frame
+        :param start_bar_start_tick: absolute tick at which start_bar started
+        :param start_ticks: ticks since the start of start_bar at start_frame, in units of
+        1/ticks_denominator ticks
+        :param ticks_denominator: denominator of start_ticks
+        """
+        self.start_frame = start_frame
+        self.tempo = tempo
+        self.frame_rate = tempo.frame_rate
+        self.beats_per_minute = tempo.beats_per_minute
+        self.beats_per_bar = tempo.beats_per_bar
+        self.beat_type = tempo.beat_type
+        self.ticks_per_beat = tempo.ticks_per_beat
+        self.start_bar = start_bar
+        self.start_bar_start_tick = start_bar_start_tick
+        self._ticks_per_beat = tempo.whole_ticks_per_beat
+        self._beats_per_bar = tempo.whole_beats_per_bar
+        self._ticks_per_bar = self._beats_per_bar * self._ticks_per_beat
+
+        # the smallest unit in which both a frame's ticks and start_ticks are whole.
+        numerator, denominator = tempo.ticks_per_frame
+        units_per_tick = denominator * ticks_denominator // gcd(denominator, ticks_denominator)
+        self.units_per_tick = units_per_tick
+        self.units_per_frame = numerator * (units_per_tick // denominator)
+        self.start_units = start_ticks * (units_per_tick // ticks_denominator)
+
+    def units_at(self, frame):
+        """
+        Returns the position of frame in units of 1/units_per_tick ticks since start_bar started.
+        """
+        return self.start_units + (frame - self.start_frame) * self.units_per_frame
+
+    def bbt(self, units):
+        """
+        Returns (bar, beat, tick, bar_start_tick) of a position returned by units_at.
+        """
+        bars, bar_ticks = divmod(units // self.units_per_tick, self._ticks_per_bar)
+        beat, tick = divmod(bar_ticks, self._ticks_per_beat)
+        return (self.start_bar + bars, beat + 1, tick,
+                self.start_bar_start_tick + bars * self._ticks_per_bar)
+
+    def same_meter(self, beats_per_bar, beat_type, ticks_per_beat):
+        return (self.beats_per_bar == beats_per_bar and self.beat_type == beat_type
+                and self.ticks_per_beat == ticks_per_beat)
+
+
+class TempoMap(object):
+    """
+    Tempo and meter of the transport as segments sorted by start frame.
+
+    Frame 0 is the first frame of bar 1 beat 1. A tempo change keeps the bar in progress; a meter
+    change starts a new bar at the frame it takes effect.
+
+    Changes are appended at the playhead, so the map only grows while the transport rolls, by at
+    most a segment per change. Segments that have not been reached yet are replaced by the next
+    change. Every segment is kept, so a locate to any earlier frame gets the bar, beat and tick
+    it had; the master limits how often control changes add one, see
+    PyJackTimebaseMaster.apply_control.
+    """
+    def __init__(self, frame_rate, beats_per_minute=120.0, beats_per_bar=4, beat_type=4,
+                 ticks_per_beat=1920.0):
+        self.frame_rate = frame_rate
+        self.segments = [TempoSegment(0, Tempo(frame_rate, beats_per_minute, beats_per_bar,
+                                                 beat_type, ticks_per_beat))]
+        # start frame of each segment, for bisection.
+        self.start_frames = [0]
+
+    def append(self, frame, beats_per_minute, beats_per_bar, beat_type, ticks_per_beat):
+        """
+        Changes the tempo and meter from frame on, see append_tempo.
+        :return: the TempoSegment in effect from frame
+        """
+        return self.append_tempo(frame, Tempo(self.frame_rate, beats_per_minute, beats_per_bar,
+                                              beat_type, ticks_per_beat))
+
+    def append_tempo(self, frame, tempo):
+        """
+        Changes the tempo and meter from frame on. Segments starting at or after frame are
+        replaced; if that leaves the tempo and meter in effect at frame unchanged, nothing is
+        appended. Only integer arithmetic is done here, the rest was done by building tempo.
+        :param frame: first frame of the change
+        :param tempo: Tempo from frame on
+        :return: the TempoSegment in effect from frame
+        """
+        segments = self.segments
+        start_frames = self.start_frames
+        previous = None
+        while start_frames and start_frames[-1] >= frame:
+            previous = segments.pop()
+            start_frames.pop()
+        if frame <= 0:
+            segments.append(TempoSegment(0, tempo))
+            start_frames.append(0)
+            return segments[0]
+        if segments:
+            previous = segments[-1]
+            if previous.tempo is tempo or previous.tempo.matches(
+                    tempo.frame_rate, tempo.beats_per_minute, tempo.beats_per_bar,
+                    tempo.beat_type, tempo.ticks_per_beat):
+                return previous
+
+        # previous is the first segment if every segment started after frame; it is continued
+        # backwards to frame.
+        units = previous.units_at(frame)
+        units_per_tick = previous.units_per_tick
+        units_per_bar = previous._ticks_per_bar * units_per_tick
+        bars, bar_units = divmod(units, units_per_bar)
+        bar = previous.start_bar + bars
+        bar_start_tick = previous.start_bar_start_tick + bars * previous._ticks_per_bar
+        if bar_units and not previous.same_meter(tempo.beats_per_bar, tempo.beat_type,
+                                                 tempo.ticks_per_beat):
+            # the bar in progress is cut short and the new meter starts with the next bar.
+            bar_start_tick += bar_units // units_per_tick
+            bar += 1
+            bar_units = 0
+        # exact ticks into the bar in progress, rescaled to the new tick resolution.
+        ticks = bar_units * tempo.whole_ticks_per_beat
+        ticks_denominator = units_per_tick * previous._ticks_per_beat
+        divisor = gcd(ticks, ticks_denominator)
+        segment = TempoSegment(frame, tempo, bar, bar_start_tick, ticks // divisor,
+                               ticks_denominator // divisor)
+        segments.append(segment)
+        start_frames.append(frame)
+        return segment
+
+    def segment_index(self, frame):
+        """
+        Returns the index of the segment containing frame, in O(log n).
+        """
+        return max(bisect_right(self.start_frames, frame) - 1, 0)
+
+
+class BBTEngine(object):
+    """
+    Computes the bar, beat and tick of each cycle's frame from a TempoMap.
+
+    Jumps are located by bisection of the tempo map and their position is computed exactly from
+    the segment's start. While the transport rolls the position is advanced from the previous
+    cycle instead, only checking the next segment boundary: the ticks and units a cycle's length
+    advances are computed once per segment and blocksize, and each cycle adds them and carries
+    into the beat and bar. The per-cycle path thus handles no Fractions, tuples or ints larger
+    than a tick's units, and the position stays exact.
+    """
+    def __init__(self, tempo_map):
+        self.tempo_map = tempo_map
+        self.segment = None
+        self._segment_index = None
+        self._end_frame = None
+        self._frame = None
+        # position at _frame, as written to the position struct, and the units of
+        # 1/units_per_tick ticks past tick.
+        self.bar = 1
+        self.beat = 1
+        self.tick = 0
+        self.bar_start_tick = 0
+        self._units = 0
+        # frames of the last step, and the whole ticks and units it advances by.
+        self._step_frames = None
+        self._step_ticks = 0
+        self._step_units = 0
+
+    def invalidate(self):
+        """
+        Forces the next seek to locate the frame in the tempo map, e.g. after the map changed.
+        """
+        self._segment_index = None
+
+    def _enter(self, index, frame):
+        tempo_map = self.tempo_map
+        self._segment_index = index
+        segment = tempo_map.segments[index]
+        self.segment = segment
+        if index + 1 < len(tempo_map.segments):
+            self._end_frame = tempo_map.start_frames[index + 1]
+        else:
+            self._end_frame = None
+        units = segment.units_at(frame)
+        self.bar, self.beat, self.tick, self.bar_start_tick = segment.bbt(units)
+        self._units = units % segment.units_per_tick
+        self._step_frames = None
+
+    def seek(self, frame):
+        """
+        Moves the engine to frame.
+        :return: True if the tempo segment changed.
+        """
+        index = self._segment_index
+        if index is None or frame < self._frame or frame < self.segment.start_frame:
+            self._enter(self.tempo_map.segment_index(frame), frame)
+        elif self._end_frame is not None and frame >= self._end_frame:
+            if (index + 2 >= len(self.tempo_map.segments)
+                    or frame < self.tempo_map.start_frames[index + 2]):
+                self._enter(index + 1, frame)
+            else:
+                self._enter(self.tempo_map.segment_index(frame), frame)
+        else:
+            self._advance(frame - self._frame)
+            self._frame = frame
+            return False
+        self._frame = frame
+        return True
+
+    def _advance(self, frames):
+        """
+        Advances the position by frames within the current segment.
+        """
+        segment = self.segment
+        if frames != self._step_frames:
+            self._step_frames = frames
+            self._step_ticks, self._step_units = divmod(frames * segment.units_per_frame,
+                                                        segment.units_per_tick)
+        units = self._units + self._step_units
+        tick = self.tick + self._step_ticks
+        if units >= segment.units_per_tick:
+            units -= segment.units_per_tick
+            tick += 1
+        self._units = units
+        ticks_per_beat = segment._ticks_per_beat
+        if tick < ticks_per_beat:
+            self.tick = tick
+            return
+        beat = self.beat + tick // ticks_per_beat
+        self.tick = tick % ticks_per_beat
+        beats_per_bar = segment._beats_per_bar
+        if beat > beats_per_bar:
+            bars = (beat - 1) // beats_per_bar
+            beat -= bars * beats_per_bar
+            self.bar += bars
+            self.bar_start_tick += bars * segment._ticks_per_bar
+        self.beat = beat
+
+    def write_bbt(self, pos):
+        """
+        Writes bar, beat, tick and bar_start_tick of the current frame.
+        :param pos: cdata object, jack_position_t C struct
+        :return: None
+        """
+        pos.bar = self.bar
+        pos.beat = self.beat
+        pos.tick = self.tick
+        pos.bar_start_tick = self.bar_start_tick
+
+    def write_tempo_and_meter(self, pos):
+        """
+        Writes the tempo and meter of the current segment and marks the BBT fields valid.
+        :param pos: cdata object, jack_position_t C struct
+        :return: None
+        """
+        segment = self.segment
+        pos.valid = pos.valid | jack._lib.JackPositionBBT
+        pos.beats_per_bar = segment.beats_per_bar
+        pos.beat_type = segment.beat_type
+        pos.ticks_per_beat = segment.ticks_per_beat
+        pos.beats_per_minute = segment.beats_per_minute
@@ -0,0 +1,167 @@
+from array import array
+
+# marks an empty slot. Beat numbers below 1 occur when the timebase master reports bar 0.
+_EMPTY = -2 ** 63
+# missing beats BeatMap.latest counts down past, e.g. across gaps left by locates, before it sorts
+# the map instead.
+_LATEST_MISSES = 1024
+
+
+class BeatMap(object):
+    """
+    Beat window information of each recorded beat, keyed by absolute beat number.
+
+    Unbounded: every recorded beat is kept for the life of the BeatStateMachine.
+    """
+    def __init__(self):
+        self.beats = {}
+        # lowest and highest recorded beat numbers.
+        self._first = -_EMPTY
+        self._last = _EMPTY
+
+    def record(self, beat_number, window_start, window_end, fpb_group):
+        """
+        Stores the window of frames in which beat_number was detected.
+        :param beat_number: absolute beat number
+        :param window_start: first frame of the window
+        :param window_end: last frame of the window
+        :param fpb_group: fpb group current when the beat was recorded
+        :return: None
+        """
+        self.beats[beat_number] = {'beat_window': (window_start, window_end),
+                                   'fpb_group': fpb_group,
+                                   'checked': False}
+        if beat_number < self._first:
+            self._first = beat_number
+        if beat_number > self._last:
+            self._last = beat_number
+
+    def evictee(self, beat_number):
+        """
+        Returns the beat number that recording beat_number would evict, or None.
+        """
+        return None
+
+    def window(self, beat_number):
+        return self.beats[beat_number]['beat_window']
+
+    def group(self, beat_number):
+        return self.beats[beat_number]['fpb_group']
+
+    def checked(self, beat_number):
+        return self.beats[beat_number]['checked']
+
+    def check(self, beat_number):
+        self.beats[beat_number]['checked'] = True
+
+    def items(self):
+        return self.beats.items()
+
+    def latest(self, count):
+        """
+        Returns the count highest recorded beat numbers in ascending order. Beats are recorded in
+        runs, so they are found by counting down from the highest beat rather than by sorting
+        the map, unless locates left gaps of thousands of beats below it. May be called while
+        beats are recorded from another thread.
+        """
+        beats = self.beats
+        latest = []
+        beat_number = self._last
+        first = self._first
+        misses = 0
+        while len(latest) < count and beat_number >= first:
+            if beat_number in beats:
+                latest.append(beat_number)
+            else:
+                misses += 1
+                if misses > _LATEST_MISSES:
+                    return sorted(beats)[-count:]
+            beat_number -= 1
+        latest.reverse()
+        return latest
+
+    def __contains__(self, beat_number):
+        return beat_number in self.beats
+
+    def __iter__(self):
+        return iter(self.beats)
+
+    def __len__(self):
+        return len(self.beats)
+
+
+class CompactBeatMap(BeatMap):
+    """
+    Beat map holding at most `retention` beats in preallocated arrays.
+
+    Beats are stored in the slot beat_number % retention, so recording a beat evicts the beat
+    `retention` beats before it and neither recording nor lookup allocates. The accuracy gained
+    from evicted beats is kept by the BeatStateMachine, see BeatStateMachine.evict_beat.
+    """
+    def __init__(self, retention):
+        if retention < 1:
+            raise ValueError('beat map retention must be at least 1 beat')
+        self.retention = retention
+        # beat number held by each slot
+        self._beat_numbers = array('q', [_EMPTY]) * retention
+        self._window_starts = array('q', [0]) * retention
+        self._window_ends = array('q', [0]) * retention
+        self._fpb_groups = array('l', [0]) * retention
+        self._checked = array('b', [0]) * retention
+        self._count = 0
+
+    def record(self, beat_number, window_start, window_end, fpb_group):
+        slot = beat_number % self.retention
+        if self._beat_numbers[slot] == _EMPTY:
+            self._count += 1
+        self._beat_numbers[slot] = beat_number
+        self._window_starts[slot] = window_start
+        self._window_ends[slot] = window_end
+        self._fpb_groups[slot] = fpb_group
+        self._checked[slot] = 0
+
+    def evictee(self, beat_number):
+        evicted = self._beat_numbers[beat_number % self.retention]
+        if evicted == _EMPTY or evicted == beat_number:
+            return None
+        return evicted
+
+    def _slot(self, beat_number):
+        slot = beat_number % self.retention
+        if self._beat_numbers[slot] != beat_number:
+            raise KeyError(beat_number)
+        return slot
+
+    def window(self, beat_number):
+        slot = self._slot(beat_number)
+        return self._window_starts[slot], self._window_ends[slot]
+
+    def group(self, beat_number):
+        return self._fpb_groups[self._slot(beat_number)]
+
+    def checked(self, beat_number):
+        return bool(self._checked[self._slot(beat_number)])
+
+    def check(self, beat_number):
+        self._checked[self._slot(beat_number)] = 1
+
+    def latest(self, count):
+        return sorted(self)[-count:]
+
+    def items(self):
+        for beat_number in self:
+            slot = beat_number % self.retention
+            yield beat_number, {'beat_window': (self._window_starts[slot], self._window_ends[slot]),
+                                'fpb_group': self._fpb_groups[slot],
+                                'checked': bool(self._checked[slot])}
+
+    def __contains__(self, beat_number):
+        return self._beat_numbers[beat_number % self.retention] == beat_number
+
+    def __iter__(self):
+        for beat_number in self._beat_numbers:
+            if beat_number != _EMPTY:
+                yield beat_number
+
+    def __len__(self):
+        return self._count
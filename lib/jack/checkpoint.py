@@ -0,0 +1,225 @@
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from fractions import Fraction
+from math import inf
+from lib.jack.estimators import STATE_FIELDS
+
+MAGIC = b'JTBEATS1'
+VERSION = 1
+
+# marks a missing integer, e.g. the end beat of the last segment.
+_NONE = -2 ** 63
+# stands for an infinite fpb bound, negated for -inf.
+_INF = 2 ** 63 - 1
+# bytes of the numerator and of the denominator of an exact start frame. A start frame
+# estimated from a tempo double has a denominator of up to 106 bits.
+_FRACTION_BYTES = 32
+
+# magic, version, frame rate, tempo, beats per bar, number of the current segment, number of
+# meters, segments and beats that follow.
+_HEADER = struct.Struct('<8sQdddqqqq')
+# first bar, its absolute beat number, beats per bar.
+_METER = struct.Struct('<qqq')
+# number, start beat, end beat, start frame numerator and denominator, start window, fpb range,
+# evicted fpb bounds, then the least-squares estimator state: its floats, origin beat and origin
+# frame numerator and denominator.
+_SEGMENT = struct.Struct('<qqq{0}s{0}sqqqqqq'.format(_FRACTION_BYTES) + 'd' * STATE_FIELDS
+                         + 'q{0}s{0}s'.format(_FRACTION_BYTES))
+# beat number, window start, window end, segment number, checked.
+_BEAT = struct.Struct('<qqqqq')
+
+# learned state of a BeatStateMachine. meters is a list of (bar, beat, beats per bar) tuples,
+# segments a list of SegmentState and beats a list of
+# (beat, window_start, window_end, segment number, checked) tuples, oldest first.
+Checkpoint = namedtuple('Checkpoint', ['frame_rate', 'beats_per_minute', 'beats_per_bar',
+                                       'meters', 'current_segment', 'segments', 'beats'])
+
+SegmentState = namedtuple('SegmentState', ['number', 'start_beat', 'end_beat', 'start_frame',
+                                           'start_window', 'fpb', 'evicted_fpb', 'estimator'])
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def _pack_fraction(value):
+    value = Fraction(value)
+    return (value.numerator.to_bytes(_FRACTION_BYTES, 'little', signed=True),
+            value.denominator.to_bytes(_FRACTION_BYTES, 'little'))
+
+
+def _unpack_fraction(numerator, denominator, path):
+    denominator = int.from_bytes(denominator, 'little')
+    if not denominator:
+        raise CheckpointError('{0} is corrupt'.format(path))
+    return Fraction(int.from_bytes(numerator, 'little', signed=True), denominator)
+
+
+def _pack_bound(bound):
+    if bound == inf:
+        return _INF
+    if bound == -inf:
+        return -_INF
+    return bound
+
+
+def _unpack_bound(bound):
+    if bound == _INF:
+        return inf
+    if bound == -_INF:
+        return -inf
+    return bound
+
+
+def write_checkpoint(checkpoint, path):
+    """
+    Writes a checkpoint to path, replacing the previous file atomically.
+    :param checkpoint: Checkpoint
+    :param path: file to write
+    :return: None
+    """
+    size = (_HEADER.size + _METER.size * len(checkpoint.meters)
+            + _SEGMENT.size * len(checkpoint.segments) + _BEAT.size * len(checkpoint.beats))
+    buffer = bytearray(size)
+    _HEADER.pack_into(buffer, 0, MAGIC, VERSION, checkpoint.frame_rate,
+                      checkpoint.beats_per_minute, checkpoint.beats_per_bar,
+                      checkpoint.current_segment, len(checkpoint.meters),
+                      len(checkpoint.segments), len(checkpoint.beats))
+    offset = _HEADER.size
+    for meter in checkpoint.meters:
+        _METER.pack_into(buffer, offset, *meter)
+        offset += _METER.size
+    for segment in checkpoint.segments:
+        window_start, window_end = segment.start_window or (_NONE, _NONE)
+        estimator = segment.estimator
+        _SEGMENT.pack_into(buffer, offset, segment.number, segment.start_beat,
+                           _NONE if segment.end_beat is None else segment.end_beat,
+                           *_pack_fraction(segment.start_frame), window_start, window_end,
+                           segment.fpb[0], segment.fpb[1], _pack_bound(segment.evicted_fpb[0]),
+                           _pack_bound(segment.evicted_fpb[1]), *estimator[:STATE_FIELDS],
+                           estimator[STATE_FIELDS], *_pack_fraction(estimator[STATE_FIELDS + 1]))
+        offset += _SEGMENT.size
+    for beat in checkpoint.beats:
+        _BEAT.pack_into(buffer, offset, *beat)
+        offset += _BEAT.size
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(buffer)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temporary, path)
+
+
+def read_checkpoint(path, pos):
+    """
+    Memory-maps a checkpoint and checks that it was learned at the sample rate, tempo and meter
+    of pos.
+    :param path: file written by write_checkpoint
+    :param pos: cdata object, jack_position_t C struct, via jack-python
+    :return: Checkpoint
+    :raises CheckpointError: if the file is missing, corrupt or does not match pos
+    """
+    try:
+        with open(path, 'rb') as checkpoint_file:
+            data = mmap.mmap(checkpoint_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        raise CheckpointError('cannot map {0}: {1}'.format(path, e))
+    with data:
+        if len(data) < _HEADER.size:
+            raise CheckpointError('{0} is truncated'.format(path))
+        (magic, version, frame_rate, beats_per_minute, beats_per_bar, current_segment,
+         meter_count, segment_count, beat_count) = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise CheckpointError('{0} is not a beat model checkpoint version {1}'
+                                  .format(path, VERSION))
+        if len(data) != (_HEADER.size + _METER.size * meter_count
+                         + _SEGMENT.size * segment_count + _BEAT.size * beat_count):
+            raise CheckpointError('{0} is truncated'.format(path))
+        meters = []
+        offset = _HEADER.size
+        for _ in range(meter_count):
+            meters.append(_METER.unpack_from(data, offset))
+            offset += _METER.size
+        segments = []
+        for _ in range(segment_count):
+            fields = _SEGMENT.unpack_from(data, offset)
+            (number, start_beat, end_beat, numerator, denominator, window_start, window_end,
+             fpb_low, fpb_high, evicted_fpb_lower, evicted_fpb_upper) = fields[:11]
+            origin_beat, origin_numerator, origin_denominator = fields[-3:]
+            segments.append(SegmentState(
+                number, start_beat, None if end_beat == _NONE else end_beat,
+                _unpack_fraction(numerator, denominator, path),
+                None if window_start == _NONE else (window_start, window_end),
+                (fpb_low, fpb_high),
+                (_unpack_bound(evicted_fpb_lower), _unpack_bound(evicted_fpb_upper)),
+                fields[11:-3] + (origin_beat,
+                                 _unpack_fraction(origin_numerator, origin_denominator, path))))
+            offset += _SEGMENT.size
+        beats = []
+        for _ in range(beat_count):
+            beats.append(_BEAT.unpack_from(data, offset))
+            offset += _BEAT.size
+    if not segments or current_segment not in {segment.number for segment in segments}:
+        raise CheckpointError('{0} has no current tempo segment'.format(path))
+    if not meters:
+        raise CheckpointError('{0} has no meter'.format(path))
+    checkpoint = Checkpoint(frame_rate, beats_per_minute, beats_per_bar, meters, current_segment,
+                            segments, beats)
+    check_checkpoint(checkpoint, pos)
+    return checkpoint
+
+
+def check_checkpoint(checkpoint, pos):
+    """
+    Checks that a checkpoint was learned at the sample rate, tempo and meter of pos.
+    :param checkpoint: Checkpoint
+    :param pos: cdata object, jack_position_t C struct, via jack-python
+    :return: None
+    :raises CheckpointError: if the checkpoint does not match pos
+    """
+    if checkpoint.frame_rate != pos.frame_rate:
+        raise CheckpointError('checkpoint sample rate {0} does not match {1}'
+                              .format(checkpoint.frame_rate, pos.frame_rate))
+    if abs(checkpoint.beats_per_minute - pos.beats_per_minute) > 1e-6 \
+            or checkpoint.beats_per_bar != pos.beats_per_bar:
+        raise CheckpointError('checkpoint tempo {0} bpm {1} beats per bar does not match '
+                              '{2} bpm {3} beats per bar'
+                              .format(checkpoint.beats_per_minute, checkpoint.beats_per_bar,
+                                      pos.beats_per_minute, pos.beats_per_bar))
+
+
+class CheckpointWriter(threading.Thread):
+    """
+    Normal-priority thread that periodically checkpoints a BeatStateMachine, so that a restarted
+    client starts with the beat model it had learned.
+    """
+    def __init__(self, beat_state, path, interval=5.0, beats=64):
+        """
+        :param beat_state: BeatStateMachine to checkpoint
+        :param path: file to write
+        :param interval: seconds between checkpoints
+        :param beats: number of recent beat windows kept in the checkpoint
+        """
+        super(CheckpointWriter, self).__init__(name='jacktime-checkpoint', daemon=True)
+        self.beat_state = beat_state
+        self.path = path
+        self.interval = interval
+        self.beats = beats
+        self._stopevent = threading.Event()
+
+    def run(self):
+        while not self._stopevent.wait(self.interval):
+            self.write()
+        self.write()
+
+    def write(self):
+        write_checkpoint(self.beat_state.checkpoint(self.beats), self.path)
+
+    def stop(self):
+        self._stopevent.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,163 @@
+from array import array
+from math import isfinite, isnan, nan
+
+# fields of a ControlBuffer state. nan leaves the master's tempo or meter as it is.
+TEMPO = 0
+BEATS_PER_BAR = 1
+BEAT_TYPE = 2
+# frame of the latest locate and the number of locates requested, which changes with each one.
+LOCATE_FRAME = 3
+LOCATES = 4
+FIELDS = 5
+
+DEFAULT_PORT = 5750
+
+# shortest tempo segment, in seconds, that a change through the control buffer starts, and the
+# interval the control server coalesces commands over. See PyJackTimebaseMaster.apply_control.
+CONTROL_SPAN = 0.05
+
+# largest frame a locate may request, that of a jack_nframes_t.
+MAX_FRAME = 2 ** 32 - 1
+# largest beats per bar, as the beat is written to an int32_t.
+MAX_BEATS_PER_BAR = 2 ** 31 - 1
+
+
+class ControlBuffer(object):
+    """
+    Lock-free double buffer handing the latest requested tempo, meter and locate from the control
+    thread to the JACK process thread.
+
+    The writer fills the buffer the reader is not reading and then advances the sequence, whose
+    low bit names the buffer holding the latest state. The reader copies that buffer into
+    preallocated storage and discards the copy if the sequence changed while it was copied, as
+    the writer may then be filling the buffer being copied; it tries again the next cycle.
+    Neither side blocks, and a state published several times between two reads is only read
+    once, in its latest version.
+
+    The reader's owner may set prepare to a function of the state, which publish calls in the
+    writer thread. Its result is handed over with the state as prepared, so that work the state
+    calls for, such as building a tempo, is done before the process callback reads it.
+    """
+    def __init__(self):
+        self._buffers = array('d', [nan, nan, nan, 0.0, 0.0]) * 2
+        self._prepared_buffers = [None, None]
+        self._sequence = array('q', [0])
+        # last state read and the object prepared from it, only written by the reader.
+        self.state = array('d', [nan, nan, nan, 0.0, 0.0])
+        self.prepared = None
+        self._read_sequence = 0
+        self.prepare = None
+
+    def publish(self, state):
+        """
+        Publishes a state. Only to be called from the one writer thread.
+        :param state: sequence of FIELDS floats
+        :return: None
+        """
+        sequence = self._sequence[0]
+        index = (sequence + 1) & 1
+        offset = index * FIELDS
+        buffers = self._buffers
+        for field in range(FIELDS):
+            buffers[offset + field] = state[field]
+        prepare = self.prepare
+        self._prepared_buffers[index] = prepare(state) if prepare is not None else None
+        self._sequence[0] = sequence + 1
+
+    def read(self):
+        """
+        Copies the latest state into state, and the object prepared from it into prepared, if
+        one was published since the last read. Does not allocate or block, so it is safe to call
+        from the JACK process thread.
+        :return: True if state holds a newly published state.
+        """
+        sequence = self._sequence[0]
+        if sequence == self._read_sequence:
+            return False
+        index = sequence & 1
+        offset = index * FIELDS
+        buffers = self._buffers
+        state = self.state
+        for field in range(FIELDS):
+            state[field] = buffers[offset + field]
+        prepared = self._prepared_buffers[index]
+        if self._sequence[0] != sequence:
+            # the writer published meanwhile and may be refilling the buffer being copied.
+            return False
+        self.prepared = prepared
+        self._read_sequence = sequence
+        return True
+
+
+class ControlError(ValueError):
+    pass
+
+
+def parse_command(line, state):
+    """
+    Applies one command to a requested state:
+        tempo BPM
+        meter BEATS_PER_BAR/BEAT_TYPE
+        locate FRAME
+    :param line: command text
+    :param state: mutable sequence of FIELDS floats
+    :return: None
+    :raises ControlError: if the command is not understood
+    """
+    words = line.split()
+    if not words:
+        return
+    try:
+        if words[0] == 'tempo' and len(words) == 2:
+            tempo = float(words[1])
+            if not (isfinite(tempo) and tempo > 0):
+                raise ControlError('tempo must be positive and finite: {0!r}'.format(line))
+            state[TEMPO] = tempo
+        elif words[0] == 'meter' and len(words) == 2:
+            beats_per_bar, beat_type = parse_time_signature(words[1])
+            state[BEATS_PER_BAR] = beats_per_bar
+            state[BEAT_TYPE] = beat_type
+        elif words[0] == 'locate' and len(words) == 2:
+            frame = int(words[1])
+            if not 0 <= frame <= MAX_FRAME:
+                raise ControlError('locate frame must be from 0 to {0}: {1!r}'.format(MAX_FRAME,
+                                                                                      line))
+            state[LOCATE_FRAME] = frame
+            state[LOCATES] += 1
+        else:
+            raise ControlError('unknown command {0!r}'.format(line))
+    except ControlError:
+        raise
+    except ValueError:
+        raise ControlError('bad argument in {0!r}'.format(line))
+
+
+def parse_time_signature(text):
+    """
+    Parses a time signature such as 7/8. The master counts whole beats, so beats_per_bar must be
+    a whole number from 1 to MAX_BEATS_PER_BAR.
+    :return: tuple (beats_per_bar, beat_type)
+    :raises ValueError: if the time signature is not one the master can count
+    """
+    beats_per_bar, _, beat_type = text.partition('/')
+    beats_per_bar = float(beats_per_bar)
+    beat_type = float(beat_type or 4)
+    if (not 1 <= beats_per_bar <= MAX_BEATS_PER_BAR or not beats_per_bar.is_integer()
+            or beat_type not in (1, 2, 4, 8, 16, 32, 64)):
+        raise ValueError('bad time signature {0!r}'.format(text))
+    return beats_per_bar, beat_type
+
+
+def changed(current, requested):
+    """
+    Returns True if a requested tempo or meter field differs from the current value; nan
+    requests nothing.
+    """
+    return not isnan(requested) and requested != current
+
+
+def requested(current, requested_value):
+    """
+    Returns the value a tempo or meter field has once a request is applied; nan requests nothing.
+    """
+    return current if isnan(requested_value) else requested_value
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+from math import nan
+from lib.jack.control import CONTROL_SPAN, DEFAULT_PORT, ControlError, parse_command
+
+
+class ControlServer(threading.Thread):
+    """
+    Normal-priority thread serving tempo, meter and locate commands on a UDP or Unix datagram
+    socket with asyncio.
+
+    A datagram holds one or more commands, one per line (see parse_command). Datagrams are read
+    as they arrive, so senders never wait on a full socket, and applied to the requested state.
+    The state is published to the ControlBuffer at once if nothing was published for interval,
+    so that the master applies a single command at the next cycle boundary; otherwise it is
+    published once, interval after the last publication. However many commands arrive, such as
+    from a tempo fader being swept, the process callback sees at most one change per interval.
+    Bad commands, and states the buffer fails to prepare, are reported to stderr and ignored.
+    """
+    def __init__(self, buffer, address=None, interval=CONTROL_SPAN):
+        """
+        :param buffer: ControlBuffer read by the master
+        :param address: path of a Unix socket, or [host:]port of a UDP socket; by default
+        localhost:DEFAULT_PORT
+        :param interval: shortest time between two publications, in seconds; by default the
+        shortest tempo segment the master starts for a control change
+        """
+        super(ControlServer, self).__init__(name='jacktime-control', daemon=True)
+        self.buffer = buffer
+        self.address = address
+        self.interval = interval
+        self.state = [nan, nan, nan, 0.0, 0.0]
+        # last state published, which a state that fails to prepare is replaced with.
+        self._published_state = list(self.state)
+        self.received = 0
+        self.published = 0
+        self.errors = 0
+        self._loop = asyncio.new_event_loop()
+        # loop time of the last publication, and the pending publication, if one is scheduled.
+        self._published_at = None
+        self._publication = None
+        self._socket = self._bind(address)
+        self._socket.setblocking(False)
+        self._ready = threading.Event()
+
+    @staticmethod
+    def _bind(address):
+        if address is not None and '/' in address:
+            if os.path.exists(address):
+                os.unlink(address)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(address)
+            return sock
+        host, port = 'localhost', DEFAULT_PORT
+        if address:
+            host, _, port = address.rpartition(':')
+            host = host or 'localhost'
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, int(port)))
+        return sock
+
+    def run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.add_reader(self._socket, self._readable)
+        self._ready.set()
+        self._loop.run_forever()
+
+    def _readable(self):
+        """
+        Applies every pending datagram to the requested state and publishes it, now or once
+        interval has passed since the last publication.
+        """
+        received = self.received
+        while True:
+            try:
+                data = self._socket.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                print('control socket error: {0}'.format(e), file=sys.stderr)
+                break
+            self.received += 1
+            self.receive(data)
+        if self.received == received or self._publication is not None:
+            return
+        now = self._loop.time()
+        if self._published_at is None or now >= self._published_at + self.interval:
+            self._publish_pending()
+        else:
+            self._publication = self._loop.call_at(self._published_at + self.interval,
+                                                   self._publish_pending)
+
+    def _publish_pending(self):
+        self._publication = None
+        self._published_at = self._loop.time()
+        self.publish()
+
+    def publish(self):
+        """
+        Publishes the requested state. If the buffer fails to prepare it, the state is discarded
+        and the last published one requested again.
+        """
+        try:
+            self.buffer.publish(self.state)
+        except Exception as e:
+            self.errors += 1
+            print('control: discarding {0}: {1}'.format(self.state, e), file=sys.stderr)
+            self.state = list(self._published_state)
+            return
+        self.published += 1
+        self._published_state = list(self.state)
+
+    def receive(self, data):
+        """
+        Applies the commands of a datagram to the requested state.
+        """
+        for line in data.decode(errors='replace').splitlines():
+            try:
+                parse_command(line, self.state)
+            except ControlError as e:
+                self.errors += 1
+                print('control: {0}'.format(e), file=sys.stderr)
+
+    def stop(self):
+        if self.is_alive():
+            self._ready.wait()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self.join()
+        self._socket.close()
+        self._loop.close()
+        if self.address is not None and '/' in self.address:
+            try:
+                os.unlink(self.address)
+            except FileNotFoundError:
+                pass
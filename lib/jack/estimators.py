@@ -0,0 +1,288 @@
+import time
+from fractions import Fraction
+from math import sqrt
+
+# skew types, see LeastSquaresBeatEstimator.skew_type.
+SKEW_NONE = 'none'
+SKEW_LINEAR = 'linear'
+SKEW_PERIODIC = 'periodic'
+SKEW_BAR = 'bar'
+
+# number of floats returned by LeastSquaresBeatEstimator.state, followed by the exact beat
+# number and frame of its origin.
+STATE_FIELDS = 18
+# weight of each new miss in the running mean misses of the fit and of the fpb range, see add.
+MISS_WEIGHT = 0.25
+# number of recent beats whose outliers are counted, see skew_type.
+OUTLIER_WINDOW = 32
+_OUTLIER_MASK = (1 << OUTLIER_WINDOW) - 1
+
+
+class LeastSquaresBeatEstimator(object):
+    """
+    Streaming least-squares fit of beat frame against beat number.
+
+    Keeps running means and co-moments updated in O(1) per beat (Welford's method, which stays
+    accurate at large frame numbers), so the beat width, its standard error and the residual skew
+    are available at any time without rescanning recorded beats.
+
+    A quadratic term is fitted alongside to tell beats that keep getting wider or narrower
+    (linear skew) from beats that are consistently early or late (periodic skew). Beats landing
+    more than half a beat away from the fitted line were reported on an unexpected bar; those of
+    the last OUTLIER_WINDOW beats are kept as a bit mask, so an early outlier does not classify
+    the master for the rest of the run.
+
+    Each beat is added once: the beats added span from _low_x to _high_x beats from the origin,
+    and a beat within that span is rejected as already added. Within a segment beats are added
+    in order, so the span only has gaps where a locate skipped beats, which the fit does without.
+
+    Each beat is predicted before it is added, by the fit and, if given, by the fpb range the
+    fit is the alternative to. The running mean misses of both decide which model predictions
+    use, see preferred_over_range.
+
+    The sums are protected by a sequence lock, like lib.telemetry.PositionSnapshot: the sequence
+    is odd while the process callback updates them, so state can be read from another thread.
+    """
+    __slots__ = ('expected_width', 'count', 'outliers', 'fit_miss', 'range_miss', 'scored',
+                 '_recent_outliers', '_origin', '_low_x', '_high_x', '_mean_x', '_mean_y',
+                 '_mean_xx', '_m2_x', '_m2_xx', '_c_xy', '_c_x_xx', '_c_xx_y', '_m2_y',
+                 '_sequence')
+
+    def __init__(self, expected_width):
+        """
+        :param expected_width: frames per beat expected from the tempo
+        """
+        self.expected_width = expected_width
+        self._sequence = 0
+        self.reset()
+
+    def reset(self):
+        self._sequence += 1
+        self.count = 0
+        # beats reported more than half a beat from the fit, and a bit for each of the last
+        # OUTLIER_WINDOW beats that was.
+        self.outliers = 0
+        self._recent_outliers = 0
+        # running mean frames by which the fit and the fpb range missed the beats scored.
+        self.fit_miss = 0.0
+        self.range_miss = 0.0
+        self.scored = 0
+        self._origin = None
+        self._low_x = 0
+        self._high_x = 0
+        self._mean_x = 0.0
+        self._mean_y = 0.0
+        self._mean_xx = 0.0
+        self._m2_x = 0.0
+        self._m2_xx = 0.0
+        self._m2_y = 0.0
+        self._c_xy = 0.0
+        self._c_x_xx = 0.0
+        self._c_xx_y = 0.0
+        self._sequence += 1
+
+    def state(self):
+        """
+        Returns the estimator's sums as a tuple of STATE_FIELDS floats followed by the origin
+        beat, an int, and the origin frame, see restore. Safe to call from a thread other than
+        the one adding beats: a state copied while a beat was added is copied again.
+        """
+        while True:
+            sequence = self._sequence
+            if not sequence & 1:
+                origin_beat, origin_frame = self._origin or (0, 0)
+                state = (self.expected_width, self.count, self.outliers,
+                         self._recent_outliers, self.fit_miss, self.range_miss, self.scored,
+                         float(self._low_x), float(self._high_x), self._mean_x, self._mean_y,
+                         self._mean_xx, self._m2_x, self._m2_xx, self._m2_y, self._c_xy,
+                         self._c_x_xx, self._c_xx_y, origin_beat, origin_frame)
+                if self._sequence == sequence:
+                    return state
+            time.sleep(0)
+
+    def restore(self, state):
+        """
+        Restores sums returned by state.
+        """
+        self._sequence += 1
+        (self.expected_width, count, outliers, recent_outliers, self.fit_miss,
+         self.range_miss, scored, low_x, high_x, self._mean_x, self._mean_y, self._mean_xx,
+         self._m2_x, self._m2_xx, self._m2_y, self._c_xy, self._c_x_xx, self._c_xx_y,
+         origin_beat, origin_frame) = state
+        self.count = int(count)
+        self.outliers = int(outliers)
+        self._recent_outliers = int(recent_outliers)
+        self.scored = int(scored)
+        self._low_x = int(low_x)
+        self._high_x = int(high_x)
+        self._origin = (int(origin_beat), origin_frame) if self.count else None
+        self._sequence += 1
+
+    def add(self, beat_number, frame, window=0, range_frame=None):
+        """
+        Adds an observed beat frame, first scoring the fit's prediction of it and range_frame.
+        A prediction misses the beat by the frames it falls outside the beat's window. A beat
+        within the span of the beats already added is rejected, see the class docstring.
+        :param beat_number: absolute beat number
+        :param frame: frame at which the beat was observed, the middle of its window
+        :param window: width in frames of the window the beat was observed in
+        :param range_frame: frame the fpb range predicted for the beat, or None
+        :return: True if the beat was added, False if it was rejected
+        """
+        if self._origin is None:
+            x = 0
+        else:
+            x = beat_number - self._origin[0]
+            if self._low_x <= x <= self._high_x:
+                return False
+        self._sequence += 1
+        if self._origin is None:
+            self._origin = (beat_number, frame)
+        elif x < self._low_x:
+            self._low_x = x
+        else:
+            self._high_x = x
+        # the offset from the origin is exact and small, whatever the magnitude of the frames.
+        y = float(frame - self._origin[1])
+        if self.count >= 2:
+            fit_miss = abs(y - self._fit(x))
+            outlier = fit_miss > self.width / 2
+            self.outliers += outlier
+            self._recent_outliers = ((self._recent_outliers << 1) | outlier) & _OUTLIER_MASK
+            if range_frame is not None:
+                fit_miss = max(fit_miss - window / 2, 0.0)
+                range_miss = max(abs(float(range_frame - frame)) - window / 2, 0.0)
+                if self.scored:
+                    self.fit_miss += (fit_miss - self.fit_miss) * MISS_WEIGHT
+                    self.range_miss += (range_miss - self.range_miss) * MISS_WEIGHT
+                else:
+                    self.fit_miss = fit_miss
+                    self.range_miss = range_miss
+                self.scored += 1
+        xx = float(x * x)
+
+        self.count += 1
+        n = self.count
+        dx = x - self._mean_x
+        dxx = xx - self._mean_xx
+        dy = y - self._mean_y
+        self._mean_x += dx / n
+        self._mean_xx += dxx / n
+        self._mean_y += dy / n
+        # co-moments use the deviation before and after updating the mean.
+        self._m2_x += dx * (x - self._mean_x)
+        self._m2_xx += dxx * (xx - self._mean_xx)
+        self._m2_y += dy * (y - self._mean_y)
+        self._c_xy += dx * (y - self._mean_y)
+        self._c_x_xx += dx * (xx - self._mean_xx)
+        self._c_xx_y += dxx * (y - self._mean_y)
+        self._sequence += 1
+        return True
+
+    def _fit(self, x):
+        return self._mean_y + self.width * (x - self._mean_x)
+
+    @property
+    def width(self):
+        """
+        Fitted frames per beat, or the expected width until two beats are observed.
+        """
+        if self.count < 2 or self._m2_x == 0:
+            return self.expected_width
+        return self._c_xy / self._m2_x
+
+    def predict(self, beat_number):
+        """
+        Returns the fitted frame of beat_number.
+        """
+        if self._origin is None:
+            return None
+        return self._origin[1] + self._fit(beat_number - self._origin[0])
+
+    def line(self, beat_number):
+        """
+        Returns the fitted frame of beat_number and the fitted width as Fractions. The fit
+        relative to the origin is small and computed in floats; the origin frame is added
+        exactly, so the sum is not rounded at large frames as it is by predict.
+        :return: tuple (frame, width)
+        """
+        origin_beat, origin_frame = self._origin
+        return (Fraction(origin_frame) + Fraction(self._fit(beat_number - origin_beat)),
+                Fraction(self.width))
+
+    @property
+    def residual(self):
+        """
+        Standard deviation of observed beat frames around the fit, in frames.
+        """
+        if self.count < 3 or self._m2_x == 0:
+            return 0.0
+        sse = max(self._m2_y - self._c_xy * self._c_xy / self._m2_x, 0.0)
+        return sqrt(sse / (self.count - 2))
+
+    @property
+    def width_error(self):
+        """
+        Standard error of the fitted beat width, in frames, or None below three beats.
+        """
+        if self.count < 3 or self._m2_x == 0:
+            return None
+        return self.residual / sqrt(self._m2_x)
+
+    @property
+    def skew_percent(self):
+        """
+        Percent difference between the observed and the expected beat width.
+        """
+        return (self.width - self.expected_width) / self.expected_width * 100
+
+    def curvature(self):
+        """
+        Change in beat width per beat from a quadratic fit, with its standard error.
+        :return: tuple (change, error), or None below four beats
+        """
+        if self.count < 4:
+            return None
+        # solve the 2x2 normal equations of the centred quadratic fit.
+        det = self._m2_x * self._m2_xx - self._c_x_xx * self._c_x_xx
+        if det <= 0:
+            return None
+        quadratic = (self._m2_x * self._c_xx_y - self._c_x_xx * self._c_xy) / det
+        linear = (self._m2_xx * self._c_xy - self._c_x_xx * self._c_xx_y) / det
+        sse = max(self._m2_y - linear * self._c_xy - quadratic * self._c_xx_y, 0.0)
+        error = sqrt(sse / (self.count - 3) * self._m2_x / det)
+        return 2 * quadratic, 2 * error
+
+    @property
+    def recent_outliers(self):
+        """
+        Number of the last OUTLIER_WINDOW beats reported more than half a beat from the fit.
+        """
+        return bin(self._recent_outliers).count('1')
+
+    def skew_type(self, tolerance):
+        """
+        Classifies the skew of the observed beats.
+        :param tolerance: frames of error attributed to measurement, e.g. the beat window size
+        :return: SKEW_BAR if any of the last OUTLIER_WINDOW beats was reported on an unexpected
+        bar, SKEW_LINEAR if the beat
+        width changes beat to beat, SKEW_PERIODIC if beats are consistently early or late
+        relative to the expected grid, otherwise SKEW_NONE.
+        """
+        if self._recent_outliers:
+            return SKEW_BAR
+        curvature = self.curvature()
+        if curvature is not None:
+            change, error = curvature
+            if abs(change) > 3 * error and abs(change) * self.count > tolerance:
+                return SKEW_LINEAR
+        if self.count >= 2 and abs(self.width - self.expected_width) * self.count > tolerance:
+            return SKEW_PERIODIC
+        return SKEW_NONE
+
+    def preferred_over_range(self):
+        """
+        Returns True if this fit has missed the beats scored by add by fewer frames than the fpb
+        range, in the running means of both. Until a beat is scored the range is preferred.
+        """
+        return self.scored > 0 and self.fit_miss < self.range_miss
@@ -0,0 +1,157 @@
+from bisect import bisect_right
+from fractions import Fraction
+from math import inf
+from lib.jack.estimators import LeastSquaresBeatEstimator
+from lib.jack.frames import BeatLine
+
+
+class FpbSegment(object):
+    """
+    A run of beats recorded at one tempo and the range of frames per beat they allow.
+    """
+    __slots__ = ('number', 'fpb', 'start_beat', 'end_beat', 'start_frame', 'start_window',
+                 'evicted_fpb', 'estimator', '_line', '_line_key')
+
+    def __init__(self, number, fpb, start_beat, start_frame):
+        """
+        :param number: identifies the segment in the beat map, never reused
+        :param fpb: tuple (low, high) frames per beat
+        :param start_beat: first beat of the segment
+        :param start_frame: estimated frame of start_beat until its window is recorded, kept as
+        a Fraction
+        """
+        self.number = number
+        self.fpb = fpb
+        self.start_beat = start_beat
+        # last beat of the segment, or None while the segment is the last.
+        self.end_beat = None
+        self.start_frame = Fraction(start_frame)
+        # window in which start_beat was recorded, see BeatStateMachine.record_beat.
+        self.start_window = None
+        # (lower, upper) fpb bounds implied by beats evicted from the beat map.
+        self.evicted_fpb = (-inf, inf)
+        # least-squares fit of the segment's beats, the alternative to narrowing fpb.
+        self.estimator = LeastSquaresBeatEstimator((fpb[0] + fpb[1]) / 2)
+        # BeatLine of beat_model, and the fpb range, start frame and estimator count it was
+        # built from.
+        self._line = None
+        self._line_key = None
+
+    def beat_model(self):
+        """
+        Returns the frame of the start beat and the frames per beat to predict beats with, from
+        the least-squares fit once it has missed recent beats by less than the fpb range,
+        otherwise from the range.
+        :return: tuple (start_frame, fpb) of Fractions
+        """
+        estimator = self.estimator
+        if estimator.preferred_over_range():
+            return estimator.line(self.start_beat)
+        low, high = self.fpb
+        return self.start_frame, Fraction(low + high) / 2
+
+    def range_frame(self, beat_number):
+        """
+        Returns the frame of beat_number predicted from the middle of the fpb range, as a
+        Fraction.
+        """
+        low, high = self.fpb
+        return self.start_frame + Fraction(low + high, 2) * (beat_number - self.start_beat)
+
+    def beat_line(self):
+        """
+        Returns the BeatLine of beat_model, beat 0 being the start beat. It is rebuilt only when
+        a beat is recorded or the fpb range or start frame change, so the process callback pays
+        for the exact arithmetic once per beat rather than once per prediction.
+        """
+        line = self._line
+        key = self._line_key
+        if (line is None or key[0] is not self.fpb or key[1] is not self.start_frame
+                or key[2] != self.estimator.count):
+            line = self._line = BeatLine(*self.beat_model())
+            self._line_key = (self.fpb, self.start_frame, self.estimator.count)
+        return line
+
+    def __repr__(self):
+        return 'FpbSegment({0}, fpb={1}, start_beat={2}, end_beat={3})'.format(
+            self.number, self.fpb, self.start_beat, self.end_beat)
+
+
+class FpbSegmentIndex(object):
+    """
+    Tempo segments of a BeatStateMachine sorted by start beat, replacing a linear scan of every
+    fpb group with bisection by beat number or frame.
+
+    Segments are appended in O(1). Appending a segment that starts before the last one means the
+    tempo changed somewhere already recorded, so the segments after it are dropped.
+    """
+    def __init__(self):
+        self.segments = []
+        # start beat and start frame of each segment, for bisection.
+        self.start_beats = []
+        self.start_frames = []
+        self._by_number = {}
+        self._next_number = 0
+
+    def append(self, fpb, start_beat, start_frame):
+        """
+        Starts a new segment at start_beat, ending the last segment the beat before.
+        :param fpb: tuple (low, high) frames per beat
+        :param start_beat: first beat of the segment
+        :param start_frame: estimated frame of start_beat
+        :return: the new FpbSegment
+        """
+        while self.segments and self.start_beats[-1] >= start_beat:
+            del self._by_number[self.segments.pop().number]
+            self.start_beats.pop()
+            self.start_frames.pop()
+        if self.segments:
+            self.segments[-1].end_beat = start_beat - 1
+        segment = FpbSegment(self._next_number, fpb, start_beat, start_frame)
+        self._next_number += 1
+        self.segments.append(segment)
+        self.start_beats.append(start_beat)
+        self.start_frames.append(start_frame)
+        self._by_number[segment.number] = segment
+        return segment
+
+    def set_start_window(self, segment, window_start, window_end):
+        """
+        Records the window of a segment's start beat, which also fixes its start frame.
+        """
+        segment.start_window = (window_start, window_end)
+        segment.start_frame = Fraction(window_start + window_end, 2)
+        index = self._position(segment.start_beat)
+        if self.segments[index] is segment:
+            self.start_frames[index] = segment.start_frame
+
+    def _position(self, beat_number):
+        return max(bisect_right(self.start_beats, beat_number) - 1, 0)
+
+    def at_beat(self, beat_number):
+        """
+        Returns the segment active at beat_number, or the first segment before any starts.
+        """
+        return self.segments[self._position(beat_number)]
+
+    def at_frame(self, frame):
+        """
+        Returns the segment active at frame, or the first segment before any starts.
+        """
+        return self.segments[max(bisect_right(self.start_frames, frame) - 1, 0)]
+
+    @property
+    def last(self):
+        return self.segments[-1]
+
+    def __getitem__(self, number):
+        return self._by_number[number]
+
+    def __contains__(self, number):
+        return number in self._by_number
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __len__(self):
+        return len(self.segments)
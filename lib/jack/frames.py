@@ -0,0 +1,98 @@
+from fractions import Fraction
+from functools import lru_cache
+from math import floor, gcd
+
+# bits kept beyond the denominator of a BeatLine, so that rounding it to fixed point moves no
+# prediction of fewer than 2 ** GUARD_BITS beats across a frame boundary.
+GUARD_BITS = 64
+# beat counts BeatLine.frame computes in fixed point.
+FIXED_BEATS = 1 << GUARD_BITS
+
+
+@lru_cache(maxsize=64)
+def frames_per_beat(frame_rate, beats_per_minute):
+    """
+    Returns the exact frames per beat of a tempo, 60 * frame_rate / beats_per_minute, as a
+    Fraction. The tempo is taken at the exact value of its double, so the result does not depend
+    on the order of float operations.
+    """
+    return Fraction(60 * frame_rate) / Fraction(beats_per_minute)
+
+
+@lru_cache(maxsize=64)
+def frames_per_tick(frame_rate, beats_per_minute, ticks_per_beat):
+    """
+    Returns the exact frames per tick of a tempo and tick resolution as a pair of integers
+    (numerator, denominator), so that tick offsets are computed with integer arithmetic only.
+    """
+    ratio = frames_per_beat(frame_rate, beats_per_minute) / Fraction(ticks_per_beat)
+    return ratio.numerator, ratio.denominator
+
+
+class BeatLine(object):
+    """
+    Frames of beats spaced width apart from start, exactly and in fixed point.
+
+    start and width are kept as Fractions for exact arithmetic, and in binary fixed point with
+    bits fractional bits for the process callback, where frame(beats) is one multiply, add and
+    shift of integers whatever the magnitude of the frames.
+
+    Both are rounded up, and 2 ** bits is at least 2 ** GUARD_BITS times the common denominator
+    q of start and width. The fixed-point frame is then at or above the exact one by less than
+    (beats + 1) / 2 ** bits <= 1 / q for beats below 2 ** GUARD_BITS, while an exact frame that
+    is not a whole number is at least 1 / q below the next one, so the floor is exact. Beats are
+    at least a frame wide, which covers every frame below 2 ** 63.
+    """
+    __slots__ = ('start', 'width', 'bits', '_start', '_width', '_one')
+
+    def __init__(self, start, width):
+        """
+        :param start: frame of beat 0 of the line, a Fraction, int or float
+        :param width: frames per beat, a Fraction, int or float
+        """
+        if type(start) is not Fraction:
+            start = Fraction(start)
+        if type(width) is not Fraction:
+            width = Fraction(width)
+        self.start = start
+        self.width = width
+        denominator = start.denominator * width.denominator // gcd(start.denominator,
+                                                                   width.denominator)
+        bits = denominator.bit_length() + GUARD_BITS
+        self.bits = bits
+        self._start = -(-(start.numerator << bits) // start.denominator)
+        self._width = -(-(width.numerator << bits) // width.denominator)
+        self._one = 1 << bits
+
+    def exact(self, beats):
+        """
+        Returns the frame of the beat beats after start as a Fraction.
+        """
+        return self.start + self.width * beats
+
+    def frame(self, beats):
+        """
+        Returns the whole frame in which the beat beats after start falls, floor(exact(beats)),
+        in fixed point for 0 <= beats < 2 ** GUARD_BITS and from the exact frame otherwise.
+        """
+        if 0 <= beats < FIXED_BEATS:
+            return (self._start + self._width * beats) >> self.bits
+        return floor(self.exact(beats))
+
+    def position(self, beats):
+        """
+        Returns the frame of the beat beats after start as the float nearest the fixed-point
+        value, rounded once.
+        """
+        return (self._start + self._width * beats) / self._one
+
+    def offset(self, beats, frame):
+        """
+        Returns the frame of the beat beats after start relative to frame, as a float. The
+        difference is taken in fixed point, so it is as precise at frame 2 ** 62 as at frame 0.
+        :param frame: whole frame, e.g. the first frame of the cycle
+        """
+        return (self._start + self._width * beats - (frame << self.bits)) / self._one
+
+    def __repr__(self):
+        return 'BeatLine({0}, {1})'.format(self.start, self.width)
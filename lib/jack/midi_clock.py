@@ -0,0 +1,247 @@
+import jack
+from array import array
+from math import gcd, inf
+
+# MIDI clock pulses per quarter note.
+PULSES_PER_QUARTER_NOTE = 24
+# MIDI clock pulses per whole note, which a beat of beat type t divides by t.
+PULSES_PER_WHOLE_NOTE = 4 * PULSES_PER_QUARTER_NOTE
+# pulses per MIDI beat, the unit of song position pointers.
+PULSES_PER_SONG_POSITION = 6
+
+CLOCK = b'\xf8'
+START = b'\xfa'
+CONTINUE = b'\xfb'
+STOP = b'\xfc'
+SONG_POSITION = 0xf2
+NOTE_ON = 0x90
+NOTE_OFF = 0x80
+
+
+class MidiClock(object):
+    """
+    Writes MIDI clock, transport and beat events to a JACK MIDI port at the frames predicted by
+    a BeatStateMachine.
+
+    MIDI clock counts PULSES_PER_QUARTER_NOTE pulses per quarter note, so a beat of the JACK
+    meter spans PULSES_PER_WHOLE_NOTE / beat_type pulses: 24 in x/4, 12 in x/8. As that is not
+    whole in every meter, e.g. 1.5 in x/64, pulses are counted in groups of _pulses pulses that
+    span _beats beats. Clock pulses divide the predicted span of each beat accordingly and are
+    written at their offset in the cycle, so they are sample accurate to the extent the beat
+    predictions are. Start, stop and continue follow the transport; a continue is preceded by a
+    song position pointer rounded up to the next sixteenth note, where clocking resumes. Beat
+    and bar notes are switched on with the first clock pulse of the beat, which is the beat's
+    own frame in every meter whose beat is a whole number of pulses, and off half a beat later,
+    or before the stop if the transport stops first.
+
+    Every message is preallocated and the song position pointer is updated in place. The whole
+    frames of a beat's pulses are computed once, when the pulse moves to the beat or the line
+    predicting it is rebuilt, so a cycle computes each pulse's offset with a divmod and an int
+    subtraction; the only objects a cycle creates are the transient ints of offsets and beat
+    numbers too large for CPython's small int cache.
+    """
+    def __init__(self, port, beat_state, beat_note=None, bar_note=None, channel=1, velocity=100):
+        """
+        :param port: python-jack OwnMidiPort to write to
+        :param beat_state: BeatStateMachine predicting the beat frames
+        :param beat_note: note number sounded on each beat, or None
+        :param bar_note: note number sounded on the first beat of each bar in place of
+        beat_note, or None
+        :param channel: MIDI channel of the notes, 1 to 16
+        :param velocity: velocity of the notes
+        """
+        self.port = port
+        self.beat_state = beat_state
+        status = channel - 1
+        self._beat_on = self._note(NOTE_ON | status, beat_note, velocity)
+        self._beat_off = self._note(NOTE_OFF | status, beat_note, 0)
+        self._bar_on = self._note(NOTE_ON | status, bar_note, velocity)
+        self._bar_off = self._note(NOTE_OFF | status, bar_note, 0)
+        self._song_position = bytearray((SONG_POSITION, 0, 0))
+        # note switched on by the last beat, switched off half a beat later.
+        self._note_off = None
+        self._rolling = False
+        # absolute index of the next clock pulse; pulse 0 is bar 1 beat 1.
+        self._next_pulse = 0
+        # beat type of the meter, and the pulses of a group and the beats it spans, in lowest
+        # terms; see set_beat_type.
+        self._beat_type = 4
+        self._pulses = PULSES_PER_WHOLE_NOTE // 4
+        self._beats = 1
+        # beat whose pulse frames are cached, the BeatLines of the beat and the next beat they
+        # were computed from, and the beat's width in whole frames.
+        self._beat = None
+        self._line = None
+        self._next_line = None
+        self._beat_width = 0
+        # whole frame of each phase of a beat, a phase being 1/_pulses of the beat.
+        self._pulse_frames = array('q', bytes(8 * PULSES_PER_WHOLE_NOTE))
+
+    @staticmethod
+    def _note(status, note, velocity):
+        if note is None:
+            return None
+        return bytes((status, note, velocity))
+
+    def set_beat_type(self, beat_type):
+        """
+        Changes the beat type of the meter, which sets how many pulses a beat spans. The next
+        pulse is renumbered to the pulse at the same beat position, or the first one after it.
+        A beat type that is not a positive whole number, e.g. of a position without BBT, is
+        ignored.
+        :param beat_type: time signature denominator
+        :return: None
+        """
+        if beat_type == self._beat_type or not 1 <= beat_type < inf or beat_type % 1:
+            return
+        beat_type = int(beat_type)
+        divisor = gcd(PULSES_PER_WHOLE_NOTE, beat_type)
+        pulses = PULSES_PER_WHOLE_NOTE // divisor
+        beats = beat_type // divisor
+        # ceiling of the next pulse's beat position, _next_pulse * _beats / _pulses beats, in
+        # pulses of the new meter.
+        self._next_pulse = -(-self._next_pulse * self._beats * pulses
+                             // (self._pulses * beats))
+        self._beat_type = beat_type
+        self._pulses = pulses
+        self._beats = beats
+        self._beat = None
+
+    def _predict(self, beat_index):
+        """
+        Caches the whole frame of each phase of a beat. Phase 0 falls in the exact frame of the
+        beat, and the others divide the whole frames up to the next beat, so no pulse is more
+        than a frame from the exact division of the beat.
+        :return: False if either end of the beat cannot be predicted yet, e.g. a beat before
+        beat 1, in which case the previous prediction is kept
+        """
+        beat_state = self.beat_state
+        line = beat_state.beat_line(beat_index + 1)
+        next_line = beat_state.beat_line(beat_index + 2)
+        if line is None or next_line is None:
+            return False
+        if beat_index != self._beat or line is not self._line or next_line is not self._next_line:
+            start = beat_state.beat_frame(beat_index + 1)
+            width = beat_state.beat_frame(beat_index + 2) - start
+            frames = self._pulse_frames
+            pulses = self._pulses
+            for phase in range(pulses):
+                frames[phase] = start + width * phase // pulses
+            self._beat = beat_index
+            self._line = line
+            self._next_line = next_line
+            self._beat_width = width
+        return True
+
+    def _pulse_offset(self, pulse, frame):
+        """
+        Returns the predicted frame of a pulse relative to frame, the first frame of the cycle,
+        as an int, or None if its beat cannot be predicted.
+        """
+        beat_index, phase = divmod(pulse * self._beats, self._pulses)
+        if not self._predict(beat_index):
+            return None
+        return self._pulse_frames[phase] - frame
+
+    def _resync(self, frame, beat_number):
+        """
+        Moves the next pulse to the first sixteenth note at or after frame.
+        """
+        beat_index = beat_number - 1
+        pulses = self._pulses
+        beats = self._beats
+        # a beat that cannot be predicted, e.g. in bar 0, resumes from its first pulse.
+        if self._predict(beat_index) and self._beat_width > 0:
+            width = self._beat_width
+            # the first pulse whose frame is at or after frame.
+            pulse = -(-(beat_index * width + frame - self._pulse_frames[0]) * pulses
+                      // (beats * width))
+        else:
+            pulse = -(-beat_index * pulses // beats)
+        pulse = max(-(-pulse // PULSES_PER_SONG_POSITION) * PULSES_PER_SONG_POSITION, 0)
+        self._next_pulse = pulse
+        if self._note_off is not None:
+            self.port.write_midi_event(0, self._note_off)
+            self._note_off = None
+
+    def _write_song_position(self):
+        position = self._next_pulse // PULSES_PER_SONG_POSITION
+        self._song_position[1] = position & 0x7f
+        self._song_position[2] = (position >> 7) & 0x7f
+        self.port.write_midi_event(0, self._song_position)
+
+    def process(self, state, pos, nframes, repositioned):
+        """
+        Writes the events of the current cycle. Only to be called from the process callback.
+        :param state: transport state
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :param nframes: number of frames in the cycle
+        :param repositioned: True if the transport was located since the last cycle
+        :return: None
+        """
+        port = self.port
+        port.clear_buffer()
+        if pos.beat_type != self._beat_type:
+            self.set_beat_type(pos.beat_type)
+        rolling = state == jack.ROLLING
+        if rolling != self._rolling:
+            self._rolling = rolling
+            if not rolling:
+                # a note left on would sound for as long as the transport is stopped.
+                if self._note_off is not None:
+                    port.write_midi_event(0, self._note_off)
+                    self._note_off = None
+                port.write_midi_event(0, STOP)
+                return
+            self._resync(pos.frame, self.beat_state.beat_number_from_pos(pos))
+            if self._next_pulse == 0:
+                port.write_midi_event(0, START)
+            else:
+                self._write_song_position()
+                port.write_midi_event(0, CONTINUE)
+        elif not rolling:
+            return
+        elif repositioned:
+            port.write_midi_event(0, STOP)
+            self._resync(pos.frame, self.beat_state.beat_number_from_pos(pos))
+            self._write_song_position()
+            port.write_midi_event(0, CONTINUE)
+
+        frame = pos.frame
+        pulse = self._next_pulse
+        pulse_offset = self._pulse_offset(pulse, frame)
+        if pulse_offset is not None and pulse_offset < -self._beat_width:
+            # the predictions moved by more than a beat; clocking resumes from here.
+            self._resync(frame, self.beat_state.beat_number_from_pos(pos))
+            pulse = self._next_pulse
+            pulse_offset = self._pulse_offset(pulse, frame)
+        # no clock or notes are written while the next pulse cannot be predicted.
+        beats = self._beats
+        half = self._pulses // 2
+        while pulse_offset is not None and pulse_offset < nframes:
+            offset = pulse_offset
+            if offset < 0:
+                offset = 0
+            port.write_midi_event(offset, CLOCK)
+            beat_index, phase = divmod(pulse * beats, self._pulses)
+            # a phase below beats is that of the first pulse of its beat, and one from half to
+            # half + beats that of the first pulse of its second half.
+            if phase < beats:
+                self._write_beat_note(offset, beat_index, pos)
+            elif half <= phase < half + beats and self._note_off is not None:
+                port.write_midi_event(offset, self._note_off)
+                self._note_off = None
+            pulse += 1
+            pulse_offset = self._pulse_offset(pulse, frame)
+        self._next_pulse = pulse
+
+    def _write_beat_note(self, offset, beat_index, pos):
+        if self._note_off is not None:
+            self.port.write_midi_event(offset, self._note_off)
+            self._note_off = None
+        if self._bar_on is not None and self.beat_state.is_first_beat_of_bar(beat_index + 1):
+            self.port.write_midi_event(offset, self._bar_on)
+            self._note_off = self._bar_off
+        elif self._beat_on is not None:
+            self.port.write_midi_event(offset, self._beat_on)
+            self._note_off = self._beat_off
@@ -0,0 +1,157 @@
+import jack
+from collections import deque
+from heapq import heappop, heappush
+from itertools import count
+
+# heap entry fields.
+_POSITION = 0
+_CALLBACK = 2
+
+
+class BeatScheduler(object):
+    """
+    Calls callbacks at musical positions, from the process callback, with the offset of the
+    position in the cycle.
+
+    Positions are absolute beats counted from 1 at bar 1 beat 1 across meter changes, see
+    BeatStateMachine.beat_number_from_bbt; fractions of a beat are allowed.
+    Events are kept in a min-heap keyed by position rather than by predicted frame: predicted
+    frames increase with the beat number, so the heap order is the order of the frames however
+    the BeatStateMachine refines its predictions, and nothing is re-keyed when it does. Each cycle
+    only the events at the top of the heap are predicted, so the cost is O(events due), plus
+    O(log n) per event to pop it.
+
+    Events may be scheduled and cancelled from any thread; they are handed to the process
+    callback through a queue. Callbacks run on the JACK process thread and must be realtime safe.
+
+    An event predicted more than one cycle before the current cycle when it is reached, e.g.
+    because the transport was located past it, is dropped and counted as missed. An event less
+    than a cycle late is called with offset 0.
+    """
+    def __init__(self, beat_state, pos):
+        """
+        :param beat_state: BeatStateMachine predicting the beat frames
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        """
+        self.beat_state = beat_state
+        self._heap = []
+        # events scheduled since the last cycle, only popped by the process callback.
+        self._pending = deque()
+        self._sequence = count()
+        self.missed = 0
+        self.dispatched = 0
+        self._observe(pos)
+
+    def _observe(self, pos):
+        self._bar = pos.bar
+        self._beat = pos.beat
+        self._ticks_per_beat = pos.ticks_per_beat
+
+    def at(self, position, callback):
+        """
+        Schedules callback(offset) at an absolute beat position.
+        :param position: beat number counted from 1, may be fractional
+        :param callback: function called with the frame offset of the position in the cycle
+        :return: handle for cancel
+        """
+        # the sequence breaks ties in scheduling order and keeps callbacks from being compared.
+        entry = [position, next(self._sequence), callback]
+        self._pending.append(entry)
+        return entry
+
+    def at_bar(self, bar, callback, beat=1, tick=0):
+        """
+        Schedules callback(offset) at bar, beat and tick, numbered in the meters known so far.
+        :return: handle for cancel
+        """
+        position = self.beat_state.beat_number_from_bbt(bar, beat)
+        if tick:
+            position += tick / self._ticks_per_beat
+        return self.at(position, callback)
+
+    def next_beat(self, callback):
+        """
+        Schedules callback(offset) at the start of the next beat.
+        :return: handle for cancel
+        """
+        return self.at(self.beat_state.beat_number_from_bbt(self._bar, self._beat) + 1, callback)
+
+    def next_bar(self, callback):
+        """
+        Schedules callback(offset) at the first beat of the next bar.
+        :return: handle for cancel
+        """
+        return self.at_bar(self._bar + 1, callback)
+
+    @staticmethod
+    def cancel(handle):
+        """
+        Cancels a scheduled event. It is removed from the heap when it reaches the top.
+        """
+        handle[_CALLBACK] = None
+
+    def __len__(self):
+        return len(self._heap) + len(self._pending)
+
+    def frame_of(self, position):
+        """
+        Returns the predicted frame of an absolute beat position.
+        """
+        beat = int(position)
+        predict = self.beat_state.predict_beat_frame
+        frame = predict(beat)
+        if position != beat:
+            frame += (predict(beat + 1) - frame) * (position - beat)
+        return frame
+
+    def offset_of(self, position, frame):
+        """
+        Returns the predicted frame of an absolute beat position relative to a whole frame,
+        computed in fixed point so that it stays precise at any frame: whole beats as the exact
+        whole frame they start in, fractions of a beat interpolated.
+        """
+        beat = int(position)
+        if position == beat:
+            return self.beat_state.beat_frame(beat) - frame
+        offset_of_beat = self.beat_state.beat_offset
+        offset = offset_of_beat(beat, frame)
+        return offset + (offset_of_beat(beat + 1, frame) - offset) * (position - beat)
+
+    def dispatch(self, state, pos, nframes):
+        """
+        Calls the callbacks of the events in the current cycle. Only to be called from the
+        process callback.
+        :param state: transport state
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :param nframes: number of frames in the cycle
+        :return: None
+        """
+        heap = self._heap
+        pending = self._pending
+        while pending:
+            heappush(heap, pending.popleft())
+        self._observe(pos)
+        if state != jack.ROLLING:
+            return
+
+        start_frame = pos.frame
+        while heap:
+            entry = heap[0]
+            callback = entry[_CALLBACK]
+            if callback is None:
+                heappop(heap)
+                continue
+            if entry[_POSITION] < 1:
+                heappop(heap)
+                self.missed += 1
+                continue
+            offset = self.offset_of(entry[_POSITION], start_frame)
+            if offset >= nframes:
+                break
+            heappop(heap)
+            offset = int(offset)
+            if offset < -nframes:
+                self.missed += 1
+                continue
+            self.dispatched += 1
+            callback(offset if offset > 0 else 0)
@@ -0,0 +1,322 @@
+import jack
+from array import array
+from bisect import bisect_right
+
+
+class SimulatedTransport(object):
+    """
+    Deterministic synthetic transport standing in for a JACK timebase master.
+
+    Bars, beats and ticks are derived from the transport frame using a tempo map. Beat changes can
+    be reported up to `jitter` frames early or late to simulate masters that do not keep
+    frame-consistent beats. The offset of each beat is derived from the beat number and seed alone,
+    so a replayed beat changes at the same frame.
+    """
+    def __init__(self, frame_rate=48000, beats_per_minute=120.0, beats_per_bar=4, beat_type=4,
+                 ticks_per_beat=1920.0, tempo_changes=None, jitter=0, seed=0):
+        """
+        :param frame_rate: sample rate in frames per second
+        :param beats_per_minute: tempo from frame 0
+        :param beats_per_bar: time signature numerator
+        :param beat_type: time signature denominator
+        :param ticks_per_beat: tick resolution of the reported position
+        :param tempo_changes: iterable of (frame, beats_per_minute) tempo changes
+        :param jitter: maximum number of frames a beat change is reported early or late
+        :param seed: seed for the jitter of each beat
+        """
+        self.frame_rate = frame_rate
+        self.beats_per_bar = beats_per_bar
+        self.beat_type = beat_type
+        self.ticks_per_beat = ticks_per_beat
+        self.jitter = jitter
+        self.seed = seed
+
+        # tempo segments as parallel lists of start frame, start beat and tempo.
+        self._start_frames = [0]
+        self._start_beats = [0.0]
+        self._tempos = [beats_per_minute]
+        for frame, bpm in sorted(tempo_changes or ()):
+            start_beat = self.beats_at(frame)
+            if frame == self._start_frames[-1]:
+                self._tempos[-1] = bpm
+                continue
+            self._start_frames.append(frame)
+            self._start_beats.append(start_beat)
+            self._tempos.append(bpm)
+
+    def beats_at(self, frame):
+        """
+        Returns the number of beats elapsed between frame 0 and frame, ignoring jitter.
+        """
+        segment = bisect_right(self._start_frames, frame) - 1
+        return (self._start_beats[segment]
+                + (frame - self._start_frames[segment]) * self._tempos[segment]
+                / (60.0 * self.frame_rate))
+
+    def frame_at(self, beats):
+        """
+        Returns the frame at which the given number of beats have elapsed, ignoring jitter.
+        """
+        segment = bisect_right(self._start_beats, beats) - 1
+        return (self._start_frames[segment]
+                + (beats - self._start_beats[segment]) * 60.0 * self.frame_rate
+                / self._tempos[segment])
+
+    def tempo_at(self, frame):
+        return self._tempos[bisect_right(self._start_frames, frame) - 1]
+
+    def beat_offset(self, beat_index):
+        """
+        Returns the number of frames the change to the given beat is reported late.
+        """
+        if not self.jitter:
+            return 0
+        mixed = ((beat_index + 1) * 2654435761 + self.seed * 40503) % 4294967296
+        return int(mixed % (2 * self.jitter + 1)) - self.jitter
+
+    def fill(self, pos, frame):
+        """
+        Writes the bar, beat and tick of frame into a jack_position_t.
+        :param pos: cdata object, jack_position_t C struct
+        :param frame: transport frame
+        :return: None
+        """
+        beats = self.beats_at(frame)
+        beat_index = int(beats)
+        if frame < self.frame_at(beat_index) + self.beat_offset(beat_index):
+            beat_index -= 1
+        elif frame >= self.frame_at(beat_index + 1) + self.beat_offset(beat_index + 1):
+            beat_index += 1
+        tick = (beats - beat_index) * self.ticks_per_beat
+        tick = min(max(tick, 0.0), self.ticks_per_beat - 1)
+
+        pos.valid = pos.valid | jack._lib.JackPositionBBT
+        pos.bar = beat_index // self.beats_per_bar + 1
+        pos.beat = beat_index % self.beats_per_bar + 1
+        pos.tick = int(tick)
+        pos.bar_start_tick = (pos.bar - 1) * self.beats_per_bar * self.ticks_per_beat
+        pos.beats_per_bar = self.beats_per_bar
+        pos.beat_type = self.beat_type
+        pos.ticks_per_beat = self.ticks_per_beat
+        pos.beats_per_minute = self.tempo_at(frame)
+
+
+class FakeMidiPort(object):
+    """
+    Stands in for a python-jack OwnMidiPort, recording the transport frame and first two bytes
+    of each event written in preallocated arrays.
+    """
+    def __init__(self, client, name, capacity=1 << 20):
+        self.client = client
+        self.name = name
+        self.frames = array('q', [0]) * capacity
+        self.statuses = array('B', [0]) * capacity
+        self.data = array('B', [0]) * capacity
+        self.count = 0
+
+    def clear_buffer(self):
+        pass
+
+    def write_midi_event(self, time, event):
+        if not 0 <= time < self.client.blocksize:
+            raise ValueError('event time {0} outside of the cycle'.format(time))
+        count = self.count
+        self.frames[count] = self.client.frame + time
+        self.statuses[count] = event[0]
+        self.data[count] = event[1] if len(event) > 1 else 0
+        self.count = count + 1
+
+    def events(self):
+        """
+        Returns the recorded events as (frame, status, data) tuples.
+        """
+        return [(self.frames[i], self.statuses[i], self.data[i]) for i in range(self.count)]
+
+
+class _FakeMidiPorts(object):
+    def __init__(self, client):
+        self.client = client
+        self.ports = []
+
+    def register(self, shortname):
+        port = FakeMidiPort(self.client, shortname)
+        self.ports.append(port)
+        return port
+
+    def __iter__(self):
+        return iter(self.ports)
+
+
+class FakeClient(object):
+    """
+    Stands in for jack.Client without a JACK server.
+
+    Implements the parts of the jack.Client interface used by jacktime and drives the registered
+    process, timebase, blocksize and shutdown callbacks from a SimulatedTransport, one call to
+    cycle() per JACK cycle. When a timebase callback is registered it provides the bar, beat and
+    tick of each cycle in place of the simulated transport. MIDI output ports record the frame of
+    every event written to them.
+    """
+    def __init__(self, name='jacktime', transport=None, blocksize=1024, blocksize_changes=None,
+                 repositions=None, rolling=True):
+        """
+        :param name: client name
+        :param transport: SimulatedTransport providing the position when there is no timebase
+        callback
+        :param blocksize: initial number of frames per cycle
+        :param blocksize_changes: dict of cycle number to new blocksize
+        :param repositions: dict of cycle number to the frame the transport is located to
+        :param rolling: whether the transport starts rolling
+        """
+        if transport is None:
+            transport = SimulatedTransport()
+        self.name = name
+        self.transport = transport
+        self.samplerate = transport.frame_rate
+        self._blocksize = blocksize
+        self.blocksize_changes = blocksize_changes or {}
+        self.repositions = repositions or {}
+        self.state = jack.ROLLING if rolling else jack.STOPPED
+        self.frame = 0
+        self.cycle_count = 0
+        self.active = False
+
+        self._position = jack._ffi.new('jack_position_t *')
+        self._requested_position = jack._ffi.new('jack_position_t *')
+        self._reposition_pending = False
+        self.transport.fill(self._position, 0)
+        self._position.frame_rate = self.samplerate
+
+        self.midi_outports = _FakeMidiPorts(self)
+
+        self.process_callback = None
+        self.timebase_callback = None
+        self.blocksize_callback = None
+        self.shutdown_callback = None
+        self.xrun_callback = None
+
+    @property
+    def blocksize(self):
+        return self._blocksize
+
+    @blocksize.setter
+    def blocksize(self, blocksize):
+        self._blocksize = blocksize
+        if self.blocksize_callback is not None:
+            self.blocksize_callback(blocksize)
+
+    def set_process_callback(self, callback):
+        self.process_callback = callback
+
+    def set_timebase_callback(self, callback=None, conditional=False):
+        self.timebase_callback = callback
+        return True
+
+    def set_blocksize_callback(self, callback):
+        self.blocksize_callback = callback
+
+    def set_shutdown_callback(self, callback):
+        self.shutdown_callback = callback
+
+    def set_xrun_callback(self, callback):
+        self.xrun_callback = callback
+
+    def transport_query_struct(self):
+        return self.state, self._position
+
+    def transport_reposition_struct(self, position):
+        self._requested_position[0] = position[0]
+        self._reposition_pending = True
+
+    def transport_locate(self, frame):
+        self._requested_position.valid = 0
+        self._requested_position.frame = frame
+        self._reposition_pending = True
+
+    def transport_start(self):
+        self.state = jack.ROLLING
+
+    def transport_stop(self):
+        self.state = jack.STOPPED
+
+    @property
+    def transport_frame(self):
+        return self.frame
+
+    def cycle(self):
+        """
+        Runs one JACK cycle: applies scheduled blocksize changes and repositions, updates the
+        transport position and calls the timebase and process callbacks.
+        :return: None
+        """
+        cycle = self.cycle_count
+        if cycle in self.blocksize_changes:
+            self.blocksize = self.blocksize_changes[cycle]
+        if cycle in self.repositions:
+            self.transport_locate(self.repositions[cycle])
+
+        pos = self._position
+        new_pos = self._reposition_pending
+        if new_pos:
+            self._reposition_pending = False
+            self.frame = self._requested_position.frame
+            if self.timebase_callback is not None:
+                pos[0] = self._requested_position[0]
+        pos.frame = self.frame
+
+        if self.timebase_callback is not None:
+            if self.state == jack.ROLLING or new_pos:
+                self.timebase_callback(self.state, self._blocksize, pos, new_pos)
+        else:
+            self.transport.fill(pos, self.frame)
+
+        # the server owns the frame fields, whatever the timebase callback wrote.
+        pos.frame = self.frame
+        pos.frame_rate = self.samplerate
+        pos.usecs = self.frame * 1000000 // self.samplerate
+
+        if self.process_callback is not None:
+            self.process_callback(self._blocksize)
+
+        if self.state == jack.ROLLING:
+            self.frame += self._blocksize
+        self.cycle_count += 1
+
+    def run(self, cycles):
+        for _ in range(cycles):
+            self.cycle()
+
+    def shutdown(self, reason='simulated shutdown'):
+        """
+        Simulates the JACK server going away.
+        """
+        self.active = False
+        if self.shutdown_callback is not None:
+            self.shutdown_callback(jack.Status(0), reason)
+
+    def xrun(self, delayed_usecs=0.0):
+        """
+        Simulates an xrun reported by the JACK server.
+        """
+        if self.xrun_callback is not None:
+            self.xrun_callback(delayed_usecs)
+
+    def cpu_load(self):
+        return 0.0
+
+    def activate(self):
+        self.active = True
+
+    def deactivate(self, ignore_errors=True):
+        self.active = False
+
+    def close(self, ignore_errors=True):
+        self.active = False
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+    def __exit__(self, *args):
+        self.deactivate()
+        self.close()
@@ -1,7 +1,20 @@
 import sys
 import threading
+import time
 import jack
+from bisect import bisect_right
+from fractions import Fraction
+from math import inf, nan
 from pprint import pprint
+from lib.jack.beat_map import BeatMap, CompactBeatMap
+from lib.jack.checkpoint import (Checkpoint, CheckpointError, SegmentState, check_checkpoint,
+                                 read_checkpoint)
+from lib.jack.fpb_segments import FpbSegmentIndex
+from lib.jack.frames import frames_per_beat, frames_per_tick
+from lib.jack.midi_clock import MidiClock
+from lib.jack.scheduler import BeatScheduler
+from lib.stats import CallbackStats, REPOSITIONS, SEGMENT_CHANGES
+from lib.telemetry import TelemetryQueue, TelemetryReporter, CLIENT_PREDICTION
 
 class BeatStateMachine(object):
     """
@@ -20,26 +33,54 @@ class BeatStateMachine(object):
 
     Assumes that beats should always be equivalent in duration.
 
-    Does not support the changing of time signature or samplerate. This is an unfortunate side
-    effect of the current implementation of Jack timebase, since there is insufficient information
-    to predict changes of this kind. This can probably be fixed.
+    Changes of tempo, meter or samplerate are detected from the position (see tempo_changed) and
+    open a new tempo segment at the first beat after the change. Beats of a segment are refined
+    relative to the window of its start beat. Beats are numbered across meter changes with a
+    meter map, so absolute beat numbers stay contiguous when the number of beats per bar changes.
 
-    Can only estimate beat frames accurate to within the number of frames provided to the process
-    callback. The estimate can be refined over time as beats occur outside the projected beat
-    frame and refine the beat width. This process is fairly computationally expensive.
+    When the master provides BBT, the frame of each beat is interpolated from the tick and tempo
+    to within a tick. Otherwise beat frames can only be estimated accurate to within the number
+    of frames provided to the process callback. The estimate can be refined over time as beats
+    occur outside the projected beat frame and refine the beat width. Each recorded beat refines
+    the estimate in constant time.
+
+    The beat width is also fitted by streaming least squares, and predictions use whichever
+    estimate has missed recent beats by less.
+
+    Frames per beat, beat windows and segment start frames are exact integers or Fractions, so
+    predictions do not drift however large the frame numbers get. Each segment keeps its model
+    as a fixed-point BeatLine for the process callback, see beat_frame and beat_offset.
 
     Reports beat skew representing the percent difference between expected beat-width
-    and observed beat-width. Skew results from the jack timebase master either changing
-    beats at inconsistent frame intervals or changing beats at a different frame when
-    replaying frames.
+    and observed beat-width (see skew_report). Skew results from the jack timebase master
+    either changing beats at inconsistent frame intervals or changing beats at a different
+    frame when replaying frames.
 
     Reports beat skew type:
         Linear: beat width increases with each beat
         Periodic: Beat occurs consistently late or early
         Bar: Beat occurs on unexpected bar.
     """
-    def __init__(self, pos, max_buffer_size):
+    def __init__(self, pos, max_buffer_size, retention=None):
+        """
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :param max_buffer_size: The maximum number of frames that can be passed to the
+        process callback function.
+        :param retention: number of recent beats to keep in the beat map, or None to keep all.
+        """
         self._max_buffer_size = max_buffer_size
+        self._retention = retention
+        # sample rate, tempo and meter of the current tempo segment, see tempo_changed.
+        self.frame_rate = pos.frame_rate
+        self.beats_per_minute = pos.beats_per_minute
+        self.beats_per_bar = pos.beats_per_bar
+        self.beat_type = pos.beat_type
+        self.ticks_per_beat = pos.ticks_per_beat
+        # meter map: the first bar of each meter, its absolute beat number and its beats per bar,
+        # sorted by bar. See beat_number_from_bbt.
+        self._meter_bars = [1]
+        self._meter_beats = [1]
+        self._meter_beats_per_bar = [int(pos.beats_per_bar) or 1]
         # tuple representing the minimum and maximum possible frames for a beat given the recorded
         # beat frames.
         # Beat width initialized with estimate from bpm until second beat is recorded. Refined
@@ -52,29 +93,27 @@ class BeatStateMachine(object):
 
         # disable multiple checking of beat frames against adjusted fpb.
         self.multi_check_disable = False
-        self.fpb_group = {0: {'fpb': fpb_range,
-                              'start_beat': 1,
-                              'end_beat': None}}
-
-        self.current_fpb_group = 0
+        # tempo segments, each with the fpb range of its beats, indexed by beat and frame.
+        self.fpb_segments = FpbSegmentIndex()
+        self.current_segment = self.fpb_segments.append(fpb_range, 1, 0)
+        self.current_segment.estimator.expected_width = float(fpb)
+        # (segment, end beat, lower, upper) bounds on the fpb of the current segment implied by
+        # the beat map. See adjust_fpb_range.
+        self._fpb_bounds = None
 
         #beat map contains beat window information of each beat recorded or estimated
         #beat. windows are recalculated on request to project_next_beat as beat inaccuracy
         #narrows
+        #with a retention limit, the beat map keeps only the most recent beats in preallocated
+        #arrays. bounds implied by evicted beats are kept by their segment, see evict_beat.
+        if retention is None:
+            self.beat_map = BeatMap()
+        else:
+            self.beat_map = CompactBeatMap(retention)
 
         #seed first beat to beat_mapexact
-
-        beat_number = 1
-        beat_window = (0, self._max_buffer_size)
-
-        #fpb group is
-        self.beat_map = {beat_number:
-            {
-            'beat_window': beat_window,
-            'fpb_group': 0,
-            'checked': False
-            }
-        }
+        self.beat_map.record(1, 0, self._max_buffer_size, self.current_segment.number)
+        self.fpb_segments.set_start_window(self.current_segment, 0, self._max_buffer_size)
 
         #register current beat (since it's not always bar 1 beat 1)
         cur_beat_no = (pos.bar - 1) * pos.beats_per_bar + pos.beat
@@ -91,77 +130,332 @@ class BeatStateMachine(object):
         :return: None
         """
         beat_number = self.beat_number_from_pos(pos)
-        self.beat_map[beat_number] = {'beat_window': (pos.frame, pos.frame + nframes),
-                                    'fpb_group': self.current_fpb_group,
-                                      'checked': False}
-
-        self.adjust_fpb_range()
-
-    def adjust_fpb_range(self):
-        first, second = self.fpb_group[self.current_fpb_group]['fpb']
+        window_start, window_end = self.beat_window(pos, nframes)
+        evicted = self.beat_map.evictee(beat_number)
+        if evicted is not None:
+            self.evict_beat(evicted)
+        if beat_number in self.beat_map and self._fpb_bounds is not None:
+            # a re-recorded beat window may have been the one bounding the fpb range.
+            lower, upper = self._beat_window_bounds((beat_number,), mark_checked=False)
+            if -inf < lower == self._fpb_bounds[2] or inf > upper == self._fpb_bounds[3]:
+                self._fpb_bounds = None
+        self.beat_map.record(beat_number, window_start, window_end, self.current_segment.number)
+        segment = self.fpb_segments.at_beat(beat_number)
+        if segment.start_beat == beat_number:
+            self.fpb_segments.set_start_window(segment, window_start, window_end)
+            # the segment's beats are bounded relative to this window.
+            self._fpb_bounds = None
+        if segment is self.current_segment:
+            segment.estimator.add(beat_number, Fraction(window_start + window_end, 2),
+                                  window_end - window_start, segment.range_frame(beat_number))
+
+        self.adjust_fpb_range(beat_number)
+
+    def beat_window(self, pos, nframes):
+        """
+        Returns the window of frames in which the current beat started.
+        With valid BBT the beat started tick ticks before the frame, so its frame is interpolated
+        from the tick and the tempo: the tick is truncated by the master, which leaves a window
+        about one tick wide. Without BBT, or when the interpolated beat does not fall within the
+        last cycle (e.g. a master reporting beats late), the window is the cycle itself.
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :param nframes: number of frames in the current cycle
+        :return: tuple (window_start, window_end)
+        """
+        if pos.valid & jack._lib.JackPositionBBT and pos.ticks_per_beat > 0 \
+                and pos.beats_per_minute > 0:
+            frame = pos.frame
+            if pos.valid & jack._lib.JackBBTFrameOffset:
+                frame += pos.bbt_offset
+            numerator, denominator = frames_per_tick(pos.frame_rate, pos.beats_per_minute,
+                                                     pos.ticks_per_beat)
+            # floor(frame - ticks * frames per tick), exactly.
+            window_start = max(frame + (-(pos.tick + 1) * numerator) // denominator, 0)
+            window_end = frame + (-pos.tick * numerator) // denominator + 1
+            if window_end > max(frame - max(nframes, self._max_buffer_size), 0):
+                return window_start, window_end
+        return pos.frame, pos.frame + nframes
+
+    def adjust_fpb_range(self, beat_number=None):
+        """
+        Narrows the fpb range of the current segment using the recorded beat windows.
+        A beat recorded n beats after the segment's start beat bounds the beat width from below by
+        (beat_start_frame - start_end_frame) / n and from above by
+        (beat_end_frame - start_start_frame) / n, where the start beat's window is
+        (start_start_frame, start_end_frame), or exactly frame 0 for beat 1. The bounds are
+        rounded outwards to whole frames, since the width at most tempos is not a whole number
+        of frames, and computed directly rather than stepped one frame at a time.
+        The tightest bounds over the beat map are kept for the current segment, so only
+        the newly recorded beat needs to be folded in. The whole beat map is folded again
+        only when the segment changes or a binding beat window is re-recorded.
+        :param beat_number: the beat just recorded, or None to fold in the whole beat map.
+        :return: None
+        """
+        segment = self.current_segment
+        first, second = segment.fpb
         low = first
         high = second
         if first > second:
             high = first
             low = second
-        start_beat = self.fpb_group[self.current_fpb_group]['start_beat']
-        end_beat = self.fpb_group[self.current_fpb_group]['end_beat']
-
-        if end_beat is not None:
-            for beat in range(start_beat, end_beat):
-                if beat > start_beat:
-                    beat_start_frame, beat_end_frame = self.beat_map[beat]['beat_window']
-                    too_low = True
-                    while too_low:
-                        if low * beat < beat_start_frame:
-                            low += 1
-                        else:
-                            too_low = False
-                    too_high = True
-                    while too_high:
-                        if high * beat > beat_end_frame:
-                            high -=1
-                        else:
-                            too_high = False
+
+        bounds = self._fpb_bounds
+        if (beat_number is None or bounds is None
+                or bounds[0] is not segment or bounds[1] != segment.end_beat):
+            lower, upper = self._beat_window_bounds(self.beat_map, *segment.evicted_fpb)
         else:
-            for beat in self.beat_map:
-                if not self.beat_map[beat]['checked']:
-                    beat_start_frame, beat_end_frame = self.beat_map[beat]['beat_window']
-                    if beat > 1:
-                        too_low = True
-                        while too_low:
-                            min_frames = low * (beat - 1)
-                            if min_frames < beat_start_frame:
-                                low += 1
-                            else:
-                                too_low = False
-                        too_high = True
-                        while too_high:
-                            max_frames = high * (beat - 1)
-                            if max_frames > beat_end_frame:
-                                high -= 1
-                            else:
-                                too_high = False
-                    if self.multi_check_disable:
-                        self.beat_map[beat]['checked'] = True
-
-        self.fpb_group[self.current_fpb_group]['fpb'] = (low, high)
-
-
-
-    def record_bpm_change(self, pos):
-        #mark end of previous group
-        current_beat = self.beat_number_from_pos(pos)
-        self.fpb_group[self.current_fpb_group]['end_beat'] = current_beat
-
-        #log next fpb group
-        self.current_fpb_group += 1
-        fmin = int(self.get_frames_per_beat(pos) - self._max_buffer_size)
+            lower, upper = self._beat_window_bounds((beat_number,), bounds[2], bounds[3])
+
+        segment.fpb = (max(low, lower), min(high, upper))
+
+        if self.multi_check_disable and segment.end_beat is None:
+            # checked beats no longer take part in refinement.
+            lower, upper = -inf, inf
+        self._fpb_bounds = (segment, segment.end_beat, lower, upper)
+
+    def _beat_window_bounds(self, beats, lower=-inf, upper=inf, mark_checked=True):
+        """
+        Folds the windows of the given beats into the fpb bounds of the current segment.
+        :param beats: iterable of beat numbers in the beat map.
+        :param lower: smallest fpb allowed by the beats already folded.
+        :param upper: largest fpb allowed by the beats already folded.
+        :param mark_checked: mark folded beats as checked when multi_check_disable is set.
+        :return: tuple (lower, upper)
+        """
+        segment = self.current_segment
+        reference = self._reference_window(segment)
+        if reference is None:
+            return lower, upper
+        reference_start, reference_end = reference
+        start_beat = segment.start_beat
+        end_beat = segment.end_beat
+        for beat in beats:
+            if end_beat is not None:
+                if not start_beat < beat <= end_beat:
+                    continue
+            else:
+                if self.beat_map.checked(beat):
+                    continue
+                if self.multi_check_disable and mark_checked:
+                    self.beat_map.check(beat)
+                if beat <= start_beat:
+                    continue
+            beat_count = beat - start_beat
+            beat_start_frame, beat_end_frame = self.beat_map.window(beat)
+            lower = max(lower, int((beat_start_frame - reference_end) // beat_count))
+            upper = min(upper, int(-(-(beat_end_frame - reference_start) // beat_count)))
+        return lower, upper
+
+    @staticmethod
+    def _reference_window(segment):
+        """
+        Returns the window beats of a segment are counted from, or None until its start beat is
+        recorded. Beat 1 is exactly frame 0.
+        """
+        if segment.start_beat <= 1:
+            return 0, 0
+        return segment.start_window
+
+    def evict_beat(self, beat_number):
+        """
+        Summarises a beat about to be evicted from a bounded beat map so that the accuracy
+        gained from it is kept: its fpb bounds are folded into the evicted-beat bounds of its
+        segment. Segments keep the window of their start beat themselves.
+        :param beat_number: beat number held by the beat map.
+        :return: None
+        """
+        segment = self.fpb_segments.at_beat(beat_number)
+        reference = self._reference_window(segment)
+        if (reference is None or beat_number <= segment.start_beat
+                or self.beat_map.checked(beat_number)):
+            return
+        beat_start_frame, beat_end_frame = self.beat_map.window(beat_number)
+        beat_count = beat_number - segment.start_beat
+        lower, upper = segment.evicted_fpb
+        segment.evicted_fpb = (
+            max(lower, int((beat_start_frame - reference[1]) // beat_count)),
+            min(upper, int(-(-(beat_end_frame - reference[0]) // beat_count))))
+
+    def segment_at_beat(self, beat_number):
+        """
+        Returns the segment of a beat: the segment it was recorded in, or else the segment
+        active at that beat.
+        :return: FpbSegment
+        """
+        if beat_number in self.beat_map:
+            number = self.beat_map.group(beat_number)
+            if number in self.fpb_segments:
+                return self.fpb_segments[number]
+        return self.fpb_segments.at_beat(beat_number)
+
+    def segment_at_frame(self, frame):
+        """
+        Returns the segment active at frame.
+        :return: FpbSegment
+        """
+        return self.fpb_segments.at_frame(frame)
+
+    def tempo_changed(self, pos):
+        """
+        Returns True if the tempo, meter, tick resolution or sample rate of pos differ from the
+        current segment's. Cheap enough to call every cycle.
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        """
+        return (pos.beats_per_minute != self.beats_per_minute
+                or pos.beats_per_bar != self.beats_per_bar
+                or pos.beat_type != self.beat_type
+                or pos.ticks_per_beat != self.ticks_per_beat
+                or pos.frame_rate != self.frame_rate)
+
+    def record_tempo_change(self, pos, beat_number, beat_changed):
+        """
+        Applies a change detected by tempo_changed.
+        A change of beats per bar starts a new meter at pos.bar, numbered on from the previous
+        beat, as does a master cutting the bar in progress short. A change of tempo, meter or
+        sample rate, or a cut bar, makes the beats that follow inconsistent with the current
+        segment, so a new segment starts with the first beat after the change. A change of tick
+        resolution alone only affects beat windows.
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :param beat_number: absolute beat number of the beat of pos, numbered on from the beats
+        before the change
+        :param beat_changed: True if the beat of pos starts in this cycle
+        :return: None
+        """
+        renumbered = self.beat_number_from_pos(pos) != beat_number
+        if renumbered or pos.beats_per_bar != self.beats_per_bar:
+            self.record_meter_change(pos.bar, beat_number - (pos.beat - 1), pos.beats_per_bar)
+        segment_changed = (renumbered
+                           or pos.beats_per_minute != self.beats_per_minute
+                           or pos.beats_per_bar != self.beats_per_bar
+                           or pos.beat_type != self.beat_type
+                           or pos.frame_rate != self.frame_rate)
+        self.beats_per_bar = pos.beats_per_bar
+        self.beat_type = pos.beat_type
+        self.ticks_per_beat = pos.ticks_per_beat
+        if segment_changed:
+            # the beat changing in this cycle is the first beat after the change.
+            self.record_bpm_change(pos, beat_number + (0 if beat_changed else 1))
+
+    def record_meter_change(self, bar, beat_number, beats_per_bar):
+        """
+        Starts a meter at bar, replacing meters starting at or after it.
+        :param bar: first bar of the meter
+        :param beat_number: absolute beat number of the first beat of bar
+        :param beats_per_bar: beats per bar of the meter
+        :return: None
+        """
+        while len(self._meter_bars) > 1 and self._meter_bars[-1] >= bar:
+            self._meter_bars.pop()
+            self._meter_beats.pop()
+            self._meter_beats_per_bar.pop()
+        if self._meter_bars[-1] >= bar:
+            # the first meter is replaced.
+            bar, beat_number = self._meter_bars[0], self._meter_beats[0]
+            self._meter_bars.pop()
+            self._meter_beats.pop()
+            self._meter_beats_per_bar.pop()
+        self._meter_bars.append(bar)
+        self._meter_beats.append(beat_number)
+        self._meter_beats_per_bar.append(int(beats_per_bar) or 1)
+
+    def record_bpm_change(self, pos, start_beat=None):
+        """
+        Ends the current segment and starts the next one at start_beat with the tempo and sample
+        rate of pos. If a segment already starts there at the same tempo, e.g. when the transport
+        replays a tempo change, it becomes current again with what it has learned.
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :param start_beat: first beat of the new segment, by default the beat after the current
+        :return: None
+        """
+        if start_beat is None:
+            start_beat = self.beat_number_from_pos(pos) + 1
+        fpb = self.get_frames_per_beat(pos)
+        self.beats_per_minute = pos.beats_per_minute
+        self.frame_rate = pos.frame_rate
+        existing = self.fpb_segments.at_beat(start_beat)
+        if existing.start_beat == start_beat and existing.estimator.expected_width == float(fpb):
+            self.current_segment = existing
+            return
+        fmin = int(fpb - self._max_buffer_size)
         fmax = int(fmin + (self._max_buffer_size * 2))
-        fpb = (fmin, fmax)
-        self.fpb_group[self.current_fpb_group] = {'fpb': fpb,
-                              'start_beat': current_beat + 1,
-                              'end_beat': None}
+        # estimated start frame, replaced by the start beat's window once it is recorded.
+        beats_to_start = start_beat - self.beat_number_from_pos(pos)
+        start_frame = pos.frame + fpb * beats_to_start
+        if pos.valid & jack._lib.JackPositionBBT and pos.ticks_per_beat > 0:
+            start_frame -= fpb * pos.tick / Fraction(pos.ticks_per_beat)
+        self.current_segment = self.fpb_segments.append((fmin, fmax), start_beat, start_frame)
+        self.current_segment.estimator.expected_width = float(fpb)
+        self._fpb_bounds = None
+
+    def checkpoint(self, beats=64):
+        """
+        Returns the learned beat model: every tempo segment and the windows of the most recent
+        beats. May be called from a non-realtime thread while beats are recorded.
+        :param beats: number of recent beat windows to include
+        :return: Checkpoint
+        """
+        while True:
+            try:
+                beat_numbers = self.beat_map.latest(beats)
+                segments = list(self.fpb_segments)
+                break
+            except RuntimeError:
+                # the beat map grew while it was copied.
+                continue
+        recent = []
+        for beat in beat_numbers:
+            try:
+                window_start, window_end = self.beat_map.window(beat)
+                recent.append((beat, window_start, window_end, self.beat_map.group(beat),
+                               int(self.beat_map.checked(beat))))
+            except KeyError:
+                # evicted since the copy.
+                continue
+        return Checkpoint(self.frame_rate, self.beats_per_minute, self.beats_per_bar,
+                          list(zip(self._meter_bars, self._meter_beats,
+                                   self._meter_beats_per_bar)),
+                          self.current_segment.number,
+                          [SegmentState(segment.number, segment.start_beat, segment.end_beat,
+                                        segment.start_frame, segment.start_window, segment.fpb,
+                                        segment.evicted_fpb, segment.estimator.state())
+                           for segment in segments],
+                          recent)
+
+    def restore(self, checkpoint):
+        """
+        Replaces the beat model with a checkpoint, so predictions start from what was learned
+        before a restart rather than from the tempo alone.
+        :param checkpoint: Checkpoint matching the current sample rate, tempo and meter
+        :return: None
+        """
+        segments = FpbSegmentIndex()
+        numbers = {}
+        for state in checkpoint.segments:
+            segment = segments.append(state.fpb, state.start_beat, state.start_frame)
+            numbers[state.number] = segment.number
+            if state.start_window is not None:
+                segments.set_start_window(segment, *state.start_window)
+            segment.end_beat = state.end_beat
+            segment.evicted_fpb = state.evicted_fpb
+            segment.estimator.restore(state.estimator)
+        if self._retention is None:
+            beat_map = BeatMap()
+        else:
+            beat_map = CompactBeatMap(self._retention)
+        for beat, window_start, window_end, number, checked in checkpoint.beats:
+            if number not in numbers:
+                continue
+            beat_map.record(beat, window_start, window_end, numbers[number])
+            if checked:
+                beat_map.check(beat)
+        self.fpb_segments = segments
+        self.beat_map = beat_map
+        self.current_segment = segments[numbers[checkpoint.current_segment]]
+        self._fpb_bounds = None
+        self.beats_per_minute = checkpoint.beats_per_minute
+        self._meter_bars = [bar for bar, _, _ in checkpoint.meters]
+        self._meter_beats = [beat for _, beat, _ in checkpoint.meters]
+        self._meter_beats_per_bar = [beats_per_bar for _, _, beats_per_bar in checkpoint.meters]
 
     def predict_beat_frame(self, beat_number):
         """
@@ -171,36 +465,78 @@ class BeatStateMachine(object):
         Used as an opportune time to back-fill beat window information with refined
         beat-width information by triggering refine_beat_accuracy.
 
+        The frame is a float rounded once from the segment's fixed-point line; use beat_frame
+        or beat_offset where whole frames must be exact.
         """
         if beat_number > 0:
-            # get fpb range from group
-            group = self.current_fpb_group
-            try:
-                group = self.beat_map[beat_number]['fpb_group']
-            except KeyError:
-                pass
-            fpb_range = self.fpb_group[group]['fpb']
+            # get fpb range from segment
+            segment = self.segment_at_beat(beat_number)
+
+            # frame = fpb * beat_count + start_frame, with the start frame and beat width from
+            # the fpb range or the least-squares fit, whichever misses recent beats by less:
+            return segment.beat_line().position(beat_number - segment.start_beat)
 
-            # determine the frame at which this tempo started:
-            start_beat = self.fpb_group[group]['start_beat']
-            l, h = self.beat_map[start_beat]['beat_window']
-            start_frame = (l + h) / 2
+    def exact_beat_frame(self, beat_number):
+        """
+        Returns the projected frame of a beat as a Fraction, or None before beat 1.
+        """
+        if beat_number > 0:
+            segment = self.segment_at_beat(beat_number)
+            start_frame, fpb = segment.beat_model()
+            return start_frame + fpb * (beat_number - segment.start_beat)
 
-            # get beat count from fpb group
-            beat_count = beat_number - start_beat
+    def beat_frame(self, beat_number):
+        """
+        Returns the whole frame in which a beat is projected to start, the floor of
+        exact_beat_frame, from the fixed-point line of its segment. Exact for every frame below
+        2 ** 63 and cheap enough for the process callback.
+        :return: int, or None before beat 1
+        """
+        if beat_number > 0:
+            segment = self.segment_at_beat(beat_number)
+            return segment.beat_line().frame(beat_number - segment.start_beat)
 
-            # average fpb range
-            low, high = fpb_range
-            fpb = (low + high) / 2
+    def beat_line(self, beat_number):
+        """
+        Returns the BeatLine beat_number is predicted from, or None before beat 1. A line is
+        replaced rather than changed when its predictions change, so callers may cache what they
+        derive from it for as long as it is returned.
+        """
+        if beat_number > 0:
+            return self.segment_at_beat(beat_number).beat_line()
+
+    def beat_offset(self, beat_number, frame):
+        """
+        Returns the projected frame of a beat relative to a whole frame, e.g. the first frame of
+        the cycle, as a float that is as precise late in a long run as at its start.
+        :return: float, or None before beat 1
+        """
+        if beat_number > 0:
+            segment = self.segment_at_beat(beat_number)
+            return segment.beat_line().offset(beat_number - segment.start_beat, frame)
 
-            # frame = fpb * beat_count + start_frame
-            # y = mx+b
-            return (fpb * beat_count) + start_frame
+    def skew_report(self):
+        """
+        Reports the beat width and skew of the current tempo segment.
+        :return: dict with the least-squares beat width, the fpb range, the percent skew from
+        the width expected from the tempo, the residual skew in frames, the skew type, and the
+        estimator predictions currently use.
+        """
+        segment = self.current_segment
+        estimator = segment.estimator
+        return {'beat_width': estimator.width,
+                'fpb': segment.fpb,
+                'skew_percent': estimator.skew_percent,
+                'residual': estimator.residual,
+                'skew_type': estimator.skew_type(self._max_buffer_size),
+                'estimator': 'least_squares' if estimator.preferred_over_range()
+                             else 'fpb_range'}
 
     def get_frames_per_beat(self, pos):
-        bps = pos.beats_per_minute / 60
-        fpb = pos.frame_rate / bps
-        return fpb
+        """
+        Returns the exact frames per beat of the tempo of pos, as a Fraction.
+        """
+        return frames_per_beat(pos.frame_rate, pos.beats_per_minute)
 
     def beat_number_from_pos(self, pos):
         """
@@ -208,17 +544,50 @@ class BeatStateMachine(object):
         :param pos: cdata object, jack_position_t C struct, via jack-python
         :return:
         """
-        return int((pos.bar - 1) * pos.beats_per_bar + pos.beat)
+        return self.beat_number_from_bbt(pos.bar, pos.beat)
+
+    def beat_number_from_bbt(self, bar, beat):
+        """
+        Returns the absolute beat number of a bar and beat, counting the beats of each meter.
+        """
+        meter_bars = self._meter_bars
+        index = 0
+        if len(meter_bars) > 1:
+            index = max(bisect_right(meter_bars, bar) - 1, 0)
+        return int(self._meter_beats[index] + (bar - meter_bars[index])
+                   * self._meter_beats_per_bar[index] + beat - 1)
+
+    def is_first_beat_of_bar(self, beat_number):
+        """
+        Returns True if the absolute beat number is the first beat of a bar.
+        """
+        index = max(bisect_right(self._meter_beats, beat_number) - 1, 0)
+        return (beat_number - self._meter_beats[index]) % self._meter_beats_per_bar[index] == 0
 
     def reposition(self, pos):
+        """
+        Makes the segment of the beat located to current. If the tempo, meter or sample rate of
+        pos differ from what was learned for that beat, e.g. because the master's tempo map
+        changed, its meter is renumbered and a new segment starts with the next beat.
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :return: None
+        """
+        if self.tempo_changed(pos):
+            self.beats_per_bar = pos.beats_per_bar
+            self.beat_type = pos.beat_type
+            self.ticks_per_beat = pos.ticks_per_beat
+            index = max(bisect_right(self._meter_bars, pos.bar) - 1, 0)
+            if self._meter_beats_per_bar[index] != (int(pos.beats_per_bar) or 1):
+                self.record_meter_change(pos.bar, self.beat_number_from_pos(pos) - (pos.beat - 1),
+                                         pos.beats_per_bar)
         beat_number = self.beat_number_from_pos(pos)
-        for group_number in self.fpb_group:
-            group_info = self.fpb_group[group_number]
-            if beat_number > group_info['start_beat']:
-                if group_info['end_beat'] is None:
-                    self.current_fpb_group = group_number
-                elif beat_number < group_info['end_beat']:
-                    self.current_fpb_group = group_number
+        segment = self.fpb_segments.at_beat(beat_number)
+        if segment.estimator.expected_width != float(self.get_frames_per_beat(pos)):
+            self.record_bpm_change(pos, beat_number + 1)
+            return
+        self.current_segment = segment
+        self.beats_per_minute = pos.beats_per_minute
+        self.frame_rate = pos.frame_rate
 
 
     def set_max_buffer_size(self, max_buffer_size):
@@ -236,20 +605,75 @@ class BeatStateMachine(object):
 
 
 class PyJackTimebaseClient(object):
-    def __init__(self, client, shutdownevent):
+    # the tempo of the transport is read on creation, so lib.supervisor waits for a timebase
+    # master's position before creating a client.
+    needs_position = True
+
+    def __init__(self, client, shutdownevent, beat_retention=None, telemetry=None,
+                 publisher=None, midi_clock=False, beat_note=None, bar_note=None,
+                 midi_channel=1, stats=None, checkpoint=None, snapshot=None, saved_state=None):
         """
 
                 :param client: python-jack Client object
                 :param shutdownevent: threading event to signal shutdown
+                :param beat_retention: number of recent beats to keep, or None to keep all
+                :param telemetry: TelemetryQueue the process callback reports to
+                :param publisher: SharedStatePublisher the process callback publishes
+                predictions to, or None
+                :param midi_clock: register a MIDI output port for clock and transport events
+                :param beat_note: note sounded on the MIDI port on each beat, or None
+                :param bar_note: note sounded on the MIDI port on the first beat of each bar,
+                or None
+                :param midi_channel: MIDI channel of the beat and bar notes
+                :param stats: CallbackStats the callbacks are timed and counted in
+                :param checkpoint: path of a beat model checkpoint to start from, if it
+                matches the transport's sample rate, tempo and meter
+                :param snapshot: PositionSnapshot the process callback publishes each cycle
+                to, or None
+                :param saved_state: Checkpoint returned by saved_state of the client this one
+                replaces, e.g. before the JACK server restarted. Used instead of the
+                checkpoint file if it matches the transport's sample rate, tempo and meter.
         """
         self.client = client
         self.shutdownevent = shutdownevent
+        if telemetry is None:
+            telemetry = TelemetryQueue()
+        self.telemetry = telemetry
+        self.publisher = publisher
+        self.snapshot = snapshot
+        # beat line whose width the snapshot was last published with, and the width as a float.
+        self._snapshot_line = None
+        self._snapshot_width = nan
+        if stats is None:
+            stats = CallbackStats()
+        self.stats = stats
 
         self.state, self.pos = self.client.transport_query_struct()
 
-        self.beat_state = BeatStateMachine(self.pos, self.client.blocksize)
-
-        self.client.set_process_callback(self.process)
+        self.beat_state = BeatStateMachine(self.pos, self.client.blocksize, beat_retention)
+        if saved_state is not None:
+            try:
+                check_checkpoint(saved_state, self.pos)
+                self.beat_state.restore(saved_state)
+                checkpoint = None
+            except CheckpointError as e:
+                print('not restoring the beat model: {0}'.format(e), file=sys.stderr)
+        if checkpoint is not None:
+            try:
+                self.beat_state.restore(read_checkpoint(checkpoint, self.pos))
+            except CheckpointError as e:
+                print('not starting from checkpoint: {0}'.format(e), file=sys.stderr)
+        # monotonic time of the first beat that started where it was predicted, see
+        # lib.supervisor.
+        self.ready_at = None
+        # events scheduled at musical positions, dispatched by process.
+        self.scheduler = BeatScheduler(self.beat_state, self.pos)
+        self.midi_clock = None
+        if midi_clock or beat_note is not None or bar_note is not None:
+            self.midi_clock = MidiClock(self.client.midi_outports.register('clock'),
+                                        self.beat_state, beat_note, bar_note, midi_channel)
+
+        self.client.set_process_callback(self.stats.timed('process', self.process))
         self.client.set_shutdown_callback(self.shutdown)
         #this is named set_buffer_size_callback in jack.
         self.client.set_blocksize_callback(self.buffer_size_callback)
@@ -257,23 +681,62 @@ class PyJackTimebaseClient(object):
         #keep state to signal discontinuity change only once
         self.o_discon = False
 
-        self.beat_last_cycle = 0
+        # the beat of the initial position was recorded by BeatStateMachine, so the first cycle
+        # does not record it again.
+        self.beat_last_cycle = self.pos.beat
+        self.bar_last_cycle = self.pos.bar
+        # absolute beat number of the last cycle.
+        self.beat_number = self.beat_state.beat_number_from_pos(self.pos)
 
     def process(self, nframes):
         self.state, self.pos = self.client.transport_query_struct()
 
-        if self.check_if_repositioned():
+        segment = self.beat_state.current_segment
+        repositioned = self.check_if_repositioned()
+        beat_changed = self.pos.beat != self.beat_last_cycle or self.pos.bar != self.bar_last_cycle
+        if repositioned:
+            self.stats.count(REPOSITIONS)
             self.beat_state.reposition(self.pos)
-        elif self.pos.beat != self.beat_last_cycle:
-            self.beat_state.record_beat(self.pos, nframes)
-
-        print(self.beat_state.predict_beat_frame(self.beat_state.beat_number_from_pos(self.pos) + 1))
-        print(self.beat_state.fpb_group)
+        else:
+            if self.beat_state.tempo_changed(self.pos):
+                self.beat_state.record_tempo_change(
+                    self.pos, self.beat_number + (1 if beat_changed else 0), beat_changed)
+            if beat_changed:
+                if self.ready_at is None:
+                    self.check_ready(nframes)
+                self.beat_state.record_beat(self.pos, nframes)
+        self.beat_number = self.beat_state.beat_number_from_pos(self.pos)
+        if self.beat_state.current_segment is not segment:
+            self.stats.count(SEGMENT_CHANGES)
+        self.scheduler.dispatch(self.state, self.pos, nframes)
+
+        next_beat = self.beat_number + 1
+        next_beat_frame = self.beat_state.predict_beat_frame(next_beat)
+        if next_beat_frame is None:
+            next_beat_frame = nan
+        segment = self.beat_state.current_segment
+        low, high = segment.fpb
+        self.telemetry.push(CLIENT_PREDICTION, self.pos.frame, next_beat, next_beat_frame,
+                            segment.number, low, high)
+        if self.publisher is not None:
+            self.publisher.publish(self.pos.frame, self.state == jack.ROLLING, next_beat - 1,
+                                   segment.number, low, high, self.beat_state.predict_beat_frame)
+        if self.snapshot is not None:
+            # the width is converted again only when the segment's beat line is rebuilt.
+            line = segment.beat_line()
+            if line is not self._snapshot_line:
+                self._snapshot_line = line
+                self._snapshot_width = float(line.width)
+            self.snapshot.publish(self.state, self.pos, next_beat, next_beat_frame,
+                                  self._snapshot_width, segment.number, low, high)
+        if self.midi_clock is not None:
+            self.midi_clock.process(self.state, self.pos, nframes, repositioned)
 
         self.after_process(nframes)
 
     def after_process(self, nframes):
         self.beat_last_cycle = self.pos.beat
+        self.bar_last_cycle = self.pos.bar
 
         if self.state is jack.ROLLING:
             self.expected_next_frame = self.pos.frame + nframes
@@ -294,11 +757,33 @@ class PyJackTimebaseClient(object):
                 self.o_discon = False
                 return False
 
+    def check_ready(self, nframes):
+        """
+        Sets ready_at if the beat that just started was predicted within a cycle of its window.
+        Only called until it is, so the prediction is made before the beat refines it.
+        :param nframes: number of frames in the current cycle
+        :return: None
+        """
+        beat_state = self.beat_state
+        predicted = beat_state.beat_frame(beat_state.beat_number_from_pos(self.pos))
+        if predicted is None:
+            return
+        window_start, window_end = beat_state.beat_window(self.pos, nframes)
+        if window_start - nframes <= predicted <= window_end + nframes:
+            self.ready_at = time.monotonic()
+
+    def saved_state(self):
+        """
+        Returns the learned beat model, for a client replacing this one.
+        :return: Checkpoint
+        """
+        return self.beat_state.checkpoint()
+
     def buffer_size_callback(self, bufsize):
         #inform beat state machine of the change.
         self.beat_state.set_max_buffer_size(bufsize)
 
-    def shutdown(self):
+    def shutdown(self, status=None, reason=None):
         self.shutdownevent.set()
 
 
@@ -306,12 +791,16 @@ if __name__ == "__main__":
     client = jack.Client('jacktime')
     shutdownevent = threading.Event()
     tclient = PyJackTimebaseClient(client, shutdownevent)
+    reporter = TelemetryReporter(tclient.telemetry)
+    reporter.start()
     with client:
         try:
             shutdownevent.wait()
 
         except KeyboardInterrupt:
-            pprint(tclient.beat_state.beat_map)
+            pprint(dict(tclient.beat_state.beat_map.items()))
         except Exception as e:
             print(e.with_traceback(e.__traceback__))
             sys.exit(0)
+        finally:
+            reporter.stop()
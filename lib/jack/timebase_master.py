@@ -1,15 +1,35 @@
 import sys
 import threading
+import time
 import jack
-from pprint import pprint
+from math import isnan, nan
+from lib.jack.bbt import Tempo, TempoMap, BBTEngine
+from lib.jack.control import (BEAT_TYPE, BEATS_PER_BAR, CONTROL_SPAN, LOCATE_FRAME, LOCATES,
+                              TEMPO, changed, requested)
+from lib.jack.frames import frames_per_beat
+from lib.stats import CallbackStats, REPOSITIONS, SEGMENT_CHANGES
+from lib.telemetry import TelemetryQueue, TelemetryReporter, MASTER_POSITION
 
 
 class TimebaseConfig(object):
     def __init__(self, pos):
         """
 
-        :param client: python-jack Client object
+        :param pos: cdata object, jack_position_t C struct, via jack-python
         """
+        self._read(pos)
+
+    def update(self, pos):
+        """
+        Reads the config from pos.
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :return: True if the tempo or meter changed.
+        """
+        tempo_and_meter = self.tempo_and_meter()
+        self._read(pos)
+        return tempo_and_meter != self.tempo_and_meter()
+
+    def _read(self, pos):
         self.usecs = pos.usecs
         self.frame_rate = pos.frame_rate
         self.frame = pos.frame
@@ -35,46 +55,130 @@ class TimebaseConfig(object):
             self.ticks_per_beat = 1920.0
             self.beats_per_minute = 120.0
 
-    def getPos(self):
-        pos = jack._ffi.new("jack_position_t *")
-        pos.usecs = self.usecs
-        pos.frame_rate = self.frame_rate
-        pos.valid = self.valid
+    def set_tempo_and_meter(self, beats_per_minute, beats_per_bar, beat_type):
+        """
+        Changes the tempo and meter; nan leaves a field as it is.
+        :return: True if the tempo or meter changed.
+        """
+        if not (changed(self.beats_per_minute, beats_per_minute)
+                or changed(self.beats_per_bar, beats_per_bar)
+                or changed(self.beat_type, beat_type)):
+            return False
+        if changed(self.beats_per_minute, beats_per_minute):
+            self.beats_per_minute = beats_per_minute
+        if changed(self.beats_per_bar, beats_per_bar):
+            self.beats_per_bar = beats_per_bar
+        if changed(self.beat_type, beat_type):
+            self.beat_type = beat_type
+        return True
+
+    def tempo_and_meter(self):
+        return (self.frame_rate, self.valid, self.beats_per_bar, self.beat_type,
+                self.ticks_per_beat, self.beats_per_minute)
+
+    def write_bbt(self, pos):
+        """
+        Writes the fields that advance from beat to beat: bar, beat, tick and bar_start_tick.
+        Does not allocate.
+        :param pos: cdata object, jack_position_t C struct
+        :return: None
+        """
         pos.bar = self.bar
         pos.beat = self.beat
         pos.tick = self.tick
         pos.bar_start_tick = self.bar_start_tick
+
+    def write_tempo_and_meter(self, pos):
+        """
+        Writes the fields that only change with the tempo or meter. Does not allocate.
+        :param pos: cdata object, jack_position_t C struct
+        :return: None
+        """
+        pos.valid = self.valid
         pos.beats_per_bar = self.beats_per_bar
         pos.beat_type = self.beat_type
         pos.ticks_per_beat = self.ticks_per_beat
         pos.beats_per_minute = self.beats_per_minute
+
+    def getPos(self):
+        """
+        Returns a new position struct filled from this config. Allocates, so it is not to be
+        called from the process thread.
+        :return: cdata object, jack_position_t C struct pointer
+        """
+        pos = jack._ffi.new("jack_position_t *")
+        pos.usecs = self.usecs
+        pos.frame_rate = self.frame_rate
+        self.write_tempo_and_meter(pos)
+        self.write_bbt(pos)
         return pos
 
 
 class PyJackTimebaseMaster(object):
-    def __init__(self, client, shutdownevent):
+    def __init__(self, client, shutdownevent, telemetry=None, stats=None, time_signature=None,
+                 control=None, snapshot=None, saved_state=None):
         """
 
                 :param client: python-jack Client object
                 :param shutdownevent: threading event to signal shutdown
+                :param telemetry: TelemetryQueue the process callback reports to
+                :param stats: CallbackStats the callbacks are timed and counted in
+                :param time_signature: tuple (beats_per_bar, beat_type) to start with instead
+                of the current meter
+                :param control: ControlBuffer of tempo, meter and locate requests, see
+                apply_control
+                :param snapshot: PositionSnapshot the process callback publishes each cycle
+                to, or None
+                :param saved_state: state returned by saved_state of the master this one
+                replaces, e.g. before the JACK server restarted, or None
         """
         self.client = client
         self.shutdownevent = shutdownevent
+        if telemetry is None:
+            telemetry = TelemetryQueue()
+        self.telemetry = telemetry
+        self.snapshot = snapshot
+        if stats is None:
+            stats = CallbackStats()
+        self.stats = stats
 
         state, pos = self.client.transport_query_struct()
         self.config = TimebaseConfig(pos)
+        if time_signature is not None:
+            self.config.set_tempo_and_meter(nan, *time_signature)
+        self.control = control
+        # locates requested through the control buffer so far, including those applied by a
+        # master this one replaces.
+        self._locates = control.state[LOCATES] if control is not None else 0.0
+        # the timebase callback rewrites the tempo and meter fields only when this is set.
+        self._tempo_and_meter_changed = True
+        # frame 0 is bar 1 beat 1; tempo and meter changes are added as segments by new_config.
+        self.tempo_map = TempoMap(self.client.samplerate, self.config.beats_per_minute,
+                                  self.config.beats_per_bar, self.config.beat_type,
+                                  self.config.ticks_per_beat)
+        # start frame of the last tempo segment a control change started, see apply_control.
+        self._control_frame = None
+        self._control_span = int(CONTROL_SPAN * self.client.samplerate)
+        if saved_state is not None:
+            self.restore(saved_state)
+        self.bbt = BBTEngine(self.tempo_map)
+        if control is not None:
+            control.prepare = self.prepare_control
+        # monotonic time of the first timebase callback, see lib.supervisor.
+        self.ready_at = None
 
-        self.client.set_process_callback(self.process)
+        self.client.set_process_callback(self.stats.timed('process', self.process))
         self.client.set_shutdown_callback(self.shutdown)
 
         self.client.transport_reposition_struct(self.config.getPos())
 
     def set_timebase_callback(self):
-        self.client.set_timebase_callback(callback=self.timebase_callback)
+        self.client.set_timebase_callback(
+            callback=self.stats.timed('timebase', self.timebase_callback))
 
     def timebase_callback(self, state, blocksize, pos, new_pos):
         """
-        TODO
+        Writes frame-consistent bars, beats and ticks for pos.frame using the tempo map.
         The goal of this timebase callback is to ensure that the bar and beat information is consistent
         on requests to modify the current jack timebase information, and to the extent possible, ensure
         that beats occur at regular intervals.
@@ -108,17 +212,31 @@ class PyJackTimebaseMaster(object):
         :return: None
         """
 
-        # pos is a cffi cdata object. pos[0] represents the
-        # dereferenced value of the jack_position_t struct
-        # pointed to by pos[0] (typically spelled *pos in C++)
-        import time
-        pos[0] = self.config.getPos()
+        # pos is a cffi cdata object pointing to the jack_position_t struct (typically spelled
+        # *pos in C++). Bars, beats and ticks are computed from pos.frame by the BBT engine.
+        # The tempo and meter are only written after a reposition or when the tempo segment
+        # changes.
+        if self.ready_at is None:
+            self.ready_at = time.monotonic()
+        if self.bbt.seek(pos.frame) or new_pos or self._tempo_and_meter_changed:
+            if new_pos:
+                self.stats.count(REPOSITIONS)
+            else:
+                self.stats.count(SEGMENT_CHANGES)
+            self._tempo_and_meter_changed = False
+            self.bbt.write_tempo_and_meter(pos)
+        self.bbt.write_bbt(pos)
 
     def process(self, nframes):
         self.state, self.pos = self.client.transport_query_struct()
-        x, self.posd = self.client.transport_query()
         self.next_frame = self.pos.frame + nframes
-        pprint(self.posd)
+        pos = self.pos
+        if self.control is not None and self.control.read():
+            self.apply_control(pos, nframes)
+        self.telemetry.push(MASTER_POSITION, pos.frame, self.state, pos.bar, pos.beat, pos.tick,
+                            pos.beats_per_minute)
+        if self.snapshot is not None:
+            self.snapshot.publish(self.state, pos)
 #        if self.state == jack.ROLLING:
 #            self.increment_beat()
 
@@ -141,24 +259,128 @@ class PyJackTimebaseMaster(object):
             self.client.transport_reposition_struct(pos)
 
     def set_frames_per_beat(self):
-        bps = self.config.beats_per_minute / 60
-        fpb = bps * self.config.frame_rate
-        self.fpb = fpb
+        """
+        Sets fpb to the exact frames per beat of the current tempo, as a Fraction.
+        """
+        self.fpb = frames_per_beat(self.config.frame_rate, self.config.beats_per_minute)
+
+    def prepare_control(self, state):
+        """
+        Builds the Tempo a control state requests, in the control thread as it publishes the
+        state, so that apply_control only appends it to the tempo map.
+        :param state: sequence of FIELDS floats, see lib.jack.control
+        :return: Tempo, or None if the state requests no tempo or meter
+        """
+        if isnan(state[TEMPO]) and isnan(state[BEATS_PER_BAR]) and isnan(state[BEAT_TYPE]):
+            return None
+        config = self.config
+        return Tempo(self.tempo_map.frame_rate,
+                     requested(config.beats_per_minute, state[TEMPO]),
+                     requested(config.beats_per_bar, state[BEATS_PER_BAR]),
+                     requested(config.beat_type, state[BEAT_TYPE]), config.ticks_per_beat)
+
+    def apply_control(self, pos, nframes):
+        """
+        Applies the latest state read from the control buffer: a new tempo or meter takes effect
+        at the next cycle boundary, and the transport is located once however many locates were
+        requested since the last cycle.
+
+        While rolling, a change within CONTROL_SPAN of the start of the previous control change
+        takes effect CONTROL_SPAN after it instead, and a change that has not taken effect yet is
+        replaced by the next. A sweep thus adds one tempo segment per CONTROL_SPAN however many
+        cycles it lasts, and the tempo map keeps them all. The control server publishes at most
+        once per CONTROL_SPAN, so its changes take effect at the next cycle boundary, or at most
+        a period later where cycle boundaries bring two publications closer than the span.
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :param nframes: number of frames in the cycle
+        :return: None
+        """
+        control = self.control
+        state = control.state
+        config = self.config
+        if config.set_tempo_and_meter(state[TEMPO], state[BEATS_PER_BAR], state[BEAT_TYPE]):
+            if self.state == jack.ROLLING:
+                frame = pos.frame + nframes
+                previous = self._control_frame
+                if previous is not None:
+                    if previous <= frame < previous + self._control_span:
+                        frame = previous + self._control_span
+                    elif frame < previous <= frame + self._control_span:
+                        # the previous change has not taken effect yet and is replaced.
+                        frame = previous
+            else:
+                # the stopped transport shows the change at once, replacing any at its frame.
+                frame = pos.frame
+            self._control_frame = frame
+            tempo = control.prepared
+            if tempo is None or not tempo.matches(self.tempo_map.frame_rate,
+                                                  config.beats_per_minute, config.beats_per_bar,
+                                                  config.beat_type, config.ticks_per_beat):
+                # the tempo or meter changed since the state was prepared.
+                tempo = Tempo(self.tempo_map.frame_rate, config.beats_per_minute,
+                              config.beats_per_bar, config.beat_type, config.ticks_per_beat)
+            self.tempo_map.append_tempo(frame, tempo)
+            self.bbt.invalidate()
+            self._tempo_and_meter_changed = True
+            self.fpb = tempo.frames_per_beat
+        if state[LOCATES] != self._locates:
+            self._locates = state[LOCATES]
+            self.client.transport_locate(int(state[LOCATE_FRAME]))
 
     def new_config(self, pos):
-        self.config = TimebaseConfig(pos)
+        """
+        Applies the tempo and meter of pos from pos.frame on.
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :return: None
+        """
+        if self.config.update(pos):
+            config = self.config
+            self.tempo_map.append(pos.frame, config.beats_per_minute, config.beats_per_bar,
+                                  config.beat_type, config.ticks_per_beat)
+            self.bbt.invalidate()
+            self._tempo_and_meter_changed = True
         self.set_frames_per_beat()
-    def shutdown(self):
+
+    def saved_state(self):
+        """
+        Returns the tempo, meter and tempo map, for a master replacing this one. Not to be
+        called while the client is active.
+        :return: tuple (frame_rate, beats_per_minute, beats_per_bar, beat_type, tempo_map)
+        """
+        config = self.config
+        return (self.tempo_map.frame_rate, config.beats_per_minute, config.beats_per_bar,
+                config.beat_type, self.tempo_map)
+
+    def restore(self, saved_state):
+        """
+        Continues the tempo map and the tempo and meter of a previous master, if it ran at the
+        current sample rate.
+        :param saved_state: tuple returned by saved_state
+        :return: None
+        """
+        frame_rate, beats_per_minute, beats_per_bar, beat_type, tempo_map = saved_state
+        if frame_rate != self.tempo_map.frame_rate:
+            print('not restoring the tempo map: sample rate {0} does not match {1}'
+                  .format(frame_rate, self.tempo_map.frame_rate), file=sys.stderr)
+            return
+        self.config.set_tempo_and_meter(beats_per_minute, beats_per_bar, beat_type)
+        self.tempo_map = tempo_map
+
+    def shutdown(self, status=None, reason=None):
         self.shutdownevent.set()
 
 
 if __name__ == "__main__":
     client = jack.Client('jacktime')
     shutdownevent = threading.Event()
-    PyJackTimebaseMaster(client, shutdownevent)
+    master = PyJackTimebaseMaster(client, shutdownevent)
+    reporter = TelemetryReporter(master.telemetry)
+    reporter.start()
     with client:
         try:
             shutdownevent.wait()
         except Exception as e:
             print(e.with_traceback(e.__traceback__))
             sys.exit(0)
+        finally:
+            reporter.stop()
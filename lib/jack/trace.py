@@ -0,0 +1,130 @@
+import mmap
+import os
+import struct
+import sys
+from lib.stats import CallbackStats
+from lib.telemetry import TelemetryQueue
+
+MAGIC = b'JTTRACE1'
+VERSION = 1
+
+# magic, version, record size, frame rate, capacity in records, records written, records
+# dropped because the trace was full.
+HEADER = struct.Struct('<8sQQQQQQ')
+HEADER_SIZE = 64
+# offset of the records written count, updated after each record.
+COUNT_OFFSET = 40
+
+# one record per cycle: frame, usecs, nframes, transport state, valid, bar, beat, tick,
+# bar_start_tick, beats_per_bar, ticks_per_beat, beats_per_minute.
+RECORD = struct.Struct('<qQiiiiiidddd')
+RECORD_FIELDS = ('frame', 'usecs', 'nframes', 'state', 'valid', 'bar', 'beat', 'tick',
+                 'bar_start_tick', 'beats_per_bar', 'ticks_per_beat', 'beats_per_minute')
+
+_COUNT = struct.Struct('<Q')
+
+
+class TraceWriter(object):
+    """
+    Appends fixed-width binary records of the transport position to a preallocated,
+    memory-mapped trace file.
+
+    Appending packs the position into the map with a precompiled struct and then updates the
+    record count in the header, so the file is readable up to the last complete record even if
+    the process dies. Nothing is formatted and the file never grows: once it is full, records
+    are dropped and counted.
+    """
+    def __init__(self, path, capacity, frame_rate):
+        """
+        :param path: trace file, created or truncated
+        :param capacity: number of records to preallocate
+        :param frame_rate: sample rate recorded in the header
+        """
+        self.path = path
+        self.capacity = capacity
+        size = HEADER_SIZE + capacity * RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size, frame_rate, capacity, 0, 0)
+        self.count = 0
+        self.dropped = 0
+
+    def append(self, nframes, state, pos):
+        """
+        Records the position of a cycle. Safe to call from the JACK process thread.
+        :param nframes: number of frames in the cycle
+        :param state: transport state
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :return: False if the trace is full and the record was dropped.
+        """
+        count = self.count
+        if count >= self.capacity:
+            self.dropped += 1
+            return False
+        RECORD.pack_into(self._map, HEADER_SIZE + count * RECORD.size, pos.frame, pos.usecs,
+                         nframes, state, pos.valid, pos.bar, pos.beat, pos.tick,
+                         pos.bar_start_tick, pos.beats_per_bar, pos.ticks_per_beat,
+                         pos.beats_per_minute)
+        self.count = count + 1
+        _COUNT.pack_into(self._map, COUNT_OFFSET, count + 1)
+        return True
+
+    def close(self):
+        """
+        Writes the dropped record count, flushes and unmaps the trace.
+        """
+        _COUNT.pack_into(self._map, COUNT_OFFSET + 8, self.dropped)
+        self._map.flush()
+        self._map.close()
+
+
+class TransportRecorder(object):
+    """
+    Records the transport position reported to every cycle, for offline analysis of how a
+    timebase master behaves. See lib.jack.trace_analysis.
+    """
+    def __init__(self, client, shutdownevent, telemetry=None, stats=None,
+                 trace='jacktime.trace', hours=4.0, snapshot=None):
+        """
+        :param client: python-jack Client object
+        :param shutdownevent: threading event to signal shutdown
+        :param telemetry: TelemetryQueue, unused; the trace replaces telemetry
+        :param stats: CallbackStats the callbacks are timed and counted in
+        :param trace: path of the trace file
+        :param hours: length of transport the trace file is preallocated for at the current
+        blocksize
+        :param snapshot: PositionSnapshot the process callback publishes each cycle to, or None
+        """
+        self.client = client
+        self.shutdownevent = shutdownevent
+        if telemetry is None:
+            telemetry = TelemetryQueue()
+        self.telemetry = telemetry
+        self.snapshot = snapshot
+        if stats is None:
+            stats = CallbackStats()
+        self.stats = stats
+        capacity = int(hours * 3600 * client.samplerate / client.blocksize) + 1
+        self.writer = TraceWriter(trace, capacity, client.samplerate)
+
+        self.client.set_process_callback(self.stats.timed('process', self.process))
+        self.client.set_shutdown_callback(self.shutdown)
+
+    def process(self, nframes):
+        state, pos = self.client.transport_query_struct()
+        self.writer.append(nframes, state, pos)
+        if self.snapshot is not None:
+            self.snapshot.publish(state, pos)
+
+    def close(self):
+        self.writer.close()
+        if self.writer.dropped:
+            print('trace full: {0} cycles not recorded'.format(self.writer.dropped),
+                  file=sys.stderr)
+
+    def shutdown(self, status=None, reason=None):
+        self.shutdownevent.set()
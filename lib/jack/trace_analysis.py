@@ -0,0 +1,160 @@
+import mmap
+import numpy as np
+from lib.jack.trace import COUNT_OFFSET, HEADER, HEADER_SIZE, MAGIC, RECORD, VERSION
+
+# numpy layout of lib.jack.trace.RECORD.
+RECORD_DTYPE = np.dtype([('frame', '<i8'), ('usecs', '<u8'), ('nframes', '<i4'),
+                         ('state', '<i4'), ('valid', '<i4'), ('bar', '<i4'), ('beat', '<i4'),
+                         ('tick', '<i4'), ('bar_start_tick', '<f8'), ('beats_per_bar', '<f8'),
+                         ('ticks_per_beat', '<f8'), ('beats_per_minute', '<f8')])
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+# jack_transport_state_t and jack_position_bits_t values, so analysis does not need JACK.
+ROLLING = 1
+POSITION_BBT = 0x10
+
+
+def load_trace(path):
+    """
+    Maps a trace written by lib.jack.trace.TraceWriter as a structured array, without copying.
+    :param path: trace file
+    :return: tuple (records, frame_rate); records is a read-only array of RECORD_DTYPE
+    """
+    with open(path, 'rb') as trace_file:
+        data = mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, record_size, frame_rate, capacity, _, _ = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError('{0} is not a jacktime trace version {1}'.format(path, VERSION))
+    count = np.frombuffer(data, dtype='<u8', count=1, offset=COUNT_OFFSET)[0]
+    records = np.frombuffer(data, dtype=RECORD_DTYPE, count=int(min(count, capacity)),
+                            offset=HEADER_SIZE)
+    return records, frame_rate
+
+
+def analyze(records, frame_rate):
+    """
+    Computes beat widths, skew, repositions and tempo segments of a trace in vectorized passes.
+    An empty trace has no segments, beats or repositions.
+    :param records: array of RECORD_DTYPE, see load_trace
+    :param frame_rate: sample rate of the trace
+    :return: dict
+    """
+    frame = records['frame']
+    rolling = records['state'] == ROLLING
+    bbt = (records['valid'] & POSITION_BBT) != 0
+    beats_per_bar = records['beats_per_bar']
+    bpm = records['beats_per_minute']
+    absolute_beat = ((records['bar'].astype(np.int64) - 1) * beats_per_bar.astype(np.int64)
+                     + records['beat'])
+    # the first cycle, if any, is compared with nothing.
+    first = min(records.size, 1)
+
+    # a cycle is a reposition when its frame is not where the previous cycle left off.
+    expected = frame[:-1] + np.where(rolling[:-1], records['nframes'][:-1], 0)
+    repositioned = np.concatenate((np.zeros(first, bool), frame[1:] != expected))
+    reposition_cycles = np.flatnonzero(repositioned)
+
+    # tempo segments start at the first cycle and at every change of tempo or meter.
+    tempo_changed = np.concatenate((np.ones(first, bool), (bpm[1:] != bpm[:-1])
+                                    | (beats_per_bar[1:] != beats_per_bar[:-1])))
+    segment_starts = np.flatnonzero(tempo_changed)
+    segment_of_cycle = np.cumsum(tempo_changed) - 1
+
+    # beat changes seen while rolling with valid BBT, excluding repositions.
+    beat_changed = np.concatenate((np.zeros(first, bool), absolute_beat[1:] != absolute_beat[:-1]))
+    beat_cycles = np.flatnonzero(beat_changed & ~repositioned & rolling & bbt)
+    # the beat started tick ticks before the cycle's frame.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frames_per_tick = 60.0 * frame_rate / bpm / records['ticks_per_beat']
+    beat_frames = frame[beat_cycles] - records['tick'][beat_cycles] * frames_per_tick[beat_cycles]
+
+    # widths between consecutive beat changes of one contiguous, constant tempo run.
+    run = np.cumsum(repositioned | tempo_changed | ~rolling)
+    same_run = run[beat_cycles[1:]] == run[beat_cycles[:-1]]
+    beat_counts = absolute_beat[beat_cycles[1:]] - absolute_beat[beat_cycles[:-1]]
+    valid = same_run & (beat_counts > 0)
+    widths = np.diff(beat_frames)[valid] / beat_counts[valid]
+    width_cycles = beat_cycles[1:][valid]
+    expected_widths = 60.0 * frame_rate / bpm[width_cycles]
+    skew = (widths - expected_widths) / expected_widths * 100
+
+    # statistics of the widths of each segment, grouped by segment number in one pass each.
+    segment_count = segment_starts.size
+    width_segments = segment_of_cycle[width_cycles]
+    segment_beats = np.bincount(width_segments, minlength=segment_count)
+    segment_bpm = bpm[segment_starts]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected_segment_widths = np.where(segment_bpm != 0, 60.0 * frame_rate / segment_bpm,
+                                           np.nan)
+        mean_widths = np.bincount(width_segments, widths, segment_count) / segment_beats
+        width_sds = np.sqrt(np.bincount(width_segments,
+                                        (widths - mean_widths[width_segments]) ** 2,
+                                        segment_count) / segment_beats)
+        mean_skews = np.bincount(width_segments, skew, segment_count) / segment_beats
+    max_skews = np.full(segment_count, np.nan)
+    np.fmax.at(max_skews, width_segments, np.abs(skew))
+    segments = [{'cycle': start, 'frame': start_frame, 'beats_per_minute': segment_tempo,
+                 'beats_per_bar': segment_beats_per_bar, 'expected_width': expected_width,
+                 'beats': beats, 'mean_width': mean_width, 'width_sd': width_sd,
+                 'mean_skew': mean_skew, 'max_skew': max_skew}
+                for (start, start_frame, segment_tempo, segment_beats_per_bar, expected_width,
+                     beats, mean_width, width_sd, mean_skew, max_skew)
+                in zip(segment_starts.tolist(), frame[segment_starts].tolist(),
+                       segment_bpm.tolist(), beats_per_bar[segment_starts].tolist(),
+                       expected_segment_widths.tolist(), segment_beats.tolist(),
+                       mean_widths.tolist(), width_sds.tolist(), mean_skews.tolist(),
+                       max_skews.tolist())]
+
+    # master quirks: the tick should advance within a beat while rolling, and bar_start_tick
+    # should match the bar.
+    advancing = rolling[1:] & rolling[:-1] & ~repositioned[1:] & ~beat_changed[1:] & bbt[1:]
+    tick_stuck = int(np.count_nonzero(advancing & (records['tick'][1:] == records['tick'][:-1])))
+    expected_bar_start = ((records['bar'] - 1) * beats_per_bar * records['ticks_per_beat'])
+    bar_start_mismatch = int(np.count_nonzero(bbt & (records['bar_start_tick']
+                                                       != expected_bar_start)))
+    return {
+        'cycles': int(records.size),
+        'seconds': float((frame[-1] - frame[0]) / frame_rate) if records.size else 0.0,
+        'rolling_cycles': int(np.count_nonzero(rolling)),
+        'bbt_cycles': int(np.count_nonzero(bbt)),
+        'repositions': [(int(cycle), int(frame[cycle - 1]), int(frame[cycle]))
+                        for cycle in reposition_cycles],
+        'segments': segments,
+        'beats': int(beat_cycles.size),
+        'widths': widths,
+        'skew': skew,
+        'quirks': {'tick_not_advancing': tick_stuck,
+                   'bar_start_tick_mismatch': bar_start_mismatch,
+                   'bbt_invalid': int(records.size - np.count_nonzero(bbt))},
+    }
+
+
+def report(analysis, repositions=20):
+    """
+    Formats an analysis as text.
+    :param analysis: dict returned by analyze
+    :param repositions: number of repositions listed
+    :return: str
+    """
+    lines = ['{0} cycles, {1:.1f} s of transport, {2} rolling, {3} with BBT, {4} beat changes'
+             .format(analysis['cycles'], analysis['seconds'], analysis['rolling_cycles'],
+                     analysis['bbt_cycles'], analysis['beats'])]
+    skew = analysis['skew']
+    if skew.size:
+        lines.append('beat width skew: mean {0:+.4f}% sd {1:.4f}% max |{2:.4f}|%'
+                     .format(skew.mean(), skew.std(), np.abs(skew).max()))
+    lines.append('tempo segments:')
+    for segment in analysis['segments']:
+        lines.append('  cycle {cycle} frame {frame}: {beats_per_minute:.3f} bpm '
+                     '{beats_per_bar:g}/bar, expected width {expected_width:.2f}, {beats} widths '
+                     'mean {mean_width:.2f} sd {width_sd:.2f}, skew mean {mean_skew:+.4f}% '
+                     'max |{max_skew:.4f}|%'.format(**segment))
+    lines.append('{0} repositions:'.format(len(analysis['repositions'])))
+    for cycle, previous, frame in analysis['repositions'][:repositions]:
+        lines.append('  cycle {0}: frame {1} -> {2}'.format(cycle, previous, frame))
+    if len(analysis['repositions']) > repositions:
+        lines.append('  ...')
+    lines.append('quirks:')
+    for name, count in sorted(analysis['quirks'].items()):
+        lines.append('  {0}: {1} cycles'.format(name.replace('_', ' '), count))
+    return '\n'.join(lines)
@@ -1,25 +1,125 @@
 import argparse
+from lib.jack.control import DEFAULT_PORT, parse_time_signature
+from lib.shared_state import DEFAULT_PATH
 
-parser = argparse.ArgumentParser(description='Monitor and control jack timebase parameters.')
+def build_parser():
+    """
+    Returns the command line parser of jacktime.py. Nothing is parsed on import, so the modes'
+    modules can be imported without a command line.
+    """
+    parser = argparse.ArgumentParser(description='Monitor and control jack timebase parameters.')
 
-subparser = parser.add_subparsers(
-    title='Mode',
-    dest='Mode',
-    description="Choose mode 'client' or 'master'."
-)
+    # options shared by every mode.
+    common = argparse.ArgumentParser(add_help=False)
+    tg = common.add_argument_group('Telemetry')
+    tg.add_argument('--telemetry', default=None, metavar='OUTPUT',
+                    help="Where to report telemetry: 'stdout', 'none' or the path of a log file. "
+                         "Defaults to 'stdout', or 'none' with --ui.")
+    tg.add_argument('--telemetry-rate', type=float, default=10.0, metavar='HZ',
+                    help='Number of times per second telemetry is reported.')
+    sg = common.add_argument_group('Statistics')
+    sg.add_argument('--stats-socket', default=None, metavar='PATH',
+                    help='Serve callback latency, DSP load and xrun statistics as JSON on a Unix '
+                         'socket. Statistics are also dumped to the telemetry output on SIGUSR1.')
+    dg = common.add_argument_group('Display')
+    dg.add_argument('--ui', action='store_true',
+                    help='Show the position, tempo, predictions and callback load in the terminal '
+                         '(needs urwid). Telemetry defaults to none instead of stdout.')
+    dg.add_argument('--ui-rate', type=float, default=10.0, metavar='FPS',
+                    help='Number of times per second the display is redrawn.')
 
-subparser.required = True
+    # options of the modes that stay connected to the JACK server.
+    supervised = argparse.ArgumentParser(add_help=False)
+    vg = supervised.add_argument_group('Supervision')
+    vg.add_argument('--daemon', '-d', action='store_true',
+                    help='Keep running when the JACK server goes away: wait for it without '
+                         'starting one, reconnect with backoff and carry on with the tempo map or '
+                         'beat model learned so far.')
+    vg.add_argument('--backoff', type=float, default=0.5, metavar='SECONDS',
+                    help='Seconds before the first reconnect attempt, doubled after each failed '
+                         'attempt.')
+    vg.add_argument('--max-backoff', type=float, default=30.0, metavar='SECONDS',
+                    help='Longest wait between reconnect attempts.')
 
-master = subparser.add_parser('master', help="For more info, try jacktime.py master -h")
-mg = master.add_argument_group('Main')
-mg.add_argument('master', action='store_true', help='Start jacktime in master mode.')
+    subparser = parser.add_subparsers(
+        title='Mode',
+        dest='Mode',
+        description="Choose mode 'client', 'master', 'record' or 'analyze'."
+    )
 
+    subparser.required = True
 
-master.add_argument('--time-signature', '-t', )
+    master = subparser.add_parser('master', parents=[common, supervised],
+                                  help="For more info, try jacktime.py master -h")
+    mg = master.add_argument_group('Main')
+    mg.add_argument('master', action='store_true', help='Start jacktime in master mode.')
 
-client = subparser.add_parser('client', help="For more info, try jacktime.py client -h")
-cg = client.add_argument_group('Main')
-cg.add_argument('client', action='store_true', help='Start jacktime in client mode.')
 
+    master.add_argument('--time-signature', '-t', type=parse_time_signature, default=None,
+                        metavar='BEATS/TYPE',
+                        help='Time signature to start with, e.g. 7/8, instead of the current one.')
+    master.add_argument('--control', nargs='?', const='localhost:{0}'.format(DEFAULT_PORT),
+                        default=None, metavar='ADDRESS',
+                        help="Accept 'tempo BPM', 'meter BEATS/TYPE' and 'locate FRAME' commands "
+                             'on a UDP [host:]port or the path of a Unix datagram socket (default '
+                             'localhost:{0}).'.format(DEFAULT_PORT))
 
-args = parser.parse_args()
\ No newline at end of file
+    client = subparser.add_parser('client', parents=[common, supervised],
+                                  help="For more info, try jacktime.py client -h")
+    cg = client.add_argument_group('Main')
+    cg.add_argument('client', action='store_true', help='Start jacktime in client mode.')
+
+
+    client.add_argument('--beat-retention', '-r', type=int, default=None,
+                        help='Keep only this many recent beats in the beat map, in preallocated '
+                             'arrays.')
+    client.add_argument('--publish', '-p', nargs='?', const=DEFAULT_PATH, default=None,
+                        metavar='PATH',
+                        help='Publish beat predictions to a shared memory file for local readers '
+                             '(default {0}).'.format(DEFAULT_PATH))
+    client.add_argument('--publish-beats', type=int, default=8, metavar='N',
+                        help='Number of upcoming beats whose predicted frames are published.')
+    client.add_argument('--checkpoint', '-c', default=None, metavar='PATH',
+                        help='Checkpoint the learned beat model to this file in the background and '
+                             'start from it when it matches the sample rate, tempo and meter.')
+    client.add_argument('--checkpoint-interval', type=float, default=5.0, metavar='SECONDS',
+                        help='Seconds between beat model checkpoints.')
+
+    mo = client.add_argument_group('MIDI output')
+    mo.add_argument('--midi-clock', '-m', action='store_true',
+                    help='Register a MIDI output port sending clock, start, stop and continue at '
+                         'the predicted beat frames.')
+    mo.add_argument('--beat-note', type=int, default=None, metavar='NOTE',
+                    help='Also send this note on each beat.')
+    mo.add_argument('--bar-note', type=int, default=None, metavar='NOTE',
+                    help='Send this note on the first beat of each bar.')
+    mo.add_argument('--midi-channel', type=int, default=1, choices=range(1, 17), metavar='CHANNEL',
+                    help='MIDI channel of the beat and bar notes.')
+
+
+    record = subparser.add_parser('record', parents=[common],
+                                  help="For more info, try jacktime.py record -h")
+    rg = record.add_argument_group('Main')
+    rg.add_argument('record', action='store_true',
+                    help='Start jacktime in record mode, tracing the transport of every cycle.')
+    record.add_argument('--trace', default='jacktime.trace', metavar='PATH',
+                        help='Trace file to write.')
+    record.add_argument('--trace-hours', type=float, default=4.0, metavar='HOURS',
+                        help='Length of transport to preallocate the trace file for.')
+
+    analyze = subparser.add_parser('analyze',
+                                   help="For more info, try jacktime.py analyze -h")
+    analyze.add_argument('analyze', metavar='TRACE',
+                         help='Report beat widths, skew, repositions and tempo segments of a trace '
+                              'written in record mode.')
+    analyze.add_argument('--repositions', type=int, default=20, metavar='N',
+                         help='Number of repositions to list.')
+    return parser
+
+
+def parse_args(argv=None):
+    """
+    Parses the command line, sys.argv by default.
+    :return: argparse.Namespace
+    """
+    return build_parser().parse_args(argv)
@@ -0,0 +1,245 @@
+import mmap
+import os
+import time
+from array import array
+from collections import namedtuple
+from math import nan
+
+# identifies a jacktime shared state file.
+MAGIC = int.from_bytes(b'JTSTATE1', 'little')
+VERSION = 1
+
+# 8-byte slots of the shared struct. Integer slots are read through an int64 view of the map and
+# float slots through a float64 view of the same bytes.
+SLOT_MAGIC = 0
+SLOT_VERSION = 1
+SLOT_BEATS = 2
+SLOT_SEQUENCE = 3
+SLOT_FRAME = 4
+SLOT_ROLLING = 5
+SLOT_BEAT = 6
+SLOT_SEGMENT = 7
+SLOT_FPB_LOW = 8
+SLOT_FPB_HIGH = 9
+# predicted frames of the beats after the current beat, beats slots.
+SLOT_PREDICTIONS = 10
+
+DEFAULT_PATH = '/dev/shm/jacktime'
+# seconds a reader retries while the publisher is writing before giving up on it.
+READ_TIMEOUT = 0.5
+
+SharedState = namedtuple('SharedState', ['sequence', 'frame', 'rolling', 'beat', 'segment',
+                                         'fpb_low', 'fpb_high', 'predictions'])
+
+
+class SharedStateError(Exception):
+    pass
+
+
+class _SharedStateMap(object):
+    def __init__(self, fd, size, access):
+        self._map = mmap.mmap(fd, size, access=access)
+        self._ints = memoryview(self._map).cast('q')
+        self._floats = memoryview(self._map).cast('d')
+
+    def close(self):
+        self._ints.release()
+        self._floats.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SharedStatePublisher(_SharedStateMap):
+    """
+    Publishes the client's beat predictions to a memory-mapped struct once per cycle, so that
+    any number of local processes can follow the transport without their own JACK client.
+
+    The struct is protected by a sequence lock: the sequence is odd while the process callback
+    writes and is incremented again when the write is complete. Publishing writes into the map
+    directly, without a syscall or a lock, so it is safe to call from the JACK process thread.
+    Predictions are computed before the sequence is incremented, so a prediction that raises
+    leaves the last published state in place.
+
+    There is no memory barrier between the stores: Python has none to offer. Readers in other
+    processes rely on the stores becoming visible in program order, as x86 (TSO) guarantees. On
+    weakly ordered CPUs such as ARM a reader may see the final sequence before the fields.
+    """
+    def __init__(self, path=DEFAULT_PATH, beats=8):
+        """
+        :param path: file to map, normally on a tmpfs such as /dev/shm
+        :param beats: number of upcoming beats whose predicted frames are published
+        """
+        self.path = path
+        self.beats = beats
+        self._predictions = array('d', [nan]) * beats
+        size = (SLOT_PREDICTIONS + beats) * 8
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            super(SharedStatePublisher, self).__init__(fd, size, mmap.ACCESS_WRITE)
+        finally:
+            os.close(fd)
+        ints = self._ints
+        # a reader seeing an odd sequence waits for the header to be written.
+        ints[SLOT_SEQUENCE] = 1
+        ints[SLOT_VERSION] = VERSION
+        ints[SLOT_BEATS] = beats
+        ints[SLOT_MAGIC] = MAGIC
+        for slot in range(SLOT_FRAME, SLOT_PREDICTIONS + beats):
+            ints[slot] = 0
+        ints[SLOT_SEQUENCE] = 2
+        self._sequence = 2
+
+    def publish(self, frame, rolling, beat, segment, fpb_low, fpb_high, predict_beat_frame):
+        """
+        Writes the state of the current cycle.
+        :param frame: transport frame
+        :param rolling: True if the transport is rolling
+        :param beat: current absolute beat number
+        :param segment: number of the current tempo segment
+        :param fpb_low: low end of the segment's fpb range
+        :param fpb_high: high end of the segment's fpb range
+        :param predict_beat_frame: function returning the predicted frame of a beat number, or
+            None if it cannot be predicted, which is published as NaN
+        :return: None
+        """
+        predictions = self._predictions
+        for i in range(self.beats):
+            frame_prediction = predict_beat_frame(beat + 1 + i)
+            predictions[i] = nan if frame_prediction is None else frame_prediction
+        ints = self._ints
+        floats = self._floats
+        sequence = self._sequence
+        ints[SLOT_SEQUENCE] = sequence + 1
+        ints[SLOT_FRAME] = frame
+        ints[SLOT_ROLLING] = 1 if rolling else 0
+        ints[SLOT_BEAT] = beat
+        ints[SLOT_SEGMENT] = segment
+        floats[SLOT_FPB_LOW] = fpb_low
+        floats[SLOT_FPB_HIGH] = fpb_high
+        for i in range(self.beats):
+            floats[SLOT_PREDICTIONS + i] = predictions[i]
+        self._sequence = sequence + 2
+        # visible after every field only under x86 store ordering, see the class docstring.
+        ints[SLOT_SEQUENCE] = sequence + 2
+
+    def close(self, unlink=True):
+        """
+        Unmaps the struct and by default removes its file. Readers that already mapped it keep
+        the last published state.
+        """
+        super(SharedStatePublisher, self).close()
+        if unlink:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class SharedStateReader(_SharedStateMap):
+    """
+    Reads the state published by a SharedStatePublisher.
+
+    Reads go straight to the shared map without syscalls and are retried while the publisher is
+    writing, so a read never returns fields from two different cycles. A reader that finds a
+    write in progress yields to the publisher before retrying, and gives up after timeout seconds,
+    e.g. if the publisher died in the middle of a write. Does not depend on JACK.
+
+    The sequence lock is read without barriers, so like the publisher it relies on x86 (TSO),
+    where loads are not reordered with other loads and the publisher's stores arrive in order.
+    """
+    def __init__(self, path=DEFAULT_PATH, timeout=READ_TIMEOUT):
+        """
+        :param path: file mapped by the publisher
+        :param timeout: seconds to retry a read while the publisher is writing
+        :raises SharedStateError: if the file is not a jacktime shared state
+        """
+        self.path = path
+        self.timeout = timeout
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if size < SLOT_PREDICTIONS * 8:
+                raise SharedStateError('{0} is not a jacktime shared state'.format(path))
+            super(SharedStateReader, self).__init__(fd, size, mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        ints = self._ints
+        deadline = None
+        while ints[SLOT_SEQUENCE] & 1:
+            try:
+                deadline = self._retry(deadline)
+            except SharedStateError:
+                self.close()
+                raise
+        if ints[SLOT_MAGIC] != MAGIC or ints[SLOT_VERSION] != VERSION:
+            self.close()
+            raise SharedStateError('{0} is not a jacktime shared state version {1}'
+                                   .format(path, VERSION))
+        self.beats = ints[SLOT_BEATS]
+
+    @property
+    def sequence(self):
+        """
+        Changes every time the publisher writes a new state, for polling.
+        """
+        return self._ints[SLOT_SEQUENCE]
+
+    def _retry(self, deadline):
+        """
+        Yields to the publisher before a read is retried.
+        :param deadline: monotonic time to give up at, None on the first retry
+        :return: the deadline of the following retries
+        :raises SharedStateError: once the deadline has passed
+        """
+        now = time.monotonic()
+        if deadline is None:
+            deadline = now + self.timeout
+        elif now > deadline:
+            raise SharedStateError('{0} is still being written after {1} seconds'
+                                   .format(self.path, self.timeout))
+        time.sleep(0)
+        return deadline
+
+    def read_into(self, predictions):
+        """
+        Reads the current state, writing the predicted beat frames into predictions.
+        :param predictions: writable sequence of at least `beats` floats, e.g. array('d')
+        :return: tuple (sequence, frame, rolling, beat, segment, fpb_low, fpb_high)
+        :raises SharedStateError: if the publisher is still writing after timeout seconds
+        """
+        ints = self._ints
+        floats = self._floats
+        beats = self.beats
+        deadline = None
+        while True:
+            sequence = ints[SLOT_SEQUENCE]
+            if sequence & 1:
+                deadline = self._retry(deadline)
+                continue
+            frame = ints[SLOT_FRAME]
+            rolling = ints[SLOT_ROLLING] != 0
+            beat = ints[SLOT_BEAT]
+            segment = ints[SLOT_SEGMENT]
+            fpb_low = floats[SLOT_FPB_LOW]
+            fpb_high = floats[SLOT_FPB_HIGH]
+            for i in range(beats):
+                predictions[i] = floats[SLOT_PREDICTIONS + i]
+            # with no fence, this load follows the field loads only under x86 load ordering.
+            if ints[SLOT_SEQUENCE] == sequence:
+                return sequence, frame, rolling, beat, segment, fpb_low, fpb_high
+            deadline = self._retry(deadline)
+
+    def read(self):
+        """
+        Reads the current state. Beats that could not be predicted are NaN.
+        :return: SharedState
+        :raises SharedStateError: if the publisher is still writing after timeout seconds
+        """
+        predictions = [0.0] * self.beats
+        return SharedState(*self.read_into(predictions), predictions=tuple(predictions))
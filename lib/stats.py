@@ -0,0 +1,289 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from array import array
+
+# counters of CallbackStats.
+REPOSITIONS = 0
+SEGMENT_CHANGES = 1
+XRUNS = 2
+RECONNECTS = 3
+COUNTER_NAMES = ('repositions', 'segment_changes', 'xruns', 'reconnects')
+
+# histograms of CallbackStats that are not callback durations.
+XRUN_DELAY = 'xrun_delay'
+DSP_LOAD = 'dsp_load'
+DOWNTIME = 'downtime'
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class Histogram(object):
+    """
+    Fixed-bucket histogram of non-negative integers with bounded relative error, in the manner
+    of HdrHistogram.
+
+    Values below 2 ** sub_bucket_bits are counted exactly. Above, each power of two is split into
+    2 ** (sub_bucket_bits - 1) buckets, so a value is known to within 2 ** (1 - sub_bucket_bits)
+    of itself (about 3% with the default 6 bits). Values above max_value are counted in the last
+    bucket. The buckets are preallocated, so record does not allocate.
+
+    record is meant for a single writer thread. Readers on other threads may see a recording in
+    progress, which is good enough for monitoring.
+    """
+    def __init__(self, max_value=2 ** 34, sub_bucket_bits=6):
+        """
+        :param max_value: largest value recorded exactly to the histogram's precision
+        :param sub_bucket_bits: number of significant bits kept of each value
+        """
+        self._bits = sub_bucket_bits
+        self._exact = 1 << sub_bucket_bits
+        self._half = 1 << (sub_bucket_bits - 1)
+        self._max_index = self._index(max_value)
+        self._counts = array('q', [0]) * (self._max_index + 1)
+        # total count and largest value, in one array so that record does not rebind attributes.
+        self._summary = array('q', [0, 0])
+
+    def _index(self, value):
+        if value < self._exact:
+            return value
+        shift = value.bit_length() - self._bits
+        return self._exact + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _bucket_bounds(self, index):
+        """
+        Returns the smallest and largest value counted in the bucket.
+        """
+        if index < self._exact:
+            return index, index
+        shift, top = divmod(index - self._exact, self._half)
+        shift += 1
+        top += self._half
+        return top << shift, ((top + 1) << shift) - 1
+
+    def record(self, value):
+        """
+        Counts a value. Negative values are counted as 0. Does not allocate.
+        """
+        if value < 0:
+            value = 0
+        index = self._index(value)
+        if index > self._max_index:
+            index = self._max_index
+        self._counts[index] += 1
+        summary = self._summary
+        summary[0] += 1
+        if value > summary[1]:
+            summary[1] = value
+
+    @property
+    def count(self):
+        return self._summary[0]
+
+    @property
+    def max(self):
+        return self._summary[1]
+
+    def percentile(self, p):
+        """
+        Returns the largest value of the bucket holding the p-th percentile, capped at max.
+        """
+        count = self._summary[0]
+        if not count:
+            return 0
+        rank = max(int(p / 100.0 * count + 0.5), 1)
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self._bucket_bounds(index)[1], self._summary[1])
+        return self._summary[1]
+
+    def mean(self):
+        count = self._summary[0]
+        if not count:
+            return 0.0
+        total = 0
+        for index, bucket_count in enumerate(self._counts):
+            if bucket_count:
+                low, high = self._bucket_bounds(index)
+                total += bucket_count * (low + high) / 2
+        return total / count
+
+    def summary(self, scale=1.0):
+        """
+        Returns the count, mean, percentiles and max, with values divided by scale.
+        :return: dict
+        """
+        result = {'count': self.count, 'mean': self.mean() / scale}
+        for p in PERCENTILES:
+            result['p{0}'.format(p)] = self.percentile(p) / scale
+        result['max'] = self.max / scale
+        return result
+
+    def reset(self):
+        for index in range(len(self._counts)):
+            self._counts[index] = 0
+        self._summary[0] = self._summary[1] = 0
+
+
+class CallbackStats(object):
+    """
+    Durations of the JACK callbacks, xruns, DSP load, transport event counters and, in daemon
+    mode, the downtime of each reconnect.
+
+    Callbacks are timed by registering the wrapper returned by timed in their place. Recording
+    only updates preallocated histograms and counters, so it is safe on the JACK threads.
+    """
+    def __init__(self):
+        # callback durations in nanoseconds, by callback name.
+        self.durations = {}
+        # delay reported with each xrun, in microseconds.
+        self.xrun_delay = Histogram()
+        # DSP load sampled by the StatsServer, in hundredths of a percent.
+        self.dsp_load = Histogram(max_value=10000)
+        # milliseconds from losing the JACK server to being ready again, see lib.supervisor.
+        self.downtime = Histogram()
+        self.counters = array('q', [0]) * len(COUNTER_NAMES)
+        self.started = time.time()
+
+    def timed(self, name, callback):
+        """
+        Returns callback wrapped to record the duration of each call under name.
+        """
+        histogram = self.durations.setdefault(name, Histogram())
+        record = histogram.record
+        clock = time.perf_counter_ns
+
+        def timed_callback(*args):
+            start = clock()
+            try:
+                return callback(*args)
+            finally:
+                record(clock() - start)
+        return timed_callback
+
+    def count(self, counter):
+        """
+        Increments a counter, one of REPOSITIONS, SEGMENT_CHANGES, XRUNS or RECONNECTS.
+        """
+        self.counters[counter] += 1
+
+    def xrun(self, delayed_usecs=0.0):
+        """
+        xrun callback for the JACK client.
+        :param delayed_usecs: delay reported by JACK, in microseconds
+        """
+        self.counters[XRUNS] += 1
+        self.xrun_delay.record(int(delayed_usecs))
+
+    def attach(self, client):
+        """
+        Registers the xrun callback with a python-jack Client.
+        """
+        client.set_xrun_callback(self.xrun)
+
+    def sample_load(self, client):
+        """
+        Records the DSP load currently reported by the client.
+        """
+        self.dsp_load.record(int(client.cpu_load() * 100))
+
+    def dump(self):
+        """
+        Returns every histogram summary and counter as a dict, durations in microseconds.
+        """
+        return {
+            'uptime': time.time() - self.started,
+            'callbacks': {name: histogram.summary(1000.0)
+                          for name, histogram in sorted(self.durations.items())},
+            XRUN_DELAY: self.xrun_delay.summary(),
+            DSP_LOAD: self.dsp_load.summary(100.0),
+            DOWNTIME: self.downtime.summary(),
+            'counters': dict(zip(COUNTER_NAMES, self.counters)),
+        }
+
+
+class StatsServer(threading.Thread):
+    """
+    Normal-priority thread that samples the DSP load and serves stats dumps.
+
+    A dump is written as one line of JSON to the output when request_dump is called, e.g. from a
+    signal handler, and to every connection made to the Unix socket at socket_path.
+    """
+    def __init__(self, stats, client, output=sys.stderr, socket_path=None, rate=10.0):
+        """
+        :param stats: CallbackStats to report
+        :param client: python-jack Client whose DSP load is sampled, or None while there is no
+        connection to the JACK server
+        :param output: writable text file dumps are written to on request, or None
+        :param socket_path: path of a Unix socket to serve dumps on, or None
+        :param rate: number of times per second the DSP load is sampled
+        """
+        super(StatsServer, self).__init__(name='jacktime-stats', daemon=True)
+        self.stats = stats
+        self.client = client
+        self.output = output
+        self.socket_path = socket_path
+        self.interval = 1.0 / rate
+        self._dump_requested = threading.Event()
+        self._stopevent = threading.Event()
+        self._socket = None
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.bind(socket_path)
+            self._socket.listen(4)
+            self._socket.setblocking(False)
+
+    def request_dump(self, *args):
+        """
+        Asks for a dump to the output. Safe to call from a signal handler.
+        """
+        self._dump_requested.set()
+
+    def dumps(self):
+        return json.dumps(self.stats.dump(), sort_keys=True) + '\n'
+
+    def run(self):
+        while not self._stopevent.wait(self.interval):
+            client = self.client
+            if client is not None:
+                self.stats.sample_load(client)
+            if self._dump_requested.is_set():
+                self._dump_requested.clear()
+                if self.output is not None:
+                    self.output.write(self.dumps())
+                    self.output.flush()
+            self._serve()
+
+    def _serve(self):
+        if self._socket is None:
+            return
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            with connection:
+                connection.setblocking(True)
+                connection.settimeout(1.0)
+                try:
+                    connection.sendall(self.dumps().encode())
+                except OSError:
+                    pass
+
+    def stop(self):
+        self._stopevent.set()
+        if self.is_alive():
+            self.join()
+        if self._socket is not None:
+            self._socket.close()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,208 @@
+import sys
+import threading
+import time
+import jack
+from lib.jack.checkpoint import CheckpointWriter
+from lib.stats import RECONNECTS
+
+
+class Supervisor(object):
+    """
+    Keeps a timebase mode connected to the JACK server.
+
+    Without daemon mode the mode runs on one connection, opened the way jack.Client opens it, and
+    run returns when the server shuts the client down. In daemon mode the JACK server is never
+    started by jacktime: a failed connection, or a mode that raised while being created or
+    activated, is retried after backoff seconds, doubled after each failure up to max_backoff, and
+    when the server goes away the mode's state is kept in memory and handed to the mode created on
+    the next connection, see saved_state of PyJackTimebaseMaster and PyJackTimebaseClient. A
+    client mode is only created once a timebase master provides the transport's tempo.
+
+    The downtime of each reconnect is measured from the shutdown callback to the ready_at time of
+    the new mode, i.e. its first correct beat, reported to log and recorded in the downtime
+    histogram of the stats.
+
+    The telemetry, stats, control and display services are created once by the caller and passed
+    in options, so they keep running while there is no connection.
+    """
+    def __init__(self, name, mode, options, stats, stopevent, daemon=False, backoff=0.5,
+                 max_backoff=30.0, stats_server=None, checkpoint_interval=5.0, log=sys.stderr,
+                 poll_interval=0.1):
+        """
+        :param name: JACK client name
+        :param mode: timebase class, called with the client, a shutdown event and options
+        :param options: dict of keyword arguments of mode
+        :param stats: CallbackStats the callbacks are timed and reconnects recorded in
+        :param stopevent: threading event which ends run when set
+        :param daemon: reconnect when the JACK server goes away
+        :param backoff: seconds before the first reconnect attempt
+        :param max_backoff: longest wait between reconnect attempts
+        :param stats_server: StatsServer whose client is replaced on each connection, or None
+        :param checkpoint_interval: seconds between beat model checkpoints, if options has a
+        checkpoint path
+        :param log: writable text file connection events are reported to
+        :param poll_interval: seconds between checks of the stop event and of the mode's
+        readiness
+        """
+        self.name = name
+        self.mode = mode
+        self.options = options
+        self.stats = stats
+        self.stopevent = stopevent
+        self.daemon = daemon
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats_server = stats_server
+        self.checkpoint_interval = checkpoint_interval
+        self.log = log
+        self.poll_interval = poll_interval
+        # shutdown event of the current connection.
+        self._shutdownevent = None
+
+    def connect(self):
+        """
+        Opens a client, without starting a JACK server in daemon mode.
+        :return: python-jack Client
+        :raises jack.JackOpenError: if the JACK server is not running
+        """
+        return jack.Client(self.name, no_start_server=self.daemon)
+
+    def run(self):
+        """
+        Runs the mode until the stop event is set or, without daemon mode, the JACK server shuts
+        the client down. Sets the stop event on return.
+        :return: None
+        """
+        saved_state = None
+        lost_at = None
+        delay = self.backoff
+        try:
+            while not self.stopevent.is_set():
+                try:
+                    client = self.connect()
+                except jack.JackOpenError as e:
+                    if not self.daemon:
+                        raise
+                    self._report('cannot connect to the JACK server ({0}), retrying in {1:g} s'
+                                 .format(e, delay))
+                    if self.stopevent.wait(delay):
+                        break
+                    delay = min(delay * 2, self.max_backoff)
+                    continue
+                try:
+                    timebase = self._run_connection(client, saved_state, lost_at)
+                except Exception as e:
+                    if not self.daemon:
+                        raise
+                    self._report('cannot start {0} ({1!r}), retrying in {2:g} s'
+                                 .format(self.mode.__name__, e, delay))
+                    if self.stopevent.wait(delay):
+                        break
+                    delay = min(delay * 2, self.max_backoff)
+                    continue
+                delay = self.backoff
+                if not self.daemon or self.stopevent.is_set():
+                    break
+                # without a mode, i.e. the server went away before a timebase master provided
+                # a position, the state and loss time of the previous connection are kept.
+                if timebase is not None:
+                    lost_at = time.monotonic()
+                    saved_state = timebase.saved_state()
+                self._report('lost the JACK server, reconnecting')
+        finally:
+            self.stopevent.set()
+
+    def _run_connection(self, client, saved_state, lost_at):
+        """
+        Runs a new instance of the mode on client until the client is shut down or the stop
+        event is set, then closes the client. A mode with needs_position set is created once the
+        transport has a BBT position with a tempo.
+        :return: the mode instance, or None if the client was shut down before it was created
+        :raises Exception: anything raised creating or activating the mode
+        """
+        shutdownevent = threading.Event()
+        self._shutdownevent = shutdownevent
+        connected_at = time.monotonic()
+        checkpoint_writer = None
+        timebase = None
+        try:
+            self.stats.attach(client)
+            if getattr(self.mode, 'needs_position', False) \
+                    and not self._await_position(client, shutdownevent):
+                return None
+            options = dict(self.options)
+            if saved_state is not None:
+                options['saved_state'] = saved_state
+            timebase = self.mode(client, shutdownevent, stats=self.stats, **options)
+            if options.get('checkpoint'):
+                checkpoint_writer = CheckpointWriter(timebase.beat_state, options['checkpoint'],
+                                                     self.checkpoint_interval)
+                checkpoint_writer.start()
+            client.activate()
+            if hasattr(timebase, 'set_timebase_callback'):
+                timebase.set_timebase_callback()
+            if self.stats_server is not None:
+                self.stats_server.client = client
+            if lost_at is not None:
+                self.stats.count(RECONNECTS)
+                self._await_ready(timebase, shutdownevent, lost_at, connected_at)
+            while not shutdownevent.wait(self.poll_interval):
+                if self.stopevent.is_set():
+                    break
+        finally:
+            if self.stats_server is not None:
+                self.stats_server.client = None
+            if checkpoint_writer is not None:
+                checkpoint_writer.stop()
+            client.deactivate(ignore_errors=True)
+            client.close(ignore_errors=True)
+            # the recorder flushes its trace on close.
+            if hasattr(timebase, 'close'):
+                timebase.close()
+        return timebase
+
+    def _await_position(self, client, shutdownevent):
+        """
+        Waits for a timebase master to provide the bar, beat and tempo of the transport, e.g.
+        after the JACK server restarted.
+        :return: True once the position has a tempo, False if the client was shut down or the
+        stop event set first
+        """
+        # replaced by the mode's shutdown callback once it is created.
+        client.set_shutdown_callback(lambda status, reason: shutdownevent.set())
+        reported = False
+        while True:
+            state, pos = client.transport_query_struct()
+            if pos.valid & jack._lib.JackPositionBBT and pos.beats_per_minute > 0:
+                return True
+            if not reported:
+                self._report('waiting for a timebase master')
+                reported = True
+            if shutdownevent.wait(self.poll_interval) or self.stopevent.is_set():
+                return False
+
+    def _await_ready(self, timebase, shutdownevent, lost_at, connected_at):
+        """
+        Waits for the first correct beat of a reconnected mode and records the downtime.
+        """
+        while timebase.ready_at is None:
+            if shutdownevent.wait(self.poll_interval) or self.stopevent.is_set():
+                return
+        downtime = timebase.ready_at - lost_at
+        self.stats.downtime.record(int(downtime * 1000))
+        self._report('reconnected to the JACK server after {0:.3f} s, first correct beat after '
+                     '{1:.3f} s'.format(connected_at - lost_at, downtime))
+
+    def _report(self, message):
+        if self.log is not None:
+            print('{0}: {1}'.format(self.name, message), file=self.log)
+            self.log.flush()
+
+    def stop(self, *args):
+        """
+        Ends run. Safe to call from a signal handler or another thread.
+        """
+        self.stopevent.set()
+        shutdownevent = self._shutdownevent
+        if shutdownevent is not None:
+            shutdownevent.set()
@@ -0,0 +1,248 @@
+import sys
+import threading
+import time
+from array import array
+from math import nan
+
+# record kinds written by the process callbacks.
+CLIENT_PREDICTION = 1
+MASTER_POSITION = 2
+
+# formats for each record kind, applied by the reporter thread to the record's fields.
+RECORD_FORMATS = {
+    CLIENT_PREDICTION: 'frame {0:.0f}: beat {1:.0f} predicted at frame {2:.1f}, '
+                       'tempo segment {3:.0f} fpb range ({4:.0f}, {5:.0f})',
+    MASTER_POSITION: 'frame {0:.0f}: state {1:.0f} bar {2:.0f} beat {3:.0f} tick {4:.0f} '
+                     'bpm {5:.2f}',
+}
+
+# number of numeric fields in a record.
+RECORD_FIELDS = 6
+
+# fields of a PositionSnapshot. The prediction fields are nan in modes that do not predict.
+SNAPSHOT_FRAME = 0
+SNAPSHOT_STATE = 1
+SNAPSHOT_FRAME_RATE = 2
+SNAPSHOT_BBT = 3
+SNAPSHOT_BAR = 4
+SNAPSHOT_BEAT = 5
+SNAPSHOT_TICK = 6
+SNAPSHOT_BEATS_PER_MINUTE = 7
+SNAPSHOT_BEATS_PER_BAR = 8
+SNAPSHOT_BEAT_TYPE = 9
+SNAPSHOT_NEXT_BEAT = 10
+SNAPSHOT_NEXT_BEAT_FRAME = 11
+SNAPSHOT_BEAT_WIDTH = 12
+SNAPSHOT_SEGMENT = 13
+SNAPSHOT_FPB_LOW = 14
+SNAPSHOT_FPB_HIGH = 15
+SNAPSHOT_FIELDS = 16
+
+# jack_position_bits_t JackPositionBBT, so telemetry does not need JACK.
+POSITION_BBT = 0x10
+
+
+class TelemetryQueue(object):
+    """
+    Single-producer/single-consumer ring buffer of fixed-size telemetry records.
+
+    The process callback is the only producer and the reporter thread the only consumer. Record
+    storage is preallocated, so push never allocates, takes a lock or blocks: when the ring is full
+    the record is dropped and counted instead.
+    Each index is only written by one side, and the producer publishes a record by advancing the
+    head after the record's fields are written.
+    """
+    def __init__(self, capacity=1024):
+        """
+        :param capacity: number of records the ring holds, rounded up to a power of two.
+        """
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.capacity = size
+        self._mask = size - 1
+        self._kinds = array('b', [0]) * size
+        self._fields = array('d', [0.0]) * (size * RECORD_FIELDS)
+        # next record to write, only advanced by the producer.
+        self._head = 0
+        # next record to read, only advanced by the consumer.
+        self._tail = 0
+        # records dropped because the ring was full, only written by the producer.
+        self.dropped = 0
+
+    def push(self, kind, f0=0.0, f1=0.0, f2=0.0, f3=0.0, f4=0.0, f5=0.0):
+        """
+        Writes a record. Safe to call from the JACK process thread.
+        :param kind: record kind, a key of RECORD_FORMATS
+        :return: False if the record was dropped because the ring is full.
+        """
+        head = self._head
+        if head - self._tail >= self.capacity:
+            self.dropped += 1
+            return False
+        slot = head & self._mask
+        self._kinds[slot] = kind
+        offset = slot * RECORD_FIELDS
+        fields = self._fields
+        fields[offset] = f0
+        fields[offset + 1] = f1
+        fields[offset + 2] = f2
+        fields[offset + 3] = f3
+        fields[offset + 4] = f4
+        fields[offset + 5] = f5
+        self._head = head + 1
+        return True
+
+    def drain(self):
+        """
+        Yields (kind, fields) for each record written since the last drain.
+        Only to be called from the consumer thread.
+        """
+        head = self._head
+        tail = self._tail
+        while tail < head:
+            slot = tail & self._mask
+            offset = slot * RECORD_FIELDS
+            yield self._kinds[slot], self._fields[offset:offset + RECORD_FIELDS]
+            tail += 1
+            self._tail = tail
+
+    def __len__(self):
+        return self._head - self._tail
+
+
+class TelemetryReporter(threading.Thread):
+    """
+    Normal-priority thread that drains a TelemetryQueue and formats its records.
+    """
+    def __init__(self, queue, output=sys.stdout, rate=10.0):
+        """
+        :param queue: TelemetryQueue to drain
+        :param output: writable text file, or None to discard records
+        :param rate: number of times per second the queue is drained
+        """
+        super(TelemetryReporter, self).__init__(name='jacktime-telemetry', daemon=True)
+        self.queue = queue
+        self.output = output
+        self.interval = 1.0 / rate
+        self._reported_dropped = 0
+        self._stopevent = threading.Event()
+
+    def run(self):
+        while not self._stopevent.wait(self.interval):
+            self.report()
+        self.report()
+
+    def report(self):
+        """
+        Formats every queued record and any newly dropped records to the output.
+        :return: None
+        """
+        lines = []
+        for kind, fields in self.queue.drain():
+            if self.output is not None:
+                lines.append(RECORD_FORMATS[kind].format(*fields))
+        dropped = self.queue.dropped
+        if dropped != self._reported_dropped:
+            lines.append('telemetry: {0} records dropped'.format(dropped - self._reported_dropped))
+            self._reported_dropped = dropped
+        if lines and self.output is not None:
+            self.output.write('\n'.join(lines) + '\n')
+            self.output.flush()
+
+    def stop(self):
+        self._stopevent.set()
+        if self.is_alive():
+            self.join()
+
+
+class PositionSnapshot(object):
+    """
+    Latest position and beat predictions of the process callback, for displays that sample it at
+    their own rate.
+
+    Unlike a TelemetryQueue, which keeps every record, a snapshot only holds the last cycle. It is
+    protected by a sequence lock like lib.shared_state, within the process: the sequence is odd
+    while the process callback writes. Writing stores numbers into preallocated arrays, without
+    formatting, locking or allocating. A reader that finds a write in progress yields the GIL to
+    the writer and retries, so it never holds up the process callback.
+    """
+    def __init__(self):
+        self._values = array('d', [nan]) * SNAPSHOT_FIELDS
+        self._sequence = array('q', [0])
+
+    def publish(self, state, pos, next_beat=nan, next_beat_frame=nan, beat_width=nan,
+                segment=nan, fpb_low=nan, fpb_high=nan):
+        """
+        Writes the state of the current cycle. Safe to call from the JACK process thread.
+        Readers extrapolate later beats from the next beat's frame and the beat width, so the
+        process callback only predicts one.
+        :param state: transport state
+        :param pos: cdata object, jack_position_t C struct, via jack-python
+        :param next_beat: absolute number of the next beat
+        :param next_beat_frame: predicted frame of the next beat
+        :param beat_width: frames per beat predictions are made with
+        :param segment: number of the current tempo segment
+        :param fpb_low: low end of the segment's fpb range
+        :param fpb_high: high end of the segment's fpb range
+        :return: None
+        """
+        values = self._values
+        sequence = self._sequence
+        sequence[0] += 1
+        values[SNAPSHOT_FRAME] = pos.frame
+        values[SNAPSHOT_STATE] = state
+        values[SNAPSHOT_FRAME_RATE] = pos.frame_rate
+        values[SNAPSHOT_BBT] = pos.valid & POSITION_BBT
+        values[SNAPSHOT_BAR] = pos.bar
+        values[SNAPSHOT_BEAT] = pos.beat
+        values[SNAPSHOT_TICK] = pos.tick
+        values[SNAPSHOT_BEATS_PER_MINUTE] = pos.beats_per_minute
+        values[SNAPSHOT_BEATS_PER_BAR] = pos.beats_per_bar
+        values[SNAPSHOT_BEAT_TYPE] = pos.beat_type
+        values[SNAPSHOT_NEXT_BEAT] = next_beat
+        values[SNAPSHOT_NEXT_BEAT_FRAME] = next_beat_frame
+        values[SNAPSHOT_BEAT_WIDTH] = beat_width
+        values[SNAPSHOT_SEGMENT] = segment
+        values[SNAPSHOT_FPB_LOW] = fpb_low
+        values[SNAPSHOT_FPB_HIGH] = fpb_high
+        sequence[0] += 1
+
+    @property
+    def sequence(self):
+        """
+        Changes every time a new cycle is published, for polling.
+        """
+        return self._sequence[0]
+
+    def read_into(self, values):
+        """
+        Copies the last published cycle into values.
+        :param values: writable sequence of at least SNAPSHOT_FIELDS floats
+        :return: the sequence of the copied cycle, or None if nothing was published yet.
+        """
+        source = self._values
+        sequence = self._sequence
+        while True:
+            start = sequence[0]
+            if not start:
+                return None
+            if not start & 1:
+                for i in range(len(source)):
+                    values[i] = source[i]
+                if sequence[0] == start:
+                    return start
+            time.sleep(0)
+
+
+def open_output(name):
+    """
+    Returns the telemetry output named on the command line.
+    :param name: 'stdout', 'none' or the path of a log file to append to.
+    :return: writable text file or None
+    """
+    if name == 'stdout':
+        return sys.stdout
+    if name == 'none':
+        return None
+    return open(name, 'a')
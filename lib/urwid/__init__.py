@@ -1 +0,0 @@
-from lib.jack.timebase_master import
\ No newline at end of file
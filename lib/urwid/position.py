@@ -0,0 +1,196 @@
+import time
+from array import array
+from collections import deque
+from math import isnan, log2, nan
+import urwid
+from lib.stats import COUNTER_NAMES
+from lib.telemetry import (SNAPSHOT_BAR, SNAPSHOT_BBT, SNAPSHOT_BEAT, SNAPSHOT_BEAT_TYPE,
+                           SNAPSHOT_BEAT_WIDTH, SNAPSHOT_BEATS_PER_BAR, SNAPSHOT_BEATS_PER_MINUTE,
+                           SNAPSHOT_FIELDS, SNAPSHOT_FPB_HIGH, SNAPSHOT_FPB_LOW, SNAPSHOT_FRAME,
+                           SNAPSHOT_FRAME_RATE, SNAPSHOT_NEXT_BEAT, SNAPSHOT_NEXT_BEAT_FRAME,
+                           SNAPSHOT_SEGMENT, SNAPSHOT_STATE, SNAPSHOT_TICK)
+
+# jack_transport_state_t names.
+STATE_NAMES = {0: 'stopped', 1: 'rolling', 2: 'looping', 3: 'starting', 4: 'net starting'}
+
+SPARK = ' ▁▂▃▄▅▆▇█'
+
+PALETTE = [
+    ('title', 'white,bold', ''),
+    ('label', 'dark cyan', ''),
+    ('rolling', 'light green,bold', ''),
+    ('stopped', 'yellow,bold', ''),
+]
+
+
+def format_position(values):
+    """
+    Returns the transport state and position lines of a snapshot.
+    """
+    state = int(values[SNAPSHOT_STATE])
+    frame = values[SNAPSHOT_FRAME]
+    frame_rate = values[SNAPSHOT_FRAME_RATE] or nan
+    position = 'frame {0:.0f} ({1:.2f} s)'.format(frame, frame / frame_rate)
+    if values[SNAPSHOT_BBT]:
+        position = 'bar {0:.0f} beat {1:.0f} tick {2:4.0f}   {3}'.format(
+            values[SNAPSHOT_BAR], values[SNAPSHOT_BEAT], values[SNAPSHOT_TICK], position)
+    return STATE_NAMES.get(state, str(state)), position
+
+
+def format_tempo(values):
+    if not values[SNAPSHOT_BBT]:
+        return 'no BBT'
+    bpm = values[SNAPSHOT_BEATS_PER_MINUTE]
+    fpb = values[SNAPSHOT_FRAME_RATE] * 60.0 / bpm if bpm else nan
+    return '{0:.3f} bpm  {1:g}/{2:g}  {3:.2f} frames per beat'.format(
+        bpm, values[SNAPSHOT_BEATS_PER_BAR], values[SNAPSHOT_BEAT_TYPE], fpb)
+
+
+def format_predictions(values, beats):
+    """
+    Returns one line per predicted beat with its frame and the time until it, extrapolating
+    from the next beat.
+    """
+    next_beat = values[SNAPSHOT_NEXT_BEAT]
+    if isnan(next_beat):
+        return ['no predictions in this mode']
+    frame = values[SNAPSHOT_FRAME]
+    frame_rate = values[SNAPSHOT_FRAME_RATE] or nan
+    lines = []
+    for i in range(beats):
+        predicted = values[SNAPSHOT_NEXT_BEAT_FRAME] + i * values[SNAPSHOT_BEAT_WIDTH]
+        lines.append('beat {0:.0f} at frame {1:.1f} ({2:+.1f} ms)'.format(
+            next_beat + i, predicted, (predicted - frame) * 1000.0 / frame_rate))
+    return lines
+
+
+def sparkline(widths):
+    """
+    Draws fpb range widths on a log scale, so the narrowing of the range stays visible.
+    """
+    if not widths:
+        return ''
+    scaled = [log2(width + 1) if width >= 0 else 0.0 for width in widths]
+    top = max(scaled) or 1.0
+    return ''.join(SPARK[int(round(value / top * (len(SPARK) - 1)))] for value in scaled)
+
+
+def format_stats(stats):
+    """
+    Returns the callback duration percentiles, DSP load and counters of a CallbackStats.
+    """
+    lines = []
+    for name, histogram in sorted(stats.durations.items()):
+        lines.append('{0:>9}: p50 {1:7.1f} us  p99 {2:7.1f} us  max {3:7.1f} us'.format(
+            name, histogram.percentile(50) / 1000.0, histogram.percentile(99) / 1000.0,
+            histogram.max / 1000.0))
+    lines.append('DSP load: p50 {0:.1f}%  max {1:.1f}%'.format(
+        stats.dsp_load.percentile(50) / 100.0, stats.dsp_load.max / 100.0))
+    lines.append('  '.join('{0} {1}'.format(name.replace('_', ' '), count)
+                           for name, count in zip(COUNTER_NAMES, stats.counters)))
+    return lines
+
+
+class PositionView(object):
+    """
+    Terminal display of the transport position, tempo, beat predictions, fpb range convergence
+    and callback load.
+
+    The display runs on the main thread and samples the PositionSnapshot published by the process
+    callback at a fixed rate, and the CallbackStats once a second, so the JACK threads never
+    format text or wait for it, however busy the terminal is.
+    """
+    def __init__(self, snapshot, stats, shutdownevent, rate=10.0, title='jacktime', history=120,
+                 beats=4):
+        """
+        :param snapshot: PositionSnapshot published by the process callback
+        :param stats: CallbackStats of the callbacks
+        :param shutdownevent: threading event set on quit, and which ends the display when set
+        :param rate: frames drawn per second
+        :param title: title line
+        :param history: number of frames of fpb range widths drawn
+        :param beats: number of predicted beats shown
+        """
+        self.snapshot = snapshot
+        self.stats = stats
+        self.shutdownevent = shutdownevent
+        self.interval = 1.0 / rate
+        self.beats = beats
+        self.widths = deque(maxlen=history)
+        self._values = array('d', [nan]) * SNAPSHOT_FIELDS
+        self._sequence = None
+        self._stats_updated = 0.0
+
+        self.state = urwid.Text('')
+        self.position = urwid.Text('')
+        self.tempo = urwid.Text('')
+        self.predictions = urwid.Text('')
+        self.model = urwid.Text('')
+        self.load = urwid.Text('')
+        pile = urwid.Pile([
+            urwid.Columns([('pack', urwid.Text(('title', title))), self.state], dividechars=2),
+            self.position,
+            self.tempo,
+            urwid.Divider(),
+            urwid.Text(('label', 'predicted beats')),
+            self.predictions,
+            urwid.Divider(),
+            urwid.Text(('label', 'beat model')),
+            self.model,
+            urwid.Divider(),
+            urwid.Text(('label', 'callbacks')),
+            self.load,
+            urwid.Divider(),
+            urwid.Text(('label', 'q to quit')),
+        ])
+        self.widget = urwid.Filler(urwid.LineBox(pile), valign='top')
+
+    def update(self):
+        """
+        Redraws from the latest snapshot, and from the stats once a second.
+        """
+        now = time.monotonic()
+        if now - self._stats_updated >= 1.0:
+            self._stats_updated = now
+            self.load.set_text('\n'.join(format_stats(self.stats)))
+
+        values = self._values
+        sequence = self.snapshot.read_into(values)
+        if sequence is None or sequence == self._sequence:
+            return
+        self._sequence = sequence
+        state, position = format_position(values)
+        self.state.set_text(('rolling' if state == 'rolling' else 'stopped', state))
+        self.position.set_text(position)
+        self.tempo.set_text(format_tempo(values))
+        self.predictions.set_text('\n'.join(format_predictions(values, self.beats)))
+        low, high = values[SNAPSHOT_FPB_LOW], values[SNAPSHOT_FPB_HIGH]
+        if isnan(low):
+            self.model.set_text('no beat model in this mode')
+            return
+        self.widths.append(high - low)
+        self.model.set_text('segment {0:.0f}  fpb range {1:.0f}..{2:.0f} (width {3:.0f})\n{4}'
+                            .format(values[SNAPSHOT_SEGMENT], low, high, high - low,
+                                    sparkline(self.widths)))
+
+    def _tick(self, loop, user_data=None):
+        if self.shutdownevent.is_set():
+            raise urwid.ExitMainLoop()
+        self.update()
+        loop.set_alarm_in(self.interval, self._tick)
+
+    def _input(self, key):
+        if key in ('q', 'Q', 'esc'):
+            self.shutdownevent.set()
+            raise urwid.ExitMainLoop()
+
+    def run(self):
+        """
+        Draws until q is pressed or the shutdown event is set. Sets the shutdown event on exit.
+        """
+        loop = urwid.MainLoop(self.widget, PALETTE, unhandled_input=self._input)
+        loop.set_alarm_in(0, self._tick)
+        try:
+            loop.run()
+        finally:
+            self.shutdownevent.set()
@@ -0,0 +1,22 @@
+"""
+Guards the JACK-Client import once for the whole suite.
+
+Without libjack, importing jack raises OSError rather than ImportError, which
+pytest.importorskip does not catch, so collection would fail. The failed import is recorded as
+None in sys.modules instead: importing jack then raises ModuleNotFoundError, and the tests that
+need JACK skip while the rest of the suite runs.
+"""
+import sys
+
+try:
+    import jack
+except (ImportError, OSError) as error:
+    JACK_ERROR = '{0}: {1}'.format(type(error).__name__, error)
+    sys.modules['jack'] = None
+else:
+    JACK_ERROR = None
+
+
+def pytest_report_header(config):
+    if JACK_ERROR is not None:
+        return 'jack: not available, tests that need JACK are skipped ({0})'.format(JACK_ERROR)
@@ -0,0 +1,76 @@
+"""
+Beat frames predicted in bulk by BeatModelSnapshot against BeatStateMachine.predict_beat_frame,
+their bounds from the start window and fpb range of each segment, and windows of frames that
+cross a tempo change.
+"""
+import threading
+import numpy as np
+import pytest
+
+pytest.importorskip('jack')
+from lib.jack.batch import BeatModelSnapshot
+from lib.jack.simulator import FakeClient, SimulatedTransport
+from lib.jack.timebase_client import PyJackTimebaseClient
+
+# the master changes from 120 to 93.7 bpm at beat 41.
+CHANGE = 48000 * 20
+# relative difference allowed between frames computed in float64 along different paths, a few
+# units in the last place.
+PRECISION = 2 ** -48
+
+
+@pytest.fixture(scope='module')
+def beat_state():
+    transport = SimulatedTransport(tempo_changes=[(CHANGE, 93.7)])
+    client = FakeClient(transport=transport, blocksize=256)
+    tclient = PyJackTimebaseClient(client, threading.Event())
+    client.run(48000 * 40 // 256)
+    assert len(tclient.beat_state.fpb_segments) == 2
+    return tclient.beat_state
+
+
+def test_frames_match_predict_beat_frame(beat_state):
+    snapshot = BeatModelSnapshot(beat_state)
+    beats = np.array([-3, 0, 1, 2, 40, 41, 42, 100, 10 ** 6, 10 ** 8])
+    frames, low, high = snapshot.predict_beats(beats)
+    for beat, frame in zip(beats[beats < 1], frames[beats < 1]):
+        assert np.isnan(frame) and beat_state.predict_beat_frame(int(beat)) is None
+    for beat, frame in zip(beats[beats >= 1], frames[beats >= 1]):
+        expected = beat_state.predict_beat_frame(int(beat))
+        assert abs(frame - expected) <= PRECISION * max(expected, 1)
+
+
+def test_bounds_are_the_fpb_range_from_the_start_window(beat_state):
+    snapshot = BeatModelSnapshot(beat_state)
+    beats, frames, low, high = snapshot.predict_beat_range(1, 80)
+    for beat, lower, upper in zip(beats, low, high):
+        segment = beat_state.segment_at_beat(int(beat))
+        window_start, window_end = segment.start_window
+        count = int(beat) - segment.start_beat
+        assert lower == window_start + segment.fpb[0] * count
+        assert upper == window_end + segment.fpb[1] * count
+    # every beat recorded lies within its bounds.
+    for beat in beat_state.beat_map:
+        window_start, window_end = beat_state.beat_map.window(beat)
+        _, lower, upper = snapshot.predict_beats([beat])
+        assert lower[0] <= window_end and window_start <= upper[0]
+
+
+def test_window_across_a_tempo_change(beat_state):
+    snapshot = BeatModelSnapshot(beat_state)
+    start_frame, end_frame = CHANGE - 100000, CHANGE + 100000
+    beats, frames, low, high = snapshot.predict_window(start_frame, end_frame)
+    start_beat = beat_state.segment_at_frame(CHANGE).start_beat
+    assert beats[0] < start_beat <= beats[-1]
+    assert list(beats) == list(range(beats[0], beats[-1] + 1))
+    assert np.all((start_frame <= frames) & (frames < end_frame))
+    # the beats either side of the window fall outside it.
+    assert beat_state.predict_beat_frame(int(beats[0]) - 1) < start_frame
+    assert beat_state.predict_beat_frame(int(beats[-1]) + 1) >= end_frame
+    expected = [beat_state.predict_beat_frame(int(beat)) for beat in beats]
+    assert np.allclose(frames, expected, rtol=PRECISION, atol=0)
+
+
+def test_window_before_beat_1_is_empty(beat_state):
+    beats, frames, low, high = BeatModelSnapshot(beat_state).predict_window(-48000, 0)
+    assert len(beats) == len(frames) == 0
@@ -0,0 +1,86 @@
+"""
+The BBT the engine advances cycle by cycle against the position computed exactly from each
+segment's start.
+"""
+import random
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('jack')
+from lib.jack.bbt import BBTEngine, TempoMap
+
+
+def random_map(rng, frame_rate):
+    tempo_map = TempoMap(frame_rate, rng.uniform(40.0, 240.0), rng.choice((3, 4, 7)))
+    frame = 0
+    for _ in range(rng.randrange(4)):
+        frame += rng.randrange(1, frame_rate * 20)
+        tempo_map.append(frame, rng.choice((120.0, 93.75, rng.uniform(40.0, 240.0))),
+                         rng.choice((3, 4, 7)), 4, rng.choice((1920.0, 960.0)))
+    return tempo_map
+
+
+def exact_bbt(tempo_map, frame):
+    segment = tempo_map.segments[tempo_map.segment_index(frame)]
+    return segment.bbt(segment.units_at(frame))
+
+
+def test_rolling_matches_exact_position():
+    rng = random.Random(1)
+    for _ in range(50):
+        tempo_map = random_map(rng, rng.choice((44100, 48000, 96000)))
+        engine = BBTEngine(tempo_map)
+        blocksize = rng.choice((16, 256, 1024, 4096))
+        frame = 0
+        for _ in range(2000):
+            engine.seek(frame)
+            pos = SimpleNamespace()
+            engine.write_bbt(pos)
+            assert (pos.bar, pos.beat, pos.tick, pos.bar_start_tick) \
+                == exact_bbt(tempo_map, frame)
+            if rng.random() < 0.01:
+                # a locate, forwards or back.
+                frame = rng.randrange(frame_rate_span(tempo_map))
+            elif rng.random() < 0.05:
+                frame += rng.randrange(1, 2 * blocksize)
+            else:
+                frame += blocksize
+
+
+def frame_rate_span(tempo_map):
+    return tempo_map.start_frames[-1] + tempo_map.frame_rate * 30
+
+
+def test_long_map_keeps_early_positions():
+    rng = random.Random(2)
+    changes = []
+    frame = 0
+    for _ in range(1000):
+        frame += rng.randrange(1, 4800)
+        changes.append((frame, rng.uniform(40.0, 240.0), rng.choice((3, 4)), 4, 1920.0))
+    tempo_map = TempoMap(48000, 120.0)
+    for change in changes:
+        tempo_map.append(*change)
+    assert len(tempo_map.segments) == 1001
+    engine = BBTEngine(tempo_map)
+    for _ in range(200):
+        # the position of an early frame does not depend on the changes after it.
+        count = rng.randrange(len(changes))
+        early = TempoMap(48000, 120.0)
+        for change in changes[:count]:
+            early.append(*change)
+        frame = rng.randrange(early.start_frames[-1], changes[count][0])
+        engine.seek(frame)
+        pos = SimpleNamespace()
+        engine.write_bbt(pos)
+        assert (pos.bar, pos.beat, pos.tick, pos.bar_start_tick) == exact_bbt(early, frame)
+
+
+def test_unreached_change_is_replaced():
+    tempo_map = TempoMap(48000, 120.0)
+    tempo_map.append(1000, 90.0, 4, 4, 1920.0)
+    tempo_map.append(1000, 100.0, 4, 4, 1920.0)
+    assert [segment.beats_per_minute for segment in tempo_map.segments] == [120.0, 100.0]
+    # changed back before it took effect.
+    tempo_map.append(1000, 120.0, 4, 4, 1920.0)
+    assert tempo_map.start_frames == [0]
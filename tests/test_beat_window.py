@@ -0,0 +1,64 @@
+"""
+The window BeatStateMachine.beat_window records a beat in: interpolated from the tick and tempo
+when the master provides BBT, otherwise the cycle the beat was seen in.
+"""
+import random
+from fractions import Fraction
+from math import floor
+from types import SimpleNamespace
+import pytest
+
+jack = pytest.importorskip('jack')
+from lib.jack.frames import frames_per_beat
+from lib.jack.timebase_client import BeatStateMachine
+
+BLOCKSIZE = 256
+
+
+def position(frame, tick, valid=None, beats_per_minute=120.0, ticks_per_beat=1920.0,
+             bbt_offset=0):
+    if valid is None:
+        valid = jack._lib.JackPositionBBT
+    return SimpleNamespace(frame_rate=48000, beats_per_minute=beats_per_minute, beats_per_bar=4,
+                           beat_type=4, ticks_per_beat=ticks_per_beat, bar=1, beat=1,
+                           tick=tick, frame=frame, valid=valid, bbt_offset=bbt_offset)
+
+
+@pytest.fixture
+def beat_state():
+    return BeatStateMachine(position(0, 0), BLOCKSIZE)
+
+
+@pytest.mark.parametrize('beats_per_minute, ticks_per_beat', [(120.0, 1920.0), (93.7, 1920.0),
+                                                              (174.0, 960.0)])
+def test_window_is_interpolated_from_the_tick(beat_state, beats_per_minute, ticks_per_beat):
+    rng = random.Random(1)
+    frames_per_tick = frames_per_beat(48000, beats_per_minute) / Fraction(ticks_per_beat)
+    for _ in range(1000):
+        beat_frame = Fraction(rng.randrange(10 ** 9)) + Fraction(rng.randrange(1000), 1000)
+        # the first cycle after the beat, and the tick the master truncated it to.
+        frame = (floor(beat_frame) // BLOCKSIZE + 1) * BLOCKSIZE
+        tick = floor((frame - beat_frame) / frames_per_tick)
+        window_start, window_end = beat_state.beat_window(
+            position(frame, tick, beats_per_minute=beats_per_minute,
+                     ticks_per_beat=ticks_per_beat), BLOCKSIZE)
+        assert window_start <= beat_frame < window_end
+        assert window_end - window_start <= frames_per_tick + 2
+
+
+def test_window_honours_the_bbt_frame_offset(beat_state):
+    valid = jack._lib.JackPositionBBT | jack._lib.JackBBTFrameOffset
+    # BBT given for 10 frames into the cycle, on the beat.
+    pos = position(48128, 0, valid=valid, bbt_offset=10)
+    window_start, window_end = beat_state.beat_window(pos, BLOCKSIZE)
+    assert window_start <= 48138 < window_end == 48139
+
+
+@pytest.mark.parametrize('pos', [position(48128, 40, valid=0),
+                                 position(48128, 40, ticks_per_beat=0.0),
+                                 position(48128, 40, beats_per_minute=0.0),
+                                 # a tick reported a beat late, before the last cycle.
+                                 position(48128, 1919)],
+                         ids=['no BBT', 'no ticks', 'no tempo', 'late'])
+def test_window_falls_back_to_the_cycle(beat_state, pos):
+    assert beat_state.beat_window(pos, BLOCKSIZE) == (48128, 48128 + BLOCKSIZE)
@@ -0,0 +1,130 @@
+"""
+The parts of a beat model checkpoint copied from the writer thread while beats are recorded, a
+checkpoint written, mapped and restored, and the files read_checkpoint rejects.
+"""
+import random
+import struct
+import threading
+from fractions import Fraction
+import pytest
+
+from lib.jack.beat_map import BeatMap, CompactBeatMap
+from lib.jack.checkpoint import (CheckpointError, read_checkpoint, write_checkpoint)
+from lib.jack.estimators import LeastSquaresBeatEstimator
+
+
+@pytest.mark.parametrize('beat_map', [BeatMap, lambda: CompactBeatMap(64)])
+def test_latest_beats(beat_map):
+    rng = random.Random(1)
+    for _ in range(200):
+        beats = beat_map()
+        beat = rng.randrange(-3, 2)
+        for _ in range(rng.randrange(1, 500)):
+            beats.record(beat, 0, 0, 1)
+            if rng.random() < 0.02:
+                # a locate, forwards past any number of beats or back.
+                beat += rng.choice((-1, 1)) * rng.randrange(1, rng.choice((10, 1000, 100000)))
+            else:
+                beat += 1
+        count = rng.choice((1, 8, 64, 100))
+        assert beats.latest(count) == sorted(beats)[-count:]
+
+
+def test_estimator_state_waits_for_beat():
+    estimator = LeastSquaresBeatEstimator(24000.0)
+    estimator.add(1, 0)
+    states = []
+    # a beat being added by the process thread.
+    estimator._sequence += 1
+    estimator.count += 1
+    reader = threading.Thread(target=lambda: states.append(estimator.state()))
+    reader.start()
+    reader.join(0.05)
+    assert reader.is_alive()
+    estimator._sequence += 1
+    reader.join()
+    assert states[0][1] == 2
+
+
+@pytest.fixture
+def learned(tmp_path):
+    """
+    A client that learned a segment of 20 beats and changed tempo a quarter of the way through
+    the next beat, to a tempo whose frames per beat are not dyadic, and the path of its
+    checkpoint. The new segment's start frame is estimated from the tempo and tick until its
+    start beat is recorded.
+    """
+    pytest.importorskip('jack')
+    from lib.jack.simulator import FakeClient, SimulatedTransport
+    from lib.jack.timebase_client import PyJackTimebaseClient
+
+    change = 48000 * 10 + 6000
+    transport = SimulatedTransport(tempo_changes=[(change, 93.7)])
+    client = FakeClient(transport=transport, blocksize=256)
+    tclient = PyJackTimebaseClient(client, threading.Event())
+    client.run(change // 256 + 2)
+    path = str(tmp_path / 'beats')
+    write_checkpoint(tclient.beat_state.checkpoint(), path)
+    return tclient, path
+
+
+def test_round_trip_is_exact(learned):
+    from lib.jack.timebase_client import BeatStateMachine
+
+    tclient, path = learned
+    checkpoint = tclient.beat_state.checkpoint()
+    assert len(checkpoint.segments) == 2
+    # exact in neither a double nor a pair of 64-bit integers.
+    start_frame = checkpoint.segments[1].start_frame
+    assert Fraction(float(start_frame)) != start_frame and start_frame.numerator >= 2 ** 63
+    assert read_checkpoint(path, tclient.pos) == checkpoint
+
+    restored = BeatStateMachine(tclient.pos, tclient.client.blocksize)
+    restored.restore(read_checkpoint(path, tclient.pos))
+    assert restored.checkpoint() == checkpoint
+    for beat in range(1, max(tclient.beat_state.beat_map) + 32):
+        assert restored.exact_beat_frame(beat) == tclient.beat_state.exact_beat_frame(beat)
+
+
+@pytest.mark.parametrize('field, value', [('frame_rate', 44100),
+                                          ('beats_per_minute', 120.0),
+                                          ('beats_per_bar', 3.0)])
+def test_position_that_does_not_match_is_rejected(learned, field, value):
+    tclient, path = learned
+    setattr(tclient.pos, field, value)
+    with pytest.raises(CheckpointError):
+        read_checkpoint(path, tclient.pos)
+
+
+def rewrite(path, edit):
+    with open(path, 'rb') as checkpoint_file:
+        data = bytearray(checkpoint_file.read())
+    with open(path, 'wb') as checkpoint_file:
+        checkpoint_file.write(edit(data))
+
+
+def with_version(data):
+    struct.pack_into('<Q', data, 8, 4)
+    return data
+
+
+def with_magic(data):
+    data[:8] = b'JTBEATS0'
+    return data
+
+
+@pytest.mark.parametrize('edit', [with_version, with_magic, lambda data: data[:-1],
+                                  lambda data: data[:16], lambda data: data + b'\0'],
+                         ids=['version', 'magic', 'truncated', 'header', 'appended'])
+def test_corrupt_file_is_rejected(learned, edit):
+    tclient, path = learned
+    rewrite(path, edit)
+    with pytest.raises(CheckpointError):
+        read_checkpoint(path, tclient.pos)
+
+
+def test_missing_file_is_rejected(learned, tmp_path):
+    tclient, _ = learned
+    with pytest.raises(CheckpointError):
+        read_checkpoint(str(tmp_path / 'missing'), tclient.pos)
+
@@ -0,0 +1,232 @@
+"""
+The control buffer handing requests to the process thread, and the master applying a tempo sweep
+through it.
+"""
+import threading
+from array import array
+from math import nan
+import pytest
+
+from lib.jack.control import (BEATS_PER_BAR, FIELDS, LOCATE_FRAME, LOCATES, MAX_FRAME, TEMPO,
+                              ControlBuffer, ControlError, parse_command, parse_time_signature)
+
+
+class HookedState(list):
+    """
+    State calling hook once, when field is first read or written.
+    """
+    def __init__(self, values, field, hook):
+        super(HookedState, self).__init__(values)
+        self.field = field
+        self.hook = hook
+
+    def _call(self, index):
+        if index == self.field and self.hook is not None:
+            hook, self.hook = self.hook, None
+            hook()
+
+    def __getitem__(self, index):
+        self._call(index)
+        return super(HookedState, self).__getitem__(index)
+
+    def __setitem__(self, index, value):
+        self._call(index)
+        super(HookedState, self).__setitem__(index, value)
+
+
+def test_read_rejects_a_buffer_being_refilled():
+    buffer = ControlBuffer()
+    buffer.publish([120.0, 4.0, 4.0, 0.0, 0.0])
+    refilling = threading.Event()
+    resume = threading.Event()
+
+    def stop_halfway():
+        refilling.set()
+        resume.wait()
+
+    def publish():
+        buffer.publish([130.0, 4.0, 4.0, 0.0, 0.0])
+        # refills the buffer being read, stopping after three fields.
+        buffer.publish(HookedState([140.0, 7.0, 8.0, 0.0, 0.0], 3, stop_halfway))
+
+    writer = threading.Thread(target=publish, daemon=True)
+
+    def start_writer():
+        writer.start()
+        refilling.wait()
+
+    # the writer runs after the reader copied the first field.
+    buffer.state = HookedState([nan] * FIELDS, 1, start_writer)
+    try:
+        assert not buffer.read()
+    finally:
+        resume.set()
+        writer.join()
+    buffer.state = array('d', [nan]) * FIELDS
+    assert buffer.read()
+    assert list(buffer.state) == [140.0, 7.0, 8.0, 0.0, 0.0]
+    assert not buffer.read()
+
+
+def test_prepared_object_is_read_with_its_state():
+    buffer = ControlBuffer()
+    buffer.prepare = lambda state: state[TEMPO] * 2
+    for tempo in (100.0, 110.0, 120.0):
+        buffer.publish([tempo, nan, nan, 0.0, 0.0])
+    assert buffer.read()
+    assert (buffer.state[TEMPO], buffer.prepared) == (120.0, 240.0)
+
+
+@pytest.mark.parametrize('line', ['tempo inf', 'tempo -inf', 'tempo nan', 'tempo 0',
+                                  'tempo 1e400'])
+def test_tempo_must_be_positive_and_finite(line):
+    state = [nan, nan, nan, 0.0, 0.0]
+    with pytest.raises(ControlError):
+        parse_command(line, state)
+    assert all(value != value for value in state[:LOCATE_FRAME])
+
+
+@pytest.mark.parametrize('text', ['0.4/4', '1.5/4', '0/4', '-3/4', '1e400/4', 'inf/4', 'nan/4',
+                                  '{0}/4'.format(2 ** 31), '7/3'])
+def test_beats_per_bar_must_be_a_whole_number(text):
+    state = [nan, nan, nan, 0.0, 0.0]
+    with pytest.raises(ControlError):
+        parse_command('meter ' + text, state)
+    assert state[BEATS_PER_BAR] != state[BEATS_PER_BAR]
+    with pytest.raises(ValueError):
+        parse_time_signature(text)
+
+
+def test_time_signature_option_is_validated(capsys):
+    from lib.parser import parse_args
+
+    assert parse_args(['master', '--time-signature', '7/8']).time_signature == (7.0, 8.0)
+    with pytest.raises(SystemExit):
+        parse_args(['master', '--time-signature', '0.4/4'])
+    assert 'time-signature' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('frame', ['-1', str(MAX_FRAME + 1), '99999999999999999999'])
+def test_locate_frame_must_fit_a_jack_frame(frame):
+    state = [nan, nan, nan, 0.0, 0.0]
+    with pytest.raises(ControlError):
+        parse_command('locate ' + frame, state)
+    assert state[LOCATES] == 0.0
+    parse_command('locate {0}'.format(MAX_FRAME), state)
+    assert (state[LOCATE_FRAME], state[LOCATES]) == (MAX_FRAME, 1.0)
+
+
+def sweeping_master(jack):
+    from lib.jack.simulator import FakeClient, SimulatedTransport
+    from lib.jack.timebase_master import PyJackTimebaseMaster
+
+    client = FakeClient(transport=SimulatedTransport(), blocksize=256)
+    control = ControlBuffer()
+    master = PyJackTimebaseMaster(client, threading.Event(), control=control)
+    master.set_timebase_callback()
+    return client, control, master
+
+
+def test_tempo_sweep_adds_a_segment_per_span():
+    jack = pytest.importorskip('jack')
+    from lib.jack.timebase_master import CONTROL_SPAN
+
+    client, control, master = sweeping_master(jack)
+    state = [nan, nan, nan, 0.0, 0.0]
+    for cycle in range(1000):
+        state[TEMPO] = 60.0 + cycle % 120
+        control.publish(state)
+        client.cycle()
+        assert master.tempo_map.segments[-1].tempo is control.prepared
+    assert client.transport_query_struct()[0] == jack.ROLLING
+    assert master.tempo_map.segments[-1].beats_per_minute == state[TEMPO]
+    span = int(CONTROL_SPAN * client.samplerate)
+    starts = master.tempo_map.start_frames
+    # the last change may take effect a span after the last cycle.
+    assert len(starts) <= 1000 * 256 // span + 3
+    assert all(later - earlier >= span for earlier, later in zip(starts[1:], starts[2:]))
+
+
+def test_locate_before_a_sweep_keeps_its_position():
+    jack = pytest.importorskip('jack')
+    client, control, master = sweeping_master(jack)
+    state = [nan, nan, nan, 0.0, 0.0]
+    positions = {}
+    for cycle in range(5000):
+        state[TEMPO] = 60.0 + cycle % 120
+        control.publish(state)
+        client.cycle()
+        if cycle % 97 == 0:
+            pos = client.transport_query_struct()[1]
+            positions[pos.frame] = (pos.bar, pos.beat, pos.tick, pos.bar_start_tick)
+    for frame, bbt in sorted(positions.items(), reverse=True):
+        client.transport_locate(frame)
+        client.cycle()
+        pos = client.transport_query_struct()[1]
+        assert (pos.frame, pos.bar, pos.beat, pos.tick, pos.bar_start_tick) == (frame,) + bbt
+
+
+def test_server_keeps_reading_after_a_state_fails_to_prepare(tmp_path, capsys):
+    import socket
+    import time
+    from lib.jack.control_server import ControlServer
+
+    def prepare(state):
+        if state[TEMPO] == 13.0:
+            raise OverflowError('unlucky tempo')
+        return state[TEMPO]
+
+    buffer = ControlBuffer()
+    buffer.prepare = prepare
+    path = str(tmp_path / 'control')
+    server = ControlServer(buffer, path, interval=0.001)
+    server.start()
+    sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        for command in (b'tempo 90', b'tempo 13', b'tempo 100'):
+            published = server.published + server.errors
+            sender.sendto(command, path)
+            deadline = time.monotonic() + 5
+            while server.published + server.errors == published and time.monotonic() < deadline:
+                time.sleep(0.001)
+    finally:
+        sender.close()
+        server.stop()
+    assert (server.published, server.errors) == (2, 1)
+    assert buffer.read()
+    assert (buffer.state[TEMPO], buffer.prepared) == (100.0, 100.0)
+    assert 'unlucky tempo' in capsys.readouterr().err
+
+
+def test_server_publishes_a_command_at_once_and_a_burst_once_per_interval(tmp_path):
+    import socket
+    import time
+    from lib.jack.control_server import ControlServer
+
+    buffer = ControlBuffer()
+    path = str(tmp_path / 'control')
+    server = ControlServer(buffer, path, interval=0.5)
+    server.start()
+    sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def wait_for(published):
+        deadline = time.monotonic() + 5
+        while server.published < published and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return time.monotonic()
+
+    try:
+        sent = time.monotonic()
+        sender.sendto(b'tempo 90', path)
+        assert wait_for(1) - sent < 0.25
+        assert buffer.read() and buffer.state[TEMPO] == 90.0
+        for tempo in (100, 110, 120):
+            sender.sendto('tempo {0}'.format(tempo).encode(), path)
+        time.sleep(0.1)
+        assert server.published == 1
+        wait_for(2)
+    finally:
+        sender.close()
+        server.stop()
+    assert (server.received, server.published) == (4, 2)
+    assert buffer.read() and buffer.state[TEMPO] == 120.0
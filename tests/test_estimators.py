@@ -0,0 +1,127 @@
+"""
+Skew classification of the least-squares beat estimator, and the choice between the fit and the
+fpb range by the beats each has missed.
+"""
+import threading
+import pytest
+
+from lib.jack.estimators import (OUTLIER_WINDOW, SKEW_BAR, SKEW_LINEAR, SKEW_NONE,
+                                 SKEW_PERIODIC, LeastSquaresBeatEstimator)
+
+WIDTH = 1000
+# frames of measurement error, e.g. the window of a beat interpolated from the tick.
+TOLERANCE = 16
+
+
+def estimator_of(frames):
+    estimator = LeastSquaresBeatEstimator(WIDTH)
+    for beat, frame in enumerate(frames, 1):
+        estimator.add(beat, frame)
+    return estimator
+
+
+def test_beats_at_the_expected_width_are_not_skewed():
+    assert estimator_of([beat * WIDTH for beat in range(40)]).skew_type(TOLERANCE) == SKEW_NONE
+
+
+def test_beats_consistently_wider_are_periodic():
+    estimator = estimator_of([beat * (WIDTH + 10) for beat in range(40)])
+    assert estimator.skew_type(TOLERANCE) == SKEW_PERIODIC
+
+
+def test_beats_widening_are_linear():
+    frames = [0]
+    for beat in range(40):
+        frames.append(frames[-1] + WIDTH + beat)
+    assert estimator_of(frames).skew_type(TOLERANCE) == SKEW_LINEAR
+
+
+def test_beat_on_an_unexpected_bar_is_reported_for_the_outlier_window():
+    frames = [beat * WIDTH for beat in range(60)]
+    # reported a bar of four beats late.
+    frames[-1] += 4 * WIDTH
+    estimator = estimator_of(frames)
+    assert estimator.skew_type(TOLERANCE) == SKEW_BAR
+    assert estimator.outliers == estimator.recent_outliers == 1
+    for beat in range(61, 61 + OUTLIER_WINDOW):
+        estimator.add(beat, (beat - 1) * WIDTH)
+    assert estimator.outliers == 1 and estimator.recent_outliers == 0
+    assert estimator.skew_type(TOLERANCE) != SKEW_BAR
+
+
+def test_state_round_trip():
+    estimator = estimator_of([beat * WIDTH + beat % 3 for beat in range(40)])
+    restored = LeastSquaresBeatEstimator(0)
+    restored.restore(estimator.state())
+    assert restored.state() == estimator.state()
+    assert restored.recent_outliers == estimator.recent_outliers
+    assert restored.preferred_over_range() == estimator.preferred_over_range()
+
+
+def test_beat_already_in_the_fit_is_rejected():
+    estimator = LeastSquaresBeatEstimator(WIDTH)
+    for beat in range(10, 20):
+        assert estimator.add(beat, beat * WIDTH + (beat % 2) * 512)
+    state = estimator.state()
+    for beat in (10, 15, 19):
+        assert not estimator.add(beat, beat * WIDTH + 128)
+    assert estimator.state() == state
+    restored = LeastSquaresBeatEstimator(0)
+    restored.restore(state)
+    assert not restored.add(10, 10 * WIDTH)
+    # beats beyond either end of those added are new.
+    assert restored.add(9, 9 * WIDTH) and restored.add(20, 20 * WIDTH)
+    assert restored.count == 12
+
+
+@pytest.mark.parametrize('range_error, fit_preferred', [(0, False), (50, True)])
+def test_model_missing_fewer_beats_is_preferred(range_error, fit_preferred):
+    estimator = LeastSquaresBeatEstimator(WIDTH)
+    assert not estimator.preferred_over_range()
+    for beat in range(1, 40):
+        frame = beat * WIDTH + (7 if beat % 2 else -7)
+        estimator.add(beat, frame, 16, beat * WIDTH + range_error)
+    assert estimator.scored == 37
+    assert estimator.preferred_over_range() == fit_preferred
+
+
+@pytest.mark.parametrize('jitter, preferred', [(0, 'fpb_range'), (128, 'least_squares')])
+def test_client_predicts_with_the_model_converging_faster(jitter, preferred):
+    pytest.importorskip('jack')
+    from lib.jack.simulator import FakeClient, SimulatedTransport
+    from lib.jack.timebase_client import PyJackTimebaseClient
+
+    transport = SimulatedTransport(jitter=jitter, seed=jitter + 1)
+    client = FakeClient(transport=transport, blocksize=256)
+    tclient = PyJackTimebaseClient(client, threading.Event())
+    client.run(48000 * 30 // 256)
+    beat_state = tclient.beat_state
+    assert beat_state.skew_report()['estimator'] == preferred
+    beat = max(beat_state.beat_map) + 1
+    segment = beat_state.current_segment
+    misses = {'fpb_range': abs(float(segment.range_frame(beat))
+                               - transport.frame_at(beat - 1)),
+              'least_squares': abs(segment.estimator.predict(beat)
+                                   - transport.frame_at(beat - 1))}
+    assert misses[preferred] <= min(misses.values()) + 1
+
+
+def test_client_does_not_record_the_start_beat_twice(monkeypatch):
+    pytest.importorskip('jack')
+    from lib.jack.simulator import FakeClient, SimulatedTransport
+    from lib.jack.timebase_client import PyJackTimebaseClient
+
+    added = []
+    add = LeastSquaresBeatEstimator.add
+
+    def recording_add(estimator, beat_number, *args):
+        added.append(beat_number)
+        return add(estimator, beat_number, *args)
+    monkeypatch.setattr(LeastSquaresBeatEstimator, 'add', recording_add)
+
+    client = FakeClient(transport=SimulatedTransport(), blocksize=256)
+    PyJackTimebaseClient(client, threading.Event())
+    assert added == [1]
+    # a second at 120 bpm, in which beat 2 starts.
+    client.run(48000 // 256)
+    assert added == [1, 2]
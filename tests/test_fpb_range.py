@@ -0,0 +1,168 @@
+"""
+The closed-form fpb range refinement of BeatStateMachine on random beat traces, against a
+one-frame-at-a-time iteration with the same rounding, and against the loop of the original
+adjust_fpb_range.
+
+The original loop rounded the bounds inwards, to ceil(window_start / n) and
+floor(window_end / n), which crosses the range once beats are not a whole number of frames
+wide. Since tempo segments were added the bounds are rounded outwards instead, so the range
+holds the original loop's range and is at most a frame wider on each side.
+"""
+import random
+from math import inf
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('jack')
+from lib.jack.timebase_client import BeatStateMachine
+
+BEATS_PER_BAR = 4
+
+
+def position(beat_number, frame, frame_rate=48000, beats_per_minute=120.0):
+    bar, beat = divmod(beat_number - 1, BEATS_PER_BAR)
+    return SimpleNamespace(frame_rate=frame_rate, beats_per_minute=beats_per_minute,
+                           beats_per_bar=BEATS_PER_BAR, beat_type=4, ticks_per_beat=1920.0,
+                           bar=bar + 1, beat=beat + 1, tick=0, frame=frame, valid=0,
+                           bbt_offset=0)
+
+
+def stepped_range(fpb, windows):
+    """
+    Narrows fpb one frame at a time while a beat window of the first segment, counted from beat
+    1 at frame 0, stays within the range, i.e. to floor(window_start / n) and
+    ceil(window_end / n). A crossed range is swapped first.
+    """
+    low, high = min(fpb), max(fpb)
+    changed = True
+    while changed:
+        changed = False
+        for beat, (window_start, window_end) in windows.items():
+            if beat <= 1:
+                continue
+            count = beat - 1
+            if (low + 1) * count <= window_start:
+                low += 1
+                changed = True
+            if (high - 1) * count >= window_end:
+                high -= 1
+                changed = True
+    return low, high
+
+
+def baseline_range(fpb, windows):
+    """
+    The loop of the original adjust_fpb_range over the beat map of the current fpb group,
+    copied verbatim but for the beat map's layout.
+    """
+    first, second = fpb
+    low = first
+    high = second
+    if first > second:
+        high = first
+        low = second
+    for beat in windows:
+        beat_start_frame, beat_end_frame = windows[beat]
+        if beat > 1:
+            too_low = True
+            while too_low:
+                min_frames = low * (beat - 1)
+                if min_frames < beat_start_frame:
+                    low += 1
+                else:
+                    too_low = False
+            too_high = True
+            while too_high:
+                max_frames = high * (beat - 1)
+                if max_frames > beat_end_frame:
+                    high -= 1
+                else:
+                    too_high = False
+    return low, high
+
+
+def trace(rng, beats, blocksize, width, jitter, repositions):
+    """
+    Yields (beat number, cycle start frame) of each beat change seen by the client, with beats
+    occasionally seen again as after a locate back. Each beat keeps its jitter when seen again.
+    """
+    offsets = [rng.randint(-jitter, jitter) for _ in range(beats + 1)]
+    beat = 2
+    while beat <= beats:
+        frame = int((beat - 1) * width) + offsets[beat]
+        yield beat, max(frame // blocksize * blocksize, 0)
+        if beat > 3 and rng.random() < repositions:
+            beat = rng.randint(2, beat)
+        else:
+            beat += 1
+
+
+@pytest.mark.parametrize('retention', [None, 8])
+def test_closed_form_matches_outward_iteration(retention):
+    rng = random.Random(retention or 0)
+    for _ in range(300):
+        blocksize = rng.choice((16, 64, 256, 1024))
+        width = rng.uniform(10000.0, 40000.0)
+        jitter = rng.choice((0, 0, 16, blocksize))
+        beats_per_minute = 60 * 48000 / width
+        state = BeatStateMachine(position(1, 0, beats_per_minute=beats_per_minute), blocksize,
+                                 retention)
+        expected = state.current_segment.fpb
+        windows = {}
+        for beat, frame in trace(rng, 40, blocksize, width, jitter, 0.05):
+            state.record_beat(position(beat, frame, beats_per_minute=beats_per_minute),
+                              blocksize)
+            windows[beat] = (frame, frame + blocksize)
+            expected = stepped_range(expected, windows)
+            assert state.current_segment.fpb == expected
+
+
+@pytest.mark.parametrize('repositions', [0, 0.05, 0.1])
+def test_range_holds_the_baseline_range(repositions):
+    rng = random.Random(2)
+    for _ in range(300):
+        blocksize = rng.choice((16, 64, 256, 1024))
+        width = rng.choice((24000.0, rng.uniform(10000.0, 40000.0)))
+        jitter = rng.choice((0, 16))
+        beats_per_minute = 60 * 48000 / width
+        state = BeatStateMachine(position(1, 0, beats_per_minute=beats_per_minute), blocksize)
+        # the original loop narrowed the range it left after the previous beat.
+        baseline = state.current_segment.fpb
+        windows = {}
+        for beat, frame in trace(rng, 40, blocksize, width, jitter, repositions):
+            state.record_beat(position(beat, frame, beats_per_minute=beats_per_minute),
+                              blocksize)
+            windows[beat] = (frame, frame + blocksize)
+            low, high = state.current_segment.fpb
+            baseline = baseline_range(baseline, windows)
+            baseline_low, baseline_high = baseline
+            assert baseline_low - 1 <= low <= baseline_low
+            assert baseline_high <= high <= baseline_high + 1
+
+
+def test_evicted_beats_keep_the_range():
+    rng = random.Random(3)
+    for _ in range(100):
+        blocksize = rng.choice((16, 64, 256, 1024))
+        width = rng.uniform(10000.0, 40000.0)
+        jitter = rng.choice((0, 16, blocksize))
+        beats_per_minute = 60 * 48000 / width
+        start = position(1, 0, beats_per_minute=beats_per_minute)
+        unbounded = BeatStateMachine(start, blocksize)
+        bounded = BeatStateMachine(start, blocksize, 4)
+        for beat, frame in trace(rng, 40, blocksize, width, jitter, 0):
+            pos = position(beat, frame, beats_per_minute=beats_per_minute)
+            unbounded.record_beat(pos, blocksize)
+            bounded.record_beat(pos, blocksize)
+            assert len(bounded.beat_map) <= 4
+            # folding the whole beat map again only sees the evicted beats through
+            # evicted_fpb, and must narrow the range no less than recording beat by beat.
+            recorded = bounded.current_segment.fpb
+            bounded.adjust_fpb_range()
+            assert bounded.current_segment.fpb == recorded
+            assert recorded == unbounded.current_segment.fpb
+            if beat > 5:
+                # beat 1 is never recorded, so beat 6 is the first to evict one.
+                assert bounded.current_segment.evicted_fpb != (-inf, inf)
+            assert ([unbounded.predict_beat_frame(beat + n) for n in range(1, 4)]
+                    == [bounded.predict_beat_frame(beat + n) for n in range(1, 4)])
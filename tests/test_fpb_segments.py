@@ -0,0 +1,53 @@
+"""
+Bisection of FpbSegmentIndex at the edges of its segments: the first and last beat of each,
+frames exactly on a start frame, before the first segment and past the last, and appending a
+segment that starts before the last.
+"""
+import pytest
+
+from lib.jack.fpb_segments import FpbSegmentIndex
+
+WIDTHS = (24000, 32000, 20000)
+START_BEATS = (1, 9, 17)
+
+
+@pytest.fixture
+def index():
+    index = FpbSegmentIndex()
+    frame = 0
+    for start_beat, next_start, width in zip(START_BEATS, START_BEATS[1:] + (None,), WIDTHS):
+        index.append((width - 1, width + 1), start_beat, frame)
+        if next_start is not None:
+            frame += width * (next_start - start_beat)
+    return index
+
+
+def test_first_and_last_beats(index):
+    first, second, third = index
+    assert [index.at_beat(beat) for beat in (1, 8, 9, 16, 17, 10 ** 9)] == [
+        first, first, second, second, third, third]
+    assert (first.end_beat, second.end_beat, third.end_beat) == (8, 16, None)
+    # before beat 1, e.g. in bar 0.
+    assert index.at_beat(0) is index.at_beat(-5) is first
+
+
+def test_frames_on_a_start_frame(index):
+    first, second, third = index
+    # second starts at frame 8 * 24000, third at 8 * 32000 after it.
+    assert [index.at_frame(frame) for frame in (0, 191999, 192000, 447999, 448000)] == [
+        first, first, second, second, third]
+    assert index.at_frame(-1) is first
+    # a start window moves the start frame bisected on.
+    index.set_start_window(third, 448100, 448101)
+    assert index.at_frame(448100) is second and index.at_frame(448101) is third
+
+
+def test_append_before_the_last_drops_later_segments(index):
+    first, second, third = index
+    replaced = index.append((30000, 30002), 9, 192000)
+    assert list(index) == [first, replaced] and second.number not in index
+    assert first.end_beat == 8 and replaced.end_beat is None
+    assert index.at_beat(17) is replaced and index.at_frame(448000) is replaced
+    later = index.append((20000, 20002), 12, 282000)
+    assert list(index) == [first, replaced, later] and replaced.end_beat == 11
+    assert index[later.number] is later and later.number > third.number
@@ -0,0 +1,65 @@
+"""
+Beat frames of BeatLine against exact rational arithmetic, at the edges of its fixed-point range:
+beats before start, starts before frame 0 and beat counts from 2 ** GUARD_BITS on.
+"""
+import random
+from fractions import Fraction
+from math import floor
+import pytest
+
+from lib.jack.frames import FIXED_BEATS, BeatLine, frames_per_beat
+
+LINES = [
+    BeatLine(0, frames_per_beat(48000, 120.0)),
+    BeatLine(Fraction(1, 3), frames_per_beat(44100, 93.75)),
+    BeatLine(-Fraction(2 ** 62, 7), frames_per_beat(96000, 174.0)),
+    BeatLine(Fraction(-0.25), Fraction(23998.5)),
+    # exact frames are whole every 7 beats, where rounding is most likely to cross a frame.
+    BeatLine(-5, Fraction(48001, 7)),
+    BeatLine(2 ** 62 - 1, Fraction(2 ** 64 + 1, 2 ** 64)),
+]
+
+BEATS = [0, 1, 7, -1, -7, -8, -2 ** 40, -2 ** 63, FIXED_BEATS - 7, FIXED_BEATS - 1, FIXED_BEATS,
+         FIXED_BEATS + 7, 2 ** 100, 7 * 2 ** 100]
+
+
+@pytest.mark.parametrize('line', LINES, ids=repr)
+@pytest.mark.parametrize('beats', BEATS)
+def test_frame_is_the_floor_of_the_exact_frame(line, beats):
+    assert line.frame(beats) == floor(line.exact(beats))
+
+
+def test_random_lines():
+    rng = random.Random(1)
+    for _ in range(2000):
+        start = Fraction(rng.randrange(-2 ** 62, 2 ** 62), rng.randrange(1, 1000))
+        line = BeatLine(start, Fraction(rng.uniform(1.0, 200000.0)))
+        beats = rng.choice((-1, 1)) * int(2 ** rng.uniform(0, 100))
+        assert line.frame(beats) == floor(line.exact(beats))
+
+
+@pytest.mark.parametrize('line', LINES, ids=repr)
+def test_offset_before_start(line):
+    for beats in (-1, -7, -2 ** 20):
+        frame = line.frame(beats)
+        assert line.offset(beats, frame) == pytest.approx(float(line.exact(beats) - frame),
+                                                          abs=1e-9)
+
+
+def test_bench_checks_find_no_errors():
+    pytest.importorskip('jack')
+    from lib.bench.frames import check_long_run, check_random, learn
+
+    assert check_random(50)[3] == 0
+    rows = check_long_run(learn(256, 48000, 5.0), 100)
+    assert rows and all(row[4] == 0 for row in rows)
+
+
+def test_bench_checks_find_a_frame_off_by_one(monkeypatch):
+    pytest.importorskip('jack')
+    from lib.bench.frames import check_random
+
+    frame = BeatLine.frame
+    monkeypatch.setattr(BeatLine, 'frame',
+                        lambda self, beats: frame(self, beats) + (beats >= FIXED_BEATS))
+    assert check_random(10)[3] > 0
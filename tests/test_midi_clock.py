@@ -0,0 +1,145 @@
+"""
+MIDI clock output of a transport that starts before beat 1, whose beats cannot be predicted, of
+a master reporting its beats with jitter, and of a locate in the middle of a bar.
+"""
+import threading
+from types import SimpleNamespace
+import pytest
+
+jack = pytest.importorskip('jack')
+from lib.jack.midi_clock import (CLOCK, CONTINUE, NOTE_OFF, NOTE_ON, PULSES_PER_QUARTER_NOTE,
+                                 PULSES_PER_SONG_POSITION, SONG_POSITION, START, STOP, MidiClock)
+from lib.jack.simulator import FakeClient, FakeMidiPort, SimulatedTransport
+from lib.jack.timebase_client import PyJackTimebaseClient
+
+# clock pulses per beat in x/4.
+PULSES_PER_BEAT = PULSES_PER_QUARTER_NOTE
+WIDTH = 1000
+# beat 1 starts at this frame; the transport starts at beat -1, in bar 0.
+BEAT_1 = 2 * WIDTH
+# beats after which the client's predictions have settled.
+SETTLED = 12
+
+
+class BeatState(object):
+    """
+    Predicts beats WIDTH frames apart from BEAT_1, and nothing before beat 1.
+    """
+    def beat_line(self, beat_number):
+        if beat_number > 0:
+            return self
+
+    def beat_frame(self, beat_number):
+        if beat_number > 0:
+            return BEAT_1 + (beat_number - 1) * WIDTH
+
+    def beat_number_from_pos(self, pos):
+        return (pos.frame - BEAT_1) // WIDTH + 1
+
+    def is_first_beat_of_bar(self, beat_number):
+        return beat_number % 4 == 1
+
+
+@pytest.mark.parametrize('start', [0, 1500])
+def test_clock_waits_for_beat_1(start):
+    client = SimpleNamespace(blocksize=256, frame=start)
+    port = FakeMidiPort(client, 'clock')
+    clock = MidiClock(port, BeatState(), beat_note=60)
+    while client.frame < BEAT_1 + 4 * WIDTH:
+        clock.process(jack.ROLLING, SimpleNamespace(frame=client.frame, beat_type=4), client.blocksize, False)
+        client.frame += client.blocksize
+    events = port.events()
+    assert events[0] == (start, START[0], 0)
+    clocks = [frame for frame, status, _ in events if status == CLOCK[0]]
+    expected = [BEAT_1 + pulse * WIDTH // PULSES_PER_BEAT for pulse in range(len(clocks))]
+    assert len(clocks) >= 4 * PULSES_PER_BEAT
+    assert clocks == expected
+
+
+def test_stop_switches_the_beat_note_off():
+    client = SimpleNamespace(blocksize=256, frame=BEAT_1 - 256)
+    port = FakeMidiPort(client, 'clock')
+    clock = MidiClock(port, BeatState(), beat_note=60)
+    # the note of beat 2 is on until the middle of the beat, which the transport stops before.
+    while client.frame < BEAT_1 + WIDTH + WIDTH // 4:
+        clock.process(jack.ROLLING, SimpleNamespace(frame=client.frame, beat_type=4), client.blocksize, False)
+        client.frame += client.blocksize
+    stop = client.frame
+    for cycle in range(8):
+        clock.process(jack.STOPPED, SimpleNamespace(frame=stop, beat_type=4), client.blocksize, False)
+    events = port.events()
+    notes = [(frame, status) for frame, status, _ in events if status in (NOTE_ON, NOTE_OFF)]
+    assert notes[-2:] == [(BEAT_1 + WIDTH, NOTE_ON), (stop, NOTE_OFF)]
+    assert events[-2:] == [(stop, NOTE_OFF, 60), (stop, STOP[0], 0)]
+
+
+def clocked_client(transport, repositions=None):
+    client = FakeClient(transport=transport, blocksize=256, repositions=repositions)
+    PyJackTimebaseClient(client, threading.Event(), midi_clock=True)
+    return client, next(iter(client.midi_outports))
+
+
+@pytest.mark.parametrize('jitter', [0, 16])
+def test_clock_follows_a_jittered_master(jitter):
+    transport = SimulatedTransport(jitter=jitter, seed=jitter + 1)
+    client, port = clocked_client(transport)
+    client.run(48000 * 20 // 256)
+    clocks = [frame for frame, status, _ in port.events() if status == CLOCK[0]]
+    assert len(clocks) >= 38 * PULSES_PER_BEAT
+    # the first beats are written before the beat width is known, and their predictions are
+    # corrected once they are recorded, a cycle after the beat's own pulse.
+    for pulse in range(SETTLED * PULSES_PER_BEAT, len(clocks)):
+        assert abs(clocks[pulse] - transport.frame_at(pulse / PULSES_PER_BEAT)) <= 8
+    # the pulses of a beat divide its whole frames.
+    for beat in range(SETTLED, len(clocks) // PULSES_PER_BEAT - 1):
+        pulses = clocks[beat * PULSES_PER_BEAT:(beat + 1) * PULSES_PER_BEAT + 1]
+        intervals = [b - a for a, b in zip(pulses, pulses[1:])]
+        assert max(intervals) - min(intervals) <= 1
+
+
+def test_locate_mid_bar_continues_from_the_next_sixteenth():
+    transport = SimulatedTransport()
+    cycle = 48000 * 20 // 256
+    # the second beat of bar 6, three tenths of the way to the third.
+    locate = int(transport.frame_at(21.3))
+    client, port = clocked_client(transport, repositions={cycle: locate})
+    client.run(cycle + 48000 * 4 // 256)
+    events = port.events()
+    stop = next(i for i, event in enumerate(events) if event[1] == STOP[0])
+    assert events[stop][0] == locate
+    # pulse 511.2 is rounded up to the sixteenth note starting at pulse 516.
+    pulse = 516
+    assert pulse % PULSES_PER_SONG_POSITION == 0
+    assert events[stop + 1] == (locate, SONG_POSITION, pulse // PULSES_PER_SONG_POSITION)
+    assert events[stop + 2][:2] == (locate, CONTINUE[0])
+    clocks = [frame for frame, status, _ in events[stop + 3:] if status == CLOCK[0]]
+    assert len(clocks) >= 3 * PULSES_PER_BEAT
+    for frame in clocks:
+        assert abs(frame - transport.frame_at(pulse / PULSES_PER_BEAT)) <= 8
+        pulse += 1
+
+
+def test_clock_counts_quarter_notes_in_7_8():
+    transport = SimulatedTransport(beats_per_bar=7, beat_type=8)
+    pulses_per_beat = PULSES_PER_QUARTER_NOTE // 2
+    cycle = 48000 * 20 // 256
+    # the fifth beat of bar 4, three tenths of the way to the sixth.
+    locate = int(transport.frame_at(25.3))
+    client, port = clocked_client(transport, repositions={cycle: locate})
+    client.run(cycle + 48000 * 4 // 256)
+    events = port.events()
+    stop = next(i for i, event in enumerate(events) if event[1] == STOP[0])
+    clocks = [frame for frame, status, _ in events[:stop] if status == CLOCK[0]]
+    # twelve pulses per beat: an eighth note, at the 120 beats per minute of the transport.
+    assert len(clocks) >= 38 * pulses_per_beat
+    for pulse in range(SETTLED * pulses_per_beat, len(clocks)):
+        assert abs(clocks[pulse] - transport.frame_at(pulse / pulses_per_beat)) <= 8
+    # beat 25.3 is pulse 303.6, 50.6 sixteenth notes in; clocking resumes at the 51st.
+    pulse = 306
+    assert events[stop + 1] == (locate, SONG_POSITION, pulse // PULSES_PER_SONG_POSITION)
+    assert events[stop + 2][:2] == (locate, CONTINUE[0])
+    clocks = [frame for frame, status, _ in events[stop + 3:] if status == CLOCK[0]]
+    assert len(clocks) >= 3 * pulses_per_beat
+    for frame in clocks:
+        assert abs(frame - transport.frame_at(pulse / pulses_per_beat)) <= 8
+        pulse += 1
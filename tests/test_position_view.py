@@ -0,0 +1,169 @@
+"""
+The text of the position view, from hand-built snapshot values and stats, and its redraws from a
+snapshot being written.
+"""
+import threading
+from math import nan
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('urwid')
+from lib.stats import REPOSITIONS, XRUNS, CallbackStats
+from lib.telemetry import (POSITION_BBT, SNAPSHOT_BAR, SNAPSHOT_BBT, SNAPSHOT_BEAT,
+                           SNAPSHOT_BEAT_TYPE, SNAPSHOT_BEAT_WIDTH, SNAPSHOT_BEATS_PER_BAR,
+                           SNAPSHOT_BEATS_PER_MINUTE, SNAPSHOT_FIELDS, SNAPSHOT_FRAME,
+                           SNAPSHOT_FRAME_RATE, SNAPSHOT_NEXT_BEAT, SNAPSHOT_NEXT_BEAT_FRAME,
+                           SNAPSHOT_STATE, SNAPSHOT_TICK, PositionSnapshot)
+from lib.urwid.position import (PositionView, format_position, format_predictions,
+                                format_stats, format_tempo, sparkline)
+
+STOPPED = 0
+ROLLING = 1
+
+
+def snapshot_values(state=ROLLING, frame=204000, bbt=True, next_beat=nan, next_beat_frame=nan,
+                    beat_width=nan):
+    """
+    Returns snapshot values at 120 bpm in 7/8, bar 3 beat 2 tick 960 when BBT is valid.
+    """
+    values = [nan] * SNAPSHOT_FIELDS
+    values[SNAPSHOT_STATE] = state
+    values[SNAPSHOT_FRAME] = frame
+    values[SNAPSHOT_FRAME_RATE] = 48000
+    values[SNAPSHOT_BBT] = POSITION_BBT if bbt else 0
+    values[SNAPSHOT_BAR] = 3
+    values[SNAPSHOT_BEAT] = 2
+    values[SNAPSHOT_TICK] = 960
+    values[SNAPSHOT_BEATS_PER_MINUTE] = 120.0
+    values[SNAPSHOT_BEATS_PER_BAR] = 7
+    values[SNAPSHOT_BEAT_TYPE] = 8
+    values[SNAPSHOT_NEXT_BEAT] = next_beat
+    values[SNAPSHOT_NEXT_BEAT_FRAME] = next_beat_frame
+    values[SNAPSHOT_BEAT_WIDTH] = beat_width
+    return values
+
+
+def position(frame=204000):
+    """
+    Returns a jack_position_t stand-in for PositionSnapshot.publish.
+    """
+    return SimpleNamespace(frame=frame, frame_rate=48000, valid=POSITION_BBT, bar=3, beat=2,
+                           tick=960, beats_per_minute=120.0, beats_per_bar=7, beat_type=8)
+
+
+def test_position_of_a_rolling_and_a_stopped_transport():
+    assert format_position(snapshot_values()) == (
+        'rolling', 'bar 3 beat 2 tick  960   frame 204000 (4.25 s)')
+    assert format_position(snapshot_values(state=STOPPED, frame=48000, bbt=False)) == (
+        'stopped', 'frame 48000 (1.00 s)')
+    assert format_position(snapshot_values(state=7))[0] == '7'
+
+
+def test_tempo_needs_bbt():
+    assert format_tempo(snapshot_values()) == '120.000 bpm  7/8  24000.00 frames per beat'
+    assert format_tempo(snapshot_values(bbt=False)) == 'no BBT'
+
+
+def test_predictions_extrapolate_from_the_next_beat():
+    values = snapshot_values(next_beat=10, next_beat_frame=216000, beat_width=24000.5)
+    assert format_predictions(values, 3) == [
+        'beat 10 at frame 216000.0 (+250.0 ms)',
+        'beat 11 at frame 240000.5 (+750.0 ms)',
+        'beat 12 at frame 264001.0 (+1250.0 ms)',
+    ]
+    # a stopped transport keeps its predictions, which a locate may move.
+    values[SNAPSHOT_STATE] = STOPPED
+    values[SNAPSHOT_FRAME] = 240000.5
+    assert format_predictions(values, 2) == [
+        'beat 10 at frame 216000.0 (-500.0 ms)',
+        'beat 11 at frame 240000.5 (+0.0 ms)',
+    ]
+
+
+def test_no_predictions_before_the_client_makes_one():
+    assert format_predictions(snapshot_values(), 4) == ['no predictions in this mode']
+
+
+def test_sparkline_scales_widths_logarithmically():
+    assert sparkline([]) == ''
+    assert sparkline([15, 3, 1, 0]) == '█▄▂ '
+    # a crossed range has a negative width and is drawn as empty.
+    assert sparkline([-2, 0]) == '  '
+
+
+def test_stats_lines():
+    stats = CallbackStats()
+    assert format_stats(stats) == [
+        'DSP load: p50 0.0%  max 0.0%',
+        'repositions 0  segment changes 0  xruns 0  reconnects 0',
+    ]
+    stats.timed('process', lambda nframes: None)
+    stats.durations['process'].record(25000)
+    stats.dsp_load.record(1250)
+    stats.count(REPOSITIONS)
+    stats.count(XRUNS)
+    stats.count(XRUNS)
+    assert format_stats(stats) == [
+        '  process: p50    25.0 us  p99    25.0 us  max    25.0 us',
+        'DSP load: p50 12.5%  max 12.5%',
+        'repositions 1  segment changes 0  xruns 2  reconnects 0',
+    ]
+
+
+def test_view_draws_nothing_until_a_cycle_is_published():
+    view = PositionView(PositionSnapshot(), CallbackStats(), threading.Event())
+    view.update()
+    assert view.position.text == view.predictions.text == view.model.text == ''
+    assert view.load.text.startswith('DSP load')
+
+
+def test_view_without_predictions_or_beat_model():
+    snapshot = PositionSnapshot()
+    view = PositionView(snapshot, CallbackStats(), threading.Event())
+    snapshot.publish(STOPPED, position())
+    view.update()
+    assert view.state.text == 'stopped'
+    assert view.predictions.text == 'no predictions in this mode'
+    assert view.model.text == 'no beat model in this mode'
+    assert not view.widths
+
+
+def test_view_redraws_once_per_published_cycle():
+    snapshot = PositionSnapshot()
+    view = PositionView(snapshot, CallbackStats(), threading.Event(), beats=2)
+    snapshot.publish(ROLLING, position(), next_beat=10, next_beat_frame=216000,
+                     beat_width=24000, segment=0, fpb_low=23990, fpb_high=24005)
+    view.update()
+    view.update()
+    assert view.state.text == 'rolling'
+    assert view.predictions.text == ('beat 10 at frame 216000.0 (+250.0 ms)\n'
+                                     'beat 11 at frame 240000.0 (+750.0 ms)')
+    assert view.model.text == 'segment 0  fpb range 23990..24005 (width 15)\n█'
+    assert list(view.widths) == [15]
+    snapshot.publish(ROLLING, position(frame=204256), next_beat=10, next_beat_frame=216000,
+                     beat_width=24000, segment=0, fpb_low=23998, fpb_high=24001)
+    view.update()
+    assert list(view.widths) == [15, 3]
+    assert view.model.text.endswith('\n█▄')
+
+
+def test_view_waits_for_a_write_in_progress():
+    snapshot = PositionSnapshot()
+    view = PositionView(snapshot, CallbackStats(), threading.Event(), beats=1)
+    snapshot.publish(ROLLING, position(), next_beat=10, next_beat_frame=216000,
+                     beat_width=24000)
+    # the process callback is between the two increments of the sequence, with the next beat
+    # written but not yet its frame.
+    sequence = snapshot._sequence
+    values = snapshot._values
+    sequence[0] += 1
+    values[SNAPSHOT_NEXT_BEAT] = 11
+
+    def finish():
+        values[SNAPSHOT_NEXT_BEAT_FRAME] = 240000
+        sequence[0] += 1
+    writer = threading.Timer(0.05, finish)
+    writer.start()
+    view.update()
+    writer.join()
+    assert view.predictions.text == 'beat 11 at frame 240000.0 (+750.0 ms)'
@@ -0,0 +1,103 @@
+"""
+Events of the BeatScheduler of a client following a simulated master: the offset each callback
+is given, cancelled events, events missed by a locate past them and events kept while the
+transport is stopped.
+"""
+import threading
+import pytest
+
+pytest.importorskip('jack')
+from lib.jack.simulator import FakeClient, SimulatedTransport
+from lib.jack.timebase_client import PyJackTimebaseClient
+
+BLOCKSIZE = 256
+# frames per beat at the simulated master's 120 bpm.
+WIDTH = 24000
+# beats after which the client's predictions have settled.
+SETTLED = 12
+
+
+def cycles_to(beat):
+    """
+    Returns the number of cycles after which the transport is past an absolute beat.
+    """
+    return (beat - 1) * WIDTH // BLOCKSIZE + 1
+
+
+class Recorder(object):
+    """
+    Schedules callbacks recording the position, the first frame of the cycle, the offset they
+    were called with and the frame the position was predicted at when they were called.
+    """
+    def __init__(self, repositions=None):
+        self.client = FakeClient(transport=SimulatedTransport(), blocksize=BLOCKSIZE,
+                                 repositions=repositions)
+        self.tclient = PyJackTimebaseClient(self.client, threading.Event())
+        self.scheduler = self.tclient.scheduler
+        self.calls = []
+
+    def at(self, position):
+        return self.scheduler.at(position, lambda offset: self.calls.append(
+            (position, self.tclient.pos.frame, offset, self.scheduler.frame_of(position))))
+
+
+def test_events_are_called_at_their_offset_in_order():
+    recorder = Recorder()
+    recorder.client.run(cycles_to(SETTLED))
+    positions = [21, 15, 18.5, 16, 24, 18]
+    for position in positions:
+        recorder.at(position)
+    recorder.client.run(cycles_to(25) - cycles_to(SETTLED))
+    calls = recorder.calls
+    assert [call[0] for call in calls] == sorted(positions)
+    for position, frame, offset, predicted in calls:
+        assert 0 <= offset < BLOCKSIZE
+        if position == int(position):
+            # the whole frame the beat is predicted to start in.
+            assert offset == predicted // 1 - frame
+        else:
+            assert abs(frame + offset - predicted) <= 1
+        assert abs(frame + offset - (position - 1) * WIDTH) <= 1
+    assert recorder.scheduler.dispatched == len(positions)
+    assert len(recorder.scheduler) == 0
+
+
+def test_cancelled_event_is_not_called():
+    recorder = Recorder()
+    cancelled = recorder.at(5)
+    recorder.at(5)
+    recorder.scheduler.cancel(cancelled)
+    recorder.client.run(cycles_to(6))
+    assert [call[0] for call in recorder.calls] == [5]
+    assert len(recorder.scheduler) == 0
+
+
+def test_locate_forwards_drops_events_missed_by_more_than_a_cycle():
+    # from beat 6 to a hundred frames after beat 20.5.
+    locate = int(19.5 * WIDTH) + 100
+    recorder = Recorder(repositions={cycles_to(6): locate})
+    for position in (8, 20.5, 24):
+        recorder.at(position)
+    recorder.client.run(cycles_to(25))
+    calls = recorder.calls
+    # beat 20.5 was a hundred frames before the cycle located to.
+    assert calls[0][:3] == (20.5, locate, 0)
+    assert calls[1][0] == 24
+    assert recorder.scheduler.missed == 1
+    assert recorder.scheduler.dispatched == 2
+
+
+def test_events_survive_a_stop():
+    recorder = Recorder()
+    client = recorder.client
+    recorder.at(16)
+    client.run(cycles_to(SETTLED))
+    client.transport_stop()
+    client.run(1000)
+    assert not recorder.calls and len(recorder.scheduler) == 1
+    client.transport_start()
+    client.run(cycles_to(17) - cycles_to(SETTLED))
+    [(position, frame, offset, predicted)] = recorder.calls
+    assert position == 16
+    assert offset == predicted // 1 - frame == 15 * WIDTH - frame
+    assert recorder.scheduler.missed == 0
@@ -0,0 +1,47 @@
+"""
+Publishing beat predictions through the shared state map and reading them back.
+"""
+from math import isnan
+import pytest
+
+from lib.shared_state import (SLOT_SEQUENCE, SharedStateError, SharedStatePublisher,
+                              SharedStateReader)
+
+
+def test_unpredicted_beats_read_as_nan(tmp_path):
+    path = str(tmp_path / 'state')
+    with SharedStatePublisher(path, beats=4) as publisher, SharedStateReader(path) as reader:
+        publisher.publish(1000, True, -2, 1, 23999.0, 24001.0,
+                          lambda beat: None if beat <= 0 else beat * 24000.0)
+        state = reader.read()
+    assert (state.frame, state.rolling, state.beat, state.segment) == (1000, True, -2, 1)
+    assert [isnan(frame) for frame in state.predictions] == [True, True, False, False]
+    assert state.predictions[2:] == (24000.0, 48000.0)
+
+
+def test_failed_prediction_keeps_last_state(tmp_path):
+    path = str(tmp_path / 'state')
+
+    def fail(beat):
+        raise ValueError(beat)
+
+    with SharedStatePublisher(path, beats=2) as publisher, SharedStateReader(path) as reader:
+        publisher.publish(1000, True, 1, 1, 0.0, 0.0, float)
+        before = reader.read()
+        with pytest.raises(ValueError):
+            publisher.publish(2000, True, 2, 1, 0.0, 0.0, fail)
+        assert reader.read() == before
+        publisher.publish(3000, True, 3, 1, 0.0, 0.0, float)
+        assert reader.read().frame == 3000
+
+
+def test_read_gives_up_on_a_write_that_never_ends(tmp_path):
+    path = str(tmp_path / 'state')
+    with SharedStatePublisher(path, beats=2) as publisher, \
+            SharedStateReader(path, timeout=0.01) as reader:
+        # a publisher that died in the middle of a write.
+        publisher._ints[SLOT_SEQUENCE] += 1
+        with pytest.raises(SharedStateError):
+            reader.read()
+        with pytest.raises(SharedStateError):
+            SharedStateReader(path, timeout=0.01)
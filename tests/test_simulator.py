@@ -0,0 +1,89 @@
+"""
+Each mode run for many cycles through a FakeClient, with blocksize changes and locates: the
+master's bars, beats and ticks against its tempo, and the client's beat predictions against the
+simulated master.
+"""
+import threading
+import pytest
+
+jack = pytest.importorskip('jack')
+from lib.jack.simulator import FakeClient, SimulatedTransport
+from lib.jack.timebase_client import PyJackTimebaseClient
+from lib.jack.timebase_master import PyJackTimebaseMaster
+from lib.stats import COUNTER_NAMES, CallbackStats
+from lib.telemetry import CLIENT_PREDICTION, MASTER_POSITION, TelemetryQueue
+
+CYCLES = 6000
+# frames per beat at 120 bpm.
+WIDTH = 24000
+
+
+def fake_client(**kwargs):
+    return FakeClient(blocksize=256, blocksize_changes={2000: 1024, 3000: 64},
+                      repositions={2500: 48000 * 7 + 5, 4000: 1234567}, **kwargs)
+
+
+def run(client, telemetry):
+    kinds = []
+    for _ in range(CYCLES):
+        client.cycle()
+        kinds.extend(kind for kind, _ in telemetry.drain())
+    return kinds
+
+
+def test_master():
+    client = fake_client()
+    telemetry = TelemetryQueue()
+    stats = CallbackStats()
+    master = PyJackTimebaseMaster(client, threading.Event(), telemetry=telemetry, stats=stats)
+    master.set_timebase_callback()
+    kinds = []
+    for _ in range(CYCLES):
+        client.cycle()
+        kinds.extend(kind for kind, _ in telemetry.drain())
+        pos = client.transport_query_struct()[1]
+        beats, remainder = divmod(pos.frame, WIDTH)
+        assert (pos.bar, pos.beat) == (beats // 4 + 1, beats % 4 + 1)
+        assert pos.tick == remainder * 1920 // WIDTH
+        assert pos.beats_per_minute == 120.0
+    assert kinds == [MASTER_POSITION] * CYCLES
+    assert stats.durations['process'].count == stats.durations['timebase'].count == CYCLES
+    # the reposition to the master's own position when it starts, and the two locates.
+    assert dict(zip(COUNTER_NAMES, stats.counters))['repositions'] == 3
+
+
+def test_client():
+    transport = SimulatedTransport(tempo_changes=[(48000 * 26, 128.0)], jitter=32, seed=1)
+    client = fake_client(transport=transport)
+    telemetry = TelemetryQueue()
+    stats = CallbackStats()
+    tclient = PyJackTimebaseClient(client, threading.Event(), telemetry=telemetry, stats=stats,
+                                   midi_clock=True)
+    kinds = run(client, telemetry)
+    assert kinds == [CLIENT_PREDICTION] * CYCLES
+    assert stats.durations['process'].count == CYCLES
+    assert dict(zip(COUNTER_NAMES, stats.counters))['repositions'] == 2
+    beat_state = tclient.beat_state
+    assert len(beat_state.fpb_segments) == 2
+    # the transport has passed the tempo change since the last locate.
+    beat = beat_state.beat_number_from_pos(tclient.pos) + 1
+    assert beat_state.segment_at_beat(beat).estimator.expected_width == pytest.approx(
+        48000 * 60 / 128.0)
+    assert abs(beat_state.predict_beat_frame(beat) - transport.frame_at(beat - 1)) <= 64
+    assert next(iter(client.midi_outports)).count > 0
+
+
+def test_allocations_exclude_the_measurement():
+    from lib.bench import CallbackAllocations, tracing_allocations
+
+    kept = []
+    empty = CallbackAllocations(lambda *args: None)
+    keeping = CallbackAllocations(lambda *args: kept.append(bytearray(1000)))
+    with tracing_allocations():
+        for _ in range(100):
+            empty(1, 2)
+            keeping(1, 2)
+    assert (empty.allocating_calls, empty.bytes_per_call(), empty.retained_bytes_per_call()) \
+        == (0, 0, 0)
+    assert keeping.allocating_calls == 100
+    assert 1000 < keeping.retained_bytes_per_call() < 1200
@@ -0,0 +1,24 @@
+"""
+The beat width the client publishes to its position snapshot.
+"""
+import threading
+import pytest
+
+pytest.importorskip('jack')
+from lib.jack.simulator import FakeClient, SimulatedTransport
+from lib.jack.timebase_client import PyJackTimebaseClient
+from lib.telemetry import SNAPSHOT_BEAT_WIDTH, SNAPSHOT_FIELDS, PositionSnapshot
+
+
+def test_published_width_follows_the_beat_line():
+    changes = [(48000 * 10, 140.0)]
+    client = FakeClient(transport=SimulatedTransport(jitter=16, seed=1, tempo_changes=changes),
+                        blocksize=256)
+    snapshot = PositionSnapshot()
+    tclient = PyJackTimebaseClient(client, threading.Event(), snapshot=snapshot)
+    values = [0.0] * SNAPSHOT_FIELDS
+    for _ in range(4000):
+        client.cycle()
+        snapshot.read_into(values)
+        line = tclient.beat_state.current_segment.beat_line()
+        assert values[SNAPSHOT_BEAT_WIDTH] == float(line.width)
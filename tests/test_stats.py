@@ -0,0 +1,147 @@
+"""
+Accuracy of the Histogram buckets and percentiles, the counters of CallbackStats as a client
+follows a simulated master, and the dumps of the StatsServer.
+"""
+import io
+import json
+import random
+import socket
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+
+from lib.stats import (COUNTER_NAMES, PERCENTILES, RECONNECTS, REPOSITIONS, CallbackStats,
+                       Histogram, StatsServer)
+
+# relative error of a value above the exact range, with the default 6 significant bits.
+ERROR = 2 ** -5
+
+
+def exact_percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(int(p / 100.0 * len(ordered) + 0.5), 1) - 1]
+
+
+def test_small_values_are_exact():
+    histogram = Histogram()
+    for value in range(64):
+        histogram.record(value)
+    assert histogram.count == 64 and histogram.max == 63
+    for p in (1, 50, 99, 100):
+        assert histogram.percentile(p) == exact_percentile(range(64), p)
+    assert histogram.mean() == pytest.approx(31.5)
+
+
+def test_buckets_cover_every_value_once():
+    histogram = Histogram(max_value=2 ** 20)
+    previous = -1
+    for index in range(histogram._max_index + 1):
+        low, high = histogram._bucket_bounds(index)
+        assert low == previous + 1 and low <= high
+        assert histogram._index(low) == histogram._index(high) == index
+        if low >= 64:
+            assert high - low < ERROR * low
+        previous = high
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_percentiles_are_within_a_bucket(seed):
+    rng = random.Random(seed)
+    values = [int(rng.lognormvariate(10, 2)) for _ in range(10000)]
+    histogram = Histogram()
+    for value in values:
+        histogram.record(value)
+    assert histogram.count == len(values) and histogram.max == max(values)
+    for p in PERCENTILES + (1, 100):
+        exact = exact_percentile(values, p)
+        assert exact <= histogram.percentile(p) <= exact * (1 + ERROR)
+    assert histogram.mean() == pytest.approx(sum(values) / len(values), rel=ERROR)
+
+
+def test_out_of_range_values_are_clamped():
+    histogram = Histogram(max_value=1000)
+    histogram.record(-5)
+    histogram.record(10 ** 9)
+    assert histogram.percentile(50) == 0
+    # counted in the last bucket, though the max is kept exactly.
+    assert 1000 <= histogram.percentile(100) <= 1000 * (1 + ERROR)
+    assert histogram.max == 10 ** 9
+    summary = histogram.summary(scale=1000.0)
+    assert summary['count'] == 2 and summary['max'] == 10 ** 6
+    histogram.reset()
+    assert histogram.count == histogram.max == histogram.percentile(99) == 0
+
+
+def test_counters_of_a_client():
+    pytest.importorskip('jack')
+    from lib.jack.simulator import FakeClient, SimulatedTransport
+    from lib.jack.timebase_client import PyJackTimebaseClient
+
+    stats = CallbackStats()
+    transport = SimulatedTransport(tempo_changes=[(48000 * 10, 90.0), (48000 * 20, 140.0)])
+    client = FakeClient(transport=transport, blocksize=256,
+                        repositions={2500: 0, 3000: 48000 * 30})
+    stats.attach(client)
+    PyJackTimebaseClient(client, threading.Event(), stats=stats)
+    client.run(48000 * 25 // 256)
+    client.xrun(1500.0)
+    client.xrun(250.0)
+    counters = dict(zip(COUNTER_NAMES, stats.counters))
+    assert counters['repositions'] == 2
+    # into the 90 bpm segment, back to the first at the locate to frame 0, then past the 90 bpm
+    # segment straight into a new one for 140 bpm.
+    assert counters['segment_changes'] == 3
+    assert counters['xruns'] == 2
+    assert stats.xrun_delay.count == 2 and stats.xrun_delay.max == 1500
+    assert stats.durations['process'].count == client.cycle_count
+
+
+def test_dump():
+    stats = CallbackStats()
+    timed = stats.timed('process', lambda seconds: time.sleep(seconds))
+    timed(0.002)
+    stats.count(RECONNECTS)
+    stats.downtime.record(120)
+    stats.sample_load(SimpleNamespace(cpu_load=lambda: 12.5))
+    dump = json.loads(json.dumps(stats.dump()))
+    process = dump['callbacks']['process']
+    assert process['count'] == 1
+    # microseconds.
+    assert 2000 <= process['max'] < 2000 + 1e6
+    assert dump['dsp_load']['max'] == 12.5
+    assert dump['downtime']['p50'] == 120
+    assert dump['counters'] == {'repositions': 0, 'segment_changes': 0, 'xruns': 0,
+                                'reconnects': 1}
+    assert dump['uptime'] >= 0
+
+
+def test_server_dumps_on_request_and_to_its_socket(tmp_path):
+    stats = CallbackStats()
+    stats.count(REPOSITIONS)
+    output = io.StringIO()
+    path = str(tmp_path / 'stats')
+    server = StatsServer(stats, SimpleNamespace(cpu_load=lambda: 50.0), output=output,
+                         socket_path=path, rate=100.0)
+    server.start()
+    try:
+        server.request_dump()
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(5.0)
+        connection.connect(path)
+        with connection:
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = connection.recv(65536)
+                assert chunk
+                data += chunk
+        served = json.loads(data)
+        assert served['counters']['repositions'] == 1
+        assert served['dsp_load']['count'] >= 1
+        deadline = time.monotonic() + 5.0
+        while not output.getvalue():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        server.stop()
+    assert json.loads(output.getvalue())['counters']['repositions'] == 1
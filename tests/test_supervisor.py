@@ -0,0 +1,93 @@
+"""
+Reconnects of the supervisor in daemon mode: waiting for a timebase master's position before
+creating a client, and retrying a mode that cannot be created.
+"""
+import threading
+import time
+import pytest
+
+pytest.importorskip('jack')
+from lib.jack.simulator import FakeClient
+from lib.jack.timebase_client import PyJackTimebaseClient
+from lib.stats import CallbackStats
+from lib.supervisor import Supervisor
+
+
+class FakeSupervisor(Supervisor):
+    """
+    Supervisor connecting to FakeClients.
+    """
+    def __init__(self, mode, clients):
+        super(FakeSupervisor, self).__init__('jacktime', mode, {}, CallbackStats(),
+                                             threading.Event(), daemon=True, backoff=0.01,
+                                             log=None, poll_interval=0.01)
+        self.clients = clients
+        self.connected = []
+
+    def connect(self):
+        client = self.clients.pop(0)
+        self.connected.append(client)
+        return client
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_client_waits_for_a_tempo():
+    created = []
+
+    class Client(PyJackTimebaseClient):
+        def __init__(self, *args, **kwargs):
+            super(Client, self).__init__(*args, **kwargs)
+            created.append(self)
+
+    # a restarted server, before a timebase master has set the tempo.
+    restarted = FakeClient()
+    restarted._position.beats_per_minute = 0.0
+    supervisor = FakeSupervisor(Client, [FakeClient(), restarted, FakeClient()])
+    runner = threading.Thread(target=supervisor.run)
+    runner.start()
+    try:
+        wait_for(lambda: created)
+        created[0].client.run(2000)
+        created[0].client.shutdown()
+        wait_for(lambda: len(supervisor.connected) == 2)
+        time.sleep(0.1)
+        assert len(created) == 1
+        restarted._position.beats_per_minute = 120.0
+        wait_for(lambda: len(created) == 2)
+        assert created[1].client is restarted
+        # restored from the first client, rather than rejected for the tempo of 0.
+        assert created[1].saved_state().beats == created[0].saved_state().beats
+    finally:
+        supervisor.stop()
+        runner.join()
+
+
+def test_mode_failure_is_retried():
+    created = []
+
+    class Mode(object):
+        ready_at = None
+
+        def __init__(self, client, shutdownevent, stats=None):
+            if not created:
+                created.append(None)
+                raise ZeroDivisionError('first attempt')
+            created.append(self)
+
+    supervisor = FakeSupervisor(Mode, [FakeClient(), FakeClient()])
+    runner = threading.Thread(target=supervisor.run)
+    runner.start()
+    try:
+        wait_for(lambda: len(created) == 2)
+        assert not supervisor.connected[0].active
+        assert supervisor.connected[1].active
+    finally:
+        supervisor.stop()
+        runner.join()
+    assert not supervisor.connected[1].active
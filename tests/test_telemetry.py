@@ -0,0 +1,103 @@
+"""
+The TelemetryQueue ring across wraparound, when full and with a producer and consumer on two
+threads, and the lines the TelemetryReporter formats from it.
+"""
+import io
+import threading
+
+from lib.telemetry import (CLIENT_PREDICTION, MASTER_POSITION, RECORD_FIELDS, TelemetryQueue,
+                           TelemetryReporter)
+
+
+def test_capacity_is_a_power_of_two():
+    assert TelemetryQueue(1).capacity == 1
+    assert TelemetryQueue(5).capacity == 8
+    assert TelemetryQueue(1024).capacity == 1024
+
+
+def test_records_survive_wraparound():
+    queue = TelemetryQueue(4)
+    record = 0
+    for _ in range(10):
+        for _ in range(3):
+            assert queue.push(MASTER_POSITION, record, record + 0.5, 0, 0, 0, -record)
+            record += 1
+        assert len(queue) == 3
+        drained = list(queue.drain())
+        assert [kind for kind, _ in drained] == [MASTER_POSITION] * 3
+        assert [list(fields) for _, fields in drained] == [
+            [value, value + 0.5, 0, 0, 0, -value] for value in range(record - 3, record)]
+        assert len(queue) == 0
+    assert queue.dropped == 0
+
+
+def test_full_ring_drops_and_counts():
+    queue = TelemetryQueue(4)
+    pushed = [queue.push(CLIENT_PREDICTION, value) for value in range(6)]
+    assert pushed == [True] * 4 + [False] * 2
+    assert queue.dropped == 2 and len(queue) == 4
+    assert [fields[0] for _, fields in queue.drain()] == [0, 1, 2, 3]
+    assert queue.push(CLIENT_PREDICTION, 6)
+    assert [fields[0] for _, fields in queue.drain()] == [6]
+    assert queue.dropped == 2
+
+
+def test_producer_and_consumer_threads():
+    queue = TelemetryQueue(64)
+    count = 100000
+    received = []
+    done = threading.Event()
+
+    def consume():
+        while True:
+            finished = done.is_set()
+            for kind, fields in queue.drain():
+                assert kind == CLIENT_PREDICTION and len(fields) == RECORD_FIELDS
+                # every field of a record is written before it is published.
+                assert list(fields) == [fields[0]] * RECORD_FIELDS
+                received.append(fields[0])
+            if finished:
+                return
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    for value in range(count):
+        queue.push(CLIENT_PREDICTION, value, value, value, value, value, value)
+    done.set()
+    consumer.join()
+    assert received and received == sorted(set(received))
+    assert len(received) + queue.dropped == count
+
+
+def test_reporter_formats_records_and_drops():
+    queue = TelemetryQueue(2)
+    output = io.StringIO()
+    reporter = TelemetryReporter(queue, output=output)
+    queue.push(CLIENT_PREDICTION, 256, 5, 96000.25, 1, 23999, 24001)
+    queue.push(MASTER_POSITION, 512, 1, 2, 1, 960, 120)
+    queue.push(MASTER_POSITION, 768)
+    reporter.report()
+    assert output.getvalue().splitlines() == [
+        'frame 256: beat 5 predicted at frame 96000.2, tempo segment 1 fpb range (23999, 24001)',
+        'frame 512: state 1 bar 2 beat 1 tick 960 bpm 120.00',
+        'telemetry: 1 records dropped']
+    reporter.report()
+    assert len(output.getvalue().splitlines()) == 3
+
+
+def test_reporter_without_output_drains():
+    queue = TelemetryQueue(2)
+    reporter = TelemetryReporter(queue, output=None)
+    queue.push(CLIENT_PREDICTION)
+    reporter.report()
+    assert len(queue) == 0
+
+
+def test_reporter_thread_drains_on_stop():
+    queue = TelemetryQueue(8)
+    output = io.StringIO()
+    reporter = TelemetryReporter(queue, output=output, rate=0.01)
+    reporter.start()
+    queue.push(MASTER_POSITION, 1024, 1, 1, 1, 0, 90)
+    reporter.stop()
+    assert output.getvalue() == 'frame 1024: state 1 bar 1 beat 1 tick 0 bpm 90.00\n'
@@ -0,0 +1,193 @@
+"""
+Changes of tempo, meter, sample rate and tick resolution seen by BeatStateMachine: the beat the
+new tempo segment starts at, the numbering of bars and beats across a meter change, and the fpb
+range of the segment before the change, which later beats no longer narrow. The range of a
+segment whose beats are not a whole number of frames wide is rounded outwards, so it always
+holds the true width.
+"""
+from fractions import Fraction
+from math import ceil
+from types import SimpleNamespace
+import pytest
+
+jack = pytest.importorskip('jack')
+from lib.jack.frames import frames_per_beat, frames_per_tick
+from lib.jack.timebase_client import BeatStateMachine
+
+BLOCKSIZE = 256
+
+
+class Master(object):
+    """
+    A timebase master whose beats fall exactly a tempo's frames per beat apart. Each beat is
+    reported in the first cycle after it starts, with the tick reached at the cycle's first
+    frame, as PyJackTimebaseClient.process sees it.
+    """
+    def __init__(self, frame_rate=48000, beats_per_minute=120.0, beats_per_bar=4,
+                 ticks_per_beat=1920.0):
+        self.tempo = dict(frame_rate=frame_rate, beats_per_minute=beats_per_minute,
+                          beats_per_bar=beats_per_bar, beat_type=4,
+                          ticks_per_beat=ticks_per_beat)
+        # exact frame and bar and beat of the next beat.
+        self.frame = Fraction(0)
+        self.bar = 1
+        self.beat = 1
+        self.beat_state = None
+        self.beat_number = None
+
+    @property
+    def fpb(self):
+        return frames_per_beat(self.tempo['frame_rate'], self.tempo['beats_per_minute'])
+
+    def ticks(self, frames):
+        """
+        Returns the ticks the master reaches in frames at the current tempo.
+        """
+        numerator, denominator = frames_per_tick(self.tempo['frame_rate'],
+                                                 self.tempo['beats_per_minute'],
+                                                 self.tempo['ticks_per_beat'])
+        return frames * denominator / numerator
+
+    def position(self, frame, bar, beat, ticks):
+        return SimpleNamespace(frame=frame, bar=bar, beat=beat, tick=int(ticks),
+                               bar_start_tick=0.0, valid=jack._lib.JackPositionBBT,
+                               bbt_offset=0, **self.tempo)
+
+    def play(self, beats):
+        """
+        Reports the next beats.
+        """
+        for _ in range(beats):
+            frame = int(ceil(self.frame / BLOCKSIZE)) * BLOCKSIZE
+            pos = self.position(frame, self.bar, self.beat, self.ticks(frame - self.frame))
+            beat_state = self.beat_state
+            if beat_state is None:
+                self.beat_state = BeatStateMachine(pos, BLOCKSIZE)
+            else:
+                if beat_state.tempo_changed(pos):
+                    beat_state.record_tempo_change(pos, self.beat_number + 1, True)
+                beat_state.record_beat(pos, BLOCKSIZE)
+            self.beat_number = self.beat_state.beat_number_from_pos(pos)
+            self.frame += self.fpb
+            self.beat += 1
+            if self.beat > self.tempo['beats_per_bar']:
+                self.bar += 1
+                self.beat = 1
+
+    def change(self, phase=0, **tempo):
+        """
+        Changes the tempo phase of the way through the last beat played, reporting the change in
+        the cycle after it if phase is above 0.
+        :param phase: Fraction of a beat
+        """
+        beat_frame = self.frame - self.fpb
+        frame = beat_frame + self.fpb * phase
+        bar, beat = (self.bar, self.beat - 1) if self.beat > 1 else (self.bar - 1,
+                                                                     self.tempo['beats_per_bar'])
+        self.tempo.update(tempo)
+        self.frame = frame + self.fpb * (1 - phase)
+        if phase:
+            cycle = int(ceil(frame / BLOCKSIZE)) * BLOCKSIZE
+            ticks = phase * self.tempo['ticks_per_beat'] + self.ticks(cycle - frame)
+            pos = self.position(cycle, bar, beat, ticks)
+            assert self.beat_state.tempo_changed(pos)
+            self.beat_state.record_tempo_change(pos, self.beat_number, False)
+
+
+def learned(master, beats=24):
+    master.play(beats)
+    return master.beat_state.current_segment
+
+
+def assert_frozen(master, segment, beats=24):
+    fpb = segment.fpb
+    end_beat = segment.end_beat
+    master.play(beats)
+    assert segment.fpb == fpb and segment.end_beat == end_beat
+
+
+def test_bpm_change_at_a_beat_in_the_middle_of_a_bar():
+    master = Master()
+    segment = learned(master, 22)
+    # the third beat of bar 6, beat 23, starts at 90 bpm.
+    master.change(beats_per_minute=90.0)
+    master.play(1)
+    current = master.beat_state.current_segment
+    assert current is not segment
+    assert current.start_beat == 23 and segment.end_beat == 22
+    assert_frozen(master, segment)
+    low, high = current.fpb
+    assert low <= frames_per_beat(48000, 90.0) <= high <= low + 2
+
+
+def test_bpm_change_within_a_beat_starts_a_segment_at_the_next():
+    master = Master()
+    segment = learned(master, 22)
+    # a quarter of the way through beat 22.
+    master.change(Fraction(1, 4), beats_per_minute=90.0)
+    current = master.beat_state.current_segment
+    assert current.start_beat == 23 and segment.end_beat == 22
+    start = master.frame
+    # estimated from the tick, truncated by the master, until beat 23 is recorded.
+    assert abs(current.start_frame - start) <= master.fpb / master.tempo['ticks_per_beat']
+    assert_frozen(master, segment)
+    window_start, window_end = current.start_window
+    assert window_start <= start < window_end
+
+
+def test_meter_change_numbers_beats_on():
+    master = Master()
+    segment = learned(master, 24)
+    # bar 7 is the first bar in 3/4.
+    master.change(beats_per_bar=3)
+    master.play(1)
+    beat_state = master.beat_state
+    current = beat_state.current_segment
+    assert current.start_beat == 25 and segment.end_beat == 24
+    assert beat_state.beat_number_from_bbt(6, 4) == 24
+    assert beat_state.beat_number_from_bbt(7, 1) == 25
+    assert beat_state.beat_number_from_bbt(8, 1) == 28
+    assert [beat for beat in range(20, 32) if beat_state.is_first_beat_of_bar(beat)] == [
+        21, 25, 28, 31]
+    assert_frozen(master, segment)
+    assert master.beat_number == 25 + 24
+
+
+def test_sample_rate_change_starts_a_segment():
+    master = Master()
+    segment = learned(master)
+    master.change(frame_rate=44100)
+    master.play(1)
+    current = master.beat_state.current_segment
+    assert current.start_beat == 25 and segment.end_beat == 24
+    assert_frozen(master, segment)
+    low, high = current.fpb
+    assert low <= frames_per_beat(44100, 120.0) <= high
+
+
+def test_tick_resolution_change_keeps_the_segment():
+    master = Master()
+    segment = learned(master)
+    fpb = segment.fpb
+    # only beat windows depend on the tick resolution.
+    master.change(ticks_per_beat=960.0)
+    master.play(1)
+    assert master.beat_state.current_segment is segment
+    assert segment.start_beat == 1 and segment.end_beat is None
+    master.play(24)
+    assert fpb[0] <= segment.fpb[0] <= 24000 <= segment.fpb[1] <= fpb[1]
+
+
+@pytest.mark.parametrize('frame_rate, beats_per_minute', [(44100, 97.0), (48000, 93.7),
+                                                          (96000, 174.0)])
+def test_range_of_a_fractional_width_holds_it(frame_rate, beats_per_minute):
+    master = Master()
+    learned(master, 6)
+    master.change(frame_rate=frame_rate, beats_per_minute=beats_per_minute)
+    fpb = master.fpb
+    assert fpb.denominator > 1
+    for _ in range(64):
+        master.play(1)
+        low, high = master.beat_state.current_segment.fpb
+        assert low <= fpb <= high
+    assert high - low <= 2
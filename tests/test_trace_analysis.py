@@ -0,0 +1,110 @@
+"""
+Trace analysis of an empty trace and of a tempo ramp with a tempo segment every few beats, and
+the round trip of a recorded transport through load_trace.
+"""
+import threading
+import numpy as np
+import pytest
+
+from lib.jack.trace import RECORD, RECORD_FIELDS, TraceWriter
+from lib.jack.trace_analysis import (POSITION_BBT, RECORD_DTYPE, ROLLING, analyze, load_trace,
+                                     report)
+
+FRAME_RATE = 48000
+
+
+def test_empty_trace(tmp_path):
+    path = str(tmp_path / 'trace')
+    TraceWriter(path, 0, FRAME_RATE).close()
+    analysis = analyze(*load_trace(path))
+    assert analysis['cycles'] == analysis['beats'] == 0
+    assert analysis['segments'] == analysis['repositions'] == []
+    assert analysis['widths'].size == analysis['skew'].size == 0
+    assert report(analysis).startswith('0 cycles')
+
+
+def ramp(cycles, segment_cycles=50, blocksize=256, seed=1):
+    """
+    Returns the records of a master changing tempo every segment_cycles cycles and located
+    forwards once, at cycle 2000.
+    """
+    rng = np.random.default_rng(seed)
+    records = np.zeros(cycles, RECORD_DTYPE)
+    bpm = np.repeat(rng.uniform(60.0, 180.0, cycles // segment_cycles + 1),
+                    segment_cycles)[:cycles]
+    frame = np.arange(cycles, dtype=np.int64) * blocksize
+    frame[2000:] += 48000
+    beats = np.concatenate(([0.0], np.cumsum(blocksize * bpm[:-1] / 60 / FRAME_RATE)))
+    beat = np.floor(beats).astype(np.int64)
+    records['frame'] = frame
+    records['nframes'] = blocksize
+    records['state'] = ROLLING
+    records['valid'] = POSITION_BBT
+    records['bar'] = beat // 4 + 1
+    records['beat'] = beat % 4 + 1
+    records['tick'] = (beats - beat) * 1920
+    records['beats_per_bar'] = 4
+    records['ticks_per_beat'] = 1920
+    records['beats_per_minute'] = bpm
+    records['bar_start_tick'] = (records['bar'] - 1) * 4 * 1920
+    return records
+
+
+def test_segment_statistics():
+    analysis = analyze(ramp(20000), FRAME_RATE)
+    segments = analysis['segments']
+    assert len(segments) == 400
+    assert [segment['cycle'] for segment in segments] == list(range(0, 20000, 50))
+    counts = [segment['beats'] for segment in segments]
+    assert sum(counts) == analysis['widths'].size
+    # widths are in cycle order, so each segment's widths follow the previous segment's.
+    splits = np.cumsum(counts)[:-1]
+    for segment, widths, skew in zip(segments, np.split(analysis['widths'], splits),
+                                     np.split(analysis['skew'], splits)):
+        assert segment['expected_width'] == pytest.approx(60.0 * FRAME_RATE
+                                                          / segment['beats_per_minute'])
+        if widths.size:
+            assert segment['mean_width'] == pytest.approx(widths.mean())
+            assert segment['width_sd'] == pytest.approx(widths.std(), abs=1e-6)
+            assert segment['mean_skew'] == pytest.approx(skew.mean())
+            assert segment['max_skew'] == pytest.approx(np.abs(skew).max())
+        else:
+            assert np.isnan([segment['mean_width'], segment['width_sd'], segment['mean_skew'],
+                             segment['max_skew']]).all()
+    assert analysis['repositions'] == [(2000, 1999 * 256, 2000 * 256 + 48000)]
+
+
+def test_recorded_transport_loads_field_for_field(tmp_path):
+    jack = pytest.importorskip('jack')
+    from lib.jack.simulator import FakeClient, SimulatedTransport
+    from lib.jack.trace import TransportRecorder
+
+    path = str(tmp_path / 'trace')
+    transport = SimulatedTransport(beats_per_minute=137.0, tempo_changes=[(96000, 91.0)])
+    client = FakeClient(transport=transport, blocksize=256, blocksize_changes={200: 128},
+                        repositions={300: 4800})
+    recorder = TransportRecorder(client, threading.Event(), trace=path, hours=0.01)
+    expected = []
+    record = client.process_callback
+
+    def process(nframes):
+        state, pos = client.transport_query_struct()
+        expected.append({field: getattr(pos, field, None) for field in RECORD_FIELDS})
+        expected[-1].update(nframes=nframes, state=state)
+        record(nframes)
+    client.set_process_callback(process)
+    client.run(400)
+    client.transport_stop()
+    client.run(10)
+    recorder.close()
+
+    records, frame_rate = load_trace(path)
+    assert frame_rate == client.samplerate
+    assert RECORD_DTYPE.itemsize == RECORD.size
+    assert RECORD_DTYPE.names == RECORD_FIELDS
+    assert len(records) == len(expected) == 410
+    for field in RECORD_FIELDS:
+        assert records[field].tolist() == [cycle[field] for cycle in expected], field
+    assert records['nframes'][199:201].tolist() == [256, 128]
+    assert records['frame'][300] == 4800
+    assert (records['state'][-10:] == jack.STOPPED).all()